@@ -0,0 +1,663 @@
+import calendar
+import contextlib
+import datetime
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# 열 형식(columnar) 출결 기록의 상태 문자 ('.'은 기록 없음)
+STATUS_CHARS = {"P": "present", "L": "late", "A": "absent"}
+NO_RECORD_CHAR = "."
+
+# 학생 기록은 서버가 정적 파일로 제공하는 저장소 폴더 밖에 저장 (AI_DATA_DIR 환경 변수로 변경)
+DATA_DIR = os.environ.get("AI_DATA_DIR") or os.path.join(os.path.expanduser("~"), ".attendance_ai")
+DEFAULT_DB_PATH = os.path.join(DATA_DIR, "attendance.db")
+
+DEFAULT_MAX_DATASETS = 100
+MAX_DECOMPRESSED_BYTES = 64 * 1024 * 1024  # 압축 해제 후 허용하는 최대 본문 크기
+DATASET_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+class AttendanceError(Exception):
+    """출결 데이터 요청을 처리할 수 없을 때 발생합니다. status_code는 HTTP 응답 코드입니다."""
+
+    status_code = 400
+
+
+class PayloadTooLargeError(AttendanceError):
+    """압축을 푼 요청 본문이 허용 크기를 넘을 때 발생합니다."""
+
+    status_code = 413
+
+
+class UnknownDatasetError(AttendanceError):
+    """서버에 없는 데이터셋을 참조할 때 발생합니다 (한도 초과로 제거됨, 메모리 저장소의 재시작 등).
+
+    클라이언트는 전체 데이터를 다시 올려야 합니다.
+    """
+
+    status_code = 404
+
+
+class SnapshotConflictError(AttendanceError):
+    """요청의 기준 버전이 서버의 현재 버전과 다를 때 발생합니다."""
+
+    status_code = 409
+
+    def __init__(self, message, current_version):
+        super().__init__(message)
+        self.current_version = current_version
+
+
+def decode_body(body, content_encoding=None):
+    """요청 본문을 (필요하면 gzip/deflate 압축을 풀고) 바이트로 반환합니다.
+
+    압축 해제 결과가 MAX_DECOMPRESSED_BYTES를 넘으면 PayloadTooLargeError를 발생시킵니다.
+    """
+    encoding = (content_encoding or "").strip().lower()
+    if encoding in ("", "identity"):
+        return body
+    if encoding not in ("gzip", "deflate"):
+        raise AttendanceError(f"지원하지 않는 Content-Encoding입니다: {content_encoding}")
+
+    # wbits=47: gzip과 zlib 헤더를 자동으로 구분
+    decompressor = zlib.decompressobj(wbits=47)
+    try:
+        data = decompressor.decompress(body, MAX_DECOMPRESSED_BYTES)
+    except zlib.error as e:
+        raise AttendanceError(f"압축된 본문을 풀 수 없습니다: {str(e)}")
+    if decompressor.unconsumed_tail:
+        raise PayloadTooLargeError(f"압축을 푼 본문이 {MAX_DECOMPRESSED_BYTES // 1024 ** 2}MB를 넘습니다.")
+    return data
+
+
+def decode_json(body, content_encoding=None):
+    """압축되었을 수 있는 JSON 요청 본문을 파싱합니다."""
+    try:
+        return json.loads(decode_body(body, content_encoding) or b"{}")
+    except ValueError as e:
+        raise AttendanceError(f"JSON 본문을 해석할 수 없습니다: {str(e)}")
+
+
+def expand_columnar(columns):
+    """열 형식의 출결 기록을 날짜별 기록({날짜: {학급: {학생 ID: 기록}}})으로 변환합니다.
+
+    학급마다 {"dates": [...], "student_ids": [...], "status": ["PPLA.", ...], "extra": [[행, 열, 기록], ...]}
+    형식이며, status의 각 문자열은 한 날짜의 학생별 상태 문자입니다. extra에는 사유나 메모가 있는 기록만 담습니다.
+    """
+    attendance = {}
+    for class_id, column in (columns or {}).items():
+        class_id = str(class_id)
+        dates = column.get("dates", [])
+        student_ids = [str(student_id) for student_id in column.get("student_ids", [])]
+        rows = column.get("status", [])
+        if len(rows) != len(dates):
+            raise AttendanceError(f"학급 {class_id}의 status 행 수({len(rows)})가 날짜 수({len(dates)})와 다릅니다.")
+
+        for date, line in zip(dates, rows):
+            if len(line) > len(student_ids):
+                raise AttendanceError(f"학급 {class_id}의 {date} 기록이 학생 수보다 깁니다.")
+            records = {}
+            for student_id, char in zip(student_ids, line):
+                if char == NO_RECORD_CHAR:
+                    continue
+                status = STATUS_CHARS.get(char)
+                if status is None:
+                    raise AttendanceError(f"알 수 없는 상태 문자입니다: {char}")
+                records[student_id] = {"status": status}
+            if records:
+                attendance.setdefault(date, {})[class_id] = records
+
+        for row, col, record in column.get("extra", []):
+            try:
+                date, student_id = dates[row], student_ids[col]
+            except (IndexError, TypeError):
+                raise AttendanceError(f"학급 {class_id}의 extra 위치가 범위를 벗어났습니다: {row}, {col}")
+            attendance.setdefault(date, {}).setdefault(class_id, {})[student_id] = record
+    return attendance
+
+
+def decode_attendance(data, students_key="students", attendance_key="attendance"):
+    """요청의 학생 목록과 출결 기록을 (students, attendance)로 반환합니다. 열 형식이면 날짜별 기록으로 변환합니다."""
+    students = data.get(students_key) or {}
+    attendance = data.get(attendance_key) or {}
+    if data.get("format") == "columnar":
+        attendance = expand_columnar(attendance)
+    return students, attendance
+
+
+def parse_period(period):
+    """{"from": "YYYY-MM-DD", "to": "YYYY-MM-DD"} 형식의 기간을 (start, end)로 반환합니다. 빠진 끝은 None입니다."""
+    if not period:
+        return None, None
+    if not isinstance(period, dict):
+        raise AttendanceError("period는 {\"from\": \"YYYY-MM-DD\", \"to\": \"YYYY-MM-DD\"} 형식이어야 합니다.")
+    start, end = period.get("from") or None, period.get("to") or None
+    for date in (start, end):
+        if date is not None:
+            _check_date(date)
+    if start and end and start > end:
+        raise AttendanceError(f"기간의 시작({start})이 끝({end})보다 늦습니다.")
+    return start, end
+
+
+def _check_date(date):
+    if not isinstance(date, str) or not DATE_PATTERN.match(date):
+        raise AttendanceError(f"날짜는 YYYY-MM-DD 형식이어야 합니다: {date}")
+    try:
+        datetime.date.fromisoformat(date)
+    except ValueError:
+        raise AttendanceError(f"존재하지 않는 날짜입니다: {date}")
+
+
+def _record_status(record):
+    """기록의 상태를 반환합니다. 상태가 없는 기록은 통계 탭과 같이 출석으로 봅니다."""
+    if record is not None and not isinstance(record, dict):
+        raise AttendanceError(f"출결 기록은 객체여야 합니다: {record}")
+    return str((record or {}).get("status", "present"))
+
+
+def _month_range(start, end):
+    """기간이 월 단위로 맞아떨어지면 (첫 달, 마지막 달)을, 아니면 None을 반환합니다. 열린 끝은 None입니다."""
+    if start is not None and not start.endswith("-01"):
+        return None
+    if end is not None:
+        year, month, day = (int(part) for part in end.split("-"))
+        if day != calendar.monthrange(year, month)[1]:
+            return None
+    return (start[:7] if start else None), (end[:7] if end else None)
+
+
+# 출결 기록과 학생 목록, 그리고 쓰기 때마다 트리거로 갱신되는 학생별 월간·요일 집계
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    dataset_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS classes (
+    dataset_id TEXT NOT NULL,
+    class_id TEXT NOT NULL,
+    students TEXT NOT NULL,
+    PRIMARY KEY (dataset_id, class_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS records (
+    dataset_id TEXT NOT NULL,
+    class_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    student_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    record TEXT NOT NULL,
+    PRIMARY KEY (dataset_id, class_id, date, student_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS records_by_student ON records (dataset_id, class_id, student_id, date);
+CREATE INDEX IF NOT EXISTS records_by_date ON records (dataset_id, date);
+CREATE TABLE IF NOT EXISTS class_days (
+    dataset_id TEXT NOT NULL,
+    class_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    records INTEGER NOT NULL,
+    PRIMARY KEY (dataset_id, class_id, date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS student_months (
+    dataset_id TEXT NOT NULL,
+    class_id TEXT NOT NULL,
+    student_id TEXT NOT NULL,
+    month TEXT NOT NULL,
+    recorded INTEGER NOT NULL,
+    present INTEGER NOT NULL,
+    late INTEGER NOT NULL,
+    absent INTEGER NOT NULL,
+    PRIMARY KEY (dataset_id, class_id, month, student_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS student_weekdays (
+    dataset_id TEXT NOT NULL,
+    class_id TEXT NOT NULL,
+    student_id TEXT NOT NULL,
+    month TEXT NOT NULL,
+    weekday INTEGER NOT NULL,
+    late INTEGER NOT NULL,
+    absent INTEGER NOT NULL,
+    PRIMARY KEY (dataset_id, class_id, month, student_id, weekday)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS records_insert AFTER INSERT ON records BEGIN
+    INSERT INTO class_days VALUES (NEW.dataset_id, NEW.class_id, NEW.date, 1)
+    ON CONFLICT (dataset_id, class_id, date) DO UPDATE SET records = records + 1;
+    INSERT INTO student_months VALUES (
+        NEW.dataset_id, NEW.class_id, NEW.student_id, substr(NEW.date, 1, 7),
+        NEW.status IN ('present', 'late', 'absent'), NEW.status = 'present',
+        NEW.status = 'late', NEW.status = 'absent')
+    ON CONFLICT (dataset_id, class_id, month, student_id) DO UPDATE SET
+        recorded = recorded + excluded.recorded, present = present + excluded.present,
+        late = late + excluded.late, absent = absent + excluded.absent;
+    -- strftime('%w')는 일요일이 0이므로 월요일이 0이 되도록 바꿈
+    INSERT INTO student_weekdays
+    SELECT NEW.dataset_id, NEW.class_id, NEW.student_id, substr(NEW.date, 1, 7),
+           (CAST(strftime('%w', NEW.date) AS INTEGER) + 6) % 7, NEW.status = 'late', NEW.status = 'absent'
+    WHERE NEW.status IN ('late', 'absent')
+    ON CONFLICT (dataset_id, class_id, month, student_id, weekday) DO UPDATE SET
+        late = late + excluded.late, absent = absent + excluded.absent;
+END;
+
+CREATE TRIGGER IF NOT EXISTS records_delete AFTER DELETE ON records BEGIN
+    UPDATE class_days SET records = records - 1
+    WHERE dataset_id = OLD.dataset_id AND class_id = OLD.class_id AND date = OLD.date;
+    DELETE FROM class_days
+    WHERE dataset_id = OLD.dataset_id AND class_id = OLD.class_id AND date = OLD.date AND records <= 0;
+    UPDATE student_months SET
+        recorded = recorded - (OLD.status IN ('present', 'late', 'absent')),
+        present = present - (OLD.status = 'present'),
+        late = late - (OLD.status = 'late'), absent = absent - (OLD.status = 'absent')
+    WHERE dataset_id = OLD.dataset_id AND class_id = OLD.class_id AND month = substr(OLD.date, 1, 7)
+          AND student_id = OLD.student_id;
+    DELETE FROM student_months
+    WHERE dataset_id = OLD.dataset_id AND class_id = OLD.class_id AND month = substr(OLD.date, 1, 7)
+          AND student_id = OLD.student_id AND recorded <= 0;
+    UPDATE student_weekdays SET late = late - (OLD.status = 'late'), absent = absent - (OLD.status = 'absent')
+    WHERE dataset_id = OLD.dataset_id AND class_id = OLD.class_id AND month = substr(OLD.date, 1, 7)
+          AND student_id = OLD.student_id AND weekday = (CAST(strftime('%w', OLD.date) AS INTEGER) + 6) % 7;
+    DELETE FROM student_weekdays
+    WHERE dataset_id = OLD.dataset_id AND class_id = OLD.class_id AND month = substr(OLD.date, 1, 7)
+          AND student_id = OLD.student_id AND weekday = (CAST(strftime('%w', OLD.date) AS INTEGER) + 6) % 7
+          AND late <= 0 AND absent <= 0;
+END;
+"""
+
+
+class AttendanceSnapshot:
+    """저장소에 있는 한 데이터셋의 특정 버전을 가리킵니다.
+
+    통계는 저장소의 집계에서 읽으며, 그사이 데이터셋이 바뀌었으면 SnapshotConflictError를 발생시킵니다.
+    """
+
+    def __init__(self, store, dataset_id, version, updated_at):
+        self.store = store
+        self.dataset_id = dataset_id
+        self.version = version
+        self.updated_at = updated_at
+
+    def summarize(self, class_ids=None, start=None, end=None):
+        """학급별 통계와 요약 텍스트를 반환합니다. start/end(YYYY-MM-DD)로 기간을 제한할 수 있습니다."""
+        return self.store.summarize(self.dataset_id, class_ids, start, end, version=self.version)
+
+    def to_dict(self):
+        return dict(self.store.describe(self.dataset_id), version=self.version, updated_at=self.updated_at)
+
+
+class AttendanceStore:
+    """버전이 붙은 출결 데이터셋을 내장 SQLite 데이터베이스에 보관합니다.
+
+    클라이언트는 처음 한 번 전체 데이터를 올리고, 이후에는 기준 버전과 바뀐 부분(delta)만 보냅니다.
+    채팅/분석 요청은 원본 데이터 대신 {"dataset": {"id": ..., "version": ...}}로 데이터셋을 참조합니다.
+
+    출결 기록은 학급·날짜, 학생, 날짜 순 인덱스로 조회하고, 학생별 월간·요일 건수는 기록을 쓸 때
+    트리거로 갱신되므로 통계를 요청마다 원본 기록에서 다시 계산하지 않습니다.
+    path가 None이면 메모리에만 보관하며, 파일에 보관하면 서버를 재시작해도 데이터셋이 유지됩니다.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, max_datasets=DEFAULT_MAX_DATASETS):
+        self.path = path
+        self.max_datasets = max_datasets
+
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._full_uploads = 0
+        self._delta_updates = 0
+        self._conflicts = 0
+
+    def put(self, dataset_id, students, attendance):
+        """데이터셋 전체를 새 버전으로 교체하고 스냅샷을 반환합니다."""
+        self._check_id(dataset_id)
+        rows = list(self._record_rows(dataset_id, attendance or {}))
+        with self._lock, self._transaction():
+            current = self._version(dataset_id)
+            self._delete_dataset(dataset_id)
+            self._db.executemany(
+                "INSERT INTO classes VALUES (?, ?, ?)",
+                [(dataset_id, str(class_id), json.dumps(student_list, ensure_ascii=False))
+                 for class_id, student_list in (students or {}).items() if student_list is not None]
+            )
+            self._db.executemany("INSERT INTO records VALUES (?, ?, ?, ?, ?, ?)", rows)
+            snapshot = self._bump(dataset_id, (current or 0) + 1)
+            self._evict()
+            self._full_uploads += 1
+        logger.info(f"출결 데이터셋 전체 업로드: {dataset_id} v{snapshot.version} (기록 {len(rows)}건)")
+        return snapshot
+
+    def apply_delta(self, dataset_id, base_version, delta):
+        """기준 버전에 바뀐 부분을 적용한 새 버전을 만들고 스냅샷을 반환합니다.
+
+        delta는 {"students": {학급: 학생 목록 또는 null}, "attendance": {날짜: {학급: {학생 ID: 기록 또는 null}}}}
+        형식이며 null은 삭제를 뜻합니다 (날짜나 학급 단위 null은 그 아래 기록 전체 삭제).
+        base_version이 현재 버전과 다르면 SnapshotConflictError를 발생시킵니다.
+        """
+        with self._lock, self._transaction():
+            current = self._version(dataset_id)
+            if current is None:
+                raise UnknownDatasetError(f"알 수 없는 데이터셋입니다: {dataset_id}")
+            if current != base_version:
+                self._conflicts += 1
+                raise SnapshotConflictError(
+                    f"기준 버전({base_version})이 현재 버전({current})과 다릅니다.", current)
+
+            for class_id, student_list in (delta.get("students") or {}).items():
+                if student_list is None:
+                    self._db.execute("DELETE FROM classes WHERE dataset_id = ? AND class_id = ?",
+                                     (dataset_id, str(class_id)))
+                else:
+                    self._db.execute(
+                        "INSERT INTO classes VALUES (?, ?, ?) "
+                        "ON CONFLICT (dataset_id, class_id) DO UPDATE SET students = excluded.students",
+                        (dataset_id, str(class_id), json.dumps(student_list, ensure_ascii=False))
+                    )
+
+            # 바뀐 기록은 지웠다가 다시 넣어 삭제/추가 트리거만으로 집계가 맞게 유지되도록 함
+            for date, classes in (delta.get("attendance") or {}).items():
+                _check_date(date)
+                if classes is None:
+                    self._db.execute("DELETE FROM records WHERE dataset_id = ? AND date = ?", (dataset_id, date))
+                    continue
+                for class_id, records in classes.items():
+                    class_id = str(class_id)
+                    if records is None:
+                        self._db.execute("DELETE FROM records WHERE dataset_id = ? AND class_id = ? AND date = ?",
+                                         (dataset_id, class_id, date))
+                        continue
+                    for student_id, record in records.items():
+                        self._db.execute(
+                            "DELETE FROM records WHERE dataset_id = ? AND class_id = ? AND date = ? AND student_id = ?",
+                            (dataset_id, class_id, date, str(student_id))
+                        )
+                        if record is not None:
+                            self._db.execute("INSERT INTO records VALUES (?, ?, ?, ?, ?, ?)",
+                                             self._record_row(dataset_id, date, class_id, student_id, record))
+
+            snapshot = self._bump(dataset_id, current + 1)
+            self._delta_updates += 1
+        return snapshot
+
+    def get(self, dataset_id, version=None):
+        """스냅샷을 반환합니다. version이 주어졌는데 현재 버전과 다르면 SnapshotConflictError를 발생시킵니다."""
+        with self._lock:
+            row = self._db.execute("SELECT version, updated_at FROM datasets WHERE dataset_id = ?",
+                                   (str(dataset_id),)).fetchone()
+            if row is None:
+                raise UnknownDatasetError(f"알 수 없는 데이터셋입니다: {dataset_id}")
+            if version is not None and row[0] != version:
+                self._conflicts += 1
+                raise SnapshotConflictError(f"요청한 버전({version})이 현재 버전({row[0]})과 다릅니다.", row[0])
+        return AttendanceSnapshot(self, dataset_id, row[0], row[1])
+
+    def describe(self, dataset_id):
+        """데이터셋의 학급, 학생 수, 기록된 날짜 수를 반환합니다."""
+        with self._lock:
+            classes = self._db.execute(
+                "SELECT class_id, json_array_length(students) FROM classes WHERE dataset_id = ? ORDER BY class_id",
+                (dataset_id,)
+            ).fetchall()
+            day_count = self._db.execute("SELECT COUNT(DISTINCT date) FROM class_days WHERE dataset_id = ?",
+                                         (dataset_id,)).fetchone()[0]
+        return {
+            "dataset_id": dataset_id,
+            "classes": [class_id for class_id, _ in classes],
+            "student_count": sum(count or 0 for _, count in classes),
+            "day_count": day_count
+        }
+
+    def query_records(self, dataset_id, class_id=None, student_id=None, start=None, end=None, status=None,
+                      limit=None):
+        """조건에 맞는 출결 기록을 날짜순으로 반환합니다: [{"date", "class_id", "student_id", "status", ...}].
+
+        예를 들어 class_id="1", start="2024-03-01", end="2024-03-31", status="absent"는
+        1반의 3월 결석 기록입니다. 조건은 인덱스로 조회하므로 데이터셋 크기와 무관하게 해당 구간만 읽습니다.
+        """
+        conditions, params = ["dataset_id = ?"], [dataset_id]
+        for column, operator, value in (("class_id", "=", class_id), ("student_id", "=", student_id),
+                                        ("date", ">=", start), ("date", "<=", end), ("status", "=", status)):
+            if value is not None:
+                conditions.append(f"{column} {operator} ?")
+                params.append(str(value))
+        sql = (f"SELECT date, class_id, student_id, status, record FROM records "
+               f"WHERE {' AND '.join(conditions)} ORDER BY date, class_id, student_id")
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+
+        with self._lock:
+            self._require(dataset_id)
+            rows = self._db.execute(sql, params).fetchall()
+        return [
+            dict(json.loads(record), date=date, class_id=class_id, student_id=student_id, status=status)
+            for date, class_id, student_id, status, record in rows
+        ]
+
+    def summarize(self, dataset_id, class_ids=None, start=None, end=None, version=None, top_k=None):
+        """학급별 통계와 요약 텍스트를 반환합니다.
+
+        기간이 없거나 월 단위로 맞아떨어지면 미리 집계된 학생별 월간·요일 건수만 읽고,
+        그 밖의 기간은 해당 구간의 기록만 인덱스로 읽어 계산합니다.
+        class_ids를 지정하지 않으면 학생이 등록된 모든 학급을 요약합니다.
+        """
+        from ai_stats import DEFAULT_TOP_K, compute_class_stats, summarize_class_stats
+
+        months = _month_range(start, end)
+        with self._lock:
+            current = self._require(dataset_id)
+            if version is not None and current != version:
+                self._conflicts += 1
+                raise SnapshotConflictError(f"요청한 버전({version})이 현재 버전({current})과 다릅니다.", current)
+
+            students = {
+                class_id: json.loads(student_list)
+                for class_id, student_list in self._db.execute(
+                    "SELECT class_id, students FROM classes WHERE dataset_id = ?", (dataset_id,))
+            }
+            if class_ids is None:
+                class_ids = sorted(class_id for class_id, student_list in students.items() if student_list)
+
+            all_stats = []
+            for class_id in class_ids:
+                class_id = str(class_id)
+                if months is not None:
+                    all_stats.append(self._aggregate_stats(dataset_id, class_id, students.get(class_id) or [],
+                                                           start, end, *months))
+                else:
+                    attendance = self._range_attendance(dataset_id, class_id, start, end)
+                    all_stats.append(compute_class_stats(students, attendance, class_id))
+
+        summary = "\n\n".join(summarize_class_stats(stats, top_k or DEFAULT_TOP_K) for stats in all_stats)
+        return all_stats, summary
+
+    def stats(self):
+        with self._lock:
+            datasets, records = self._db.execute(
+                "SELECT (SELECT COUNT(*) FROM datasets), (SELECT COUNT(*) FROM records)").fetchone()
+            return {
+                "path": self.path,
+                "datasets": datasets,
+                "records": records,
+                "max_datasets": self.max_datasets,
+                "full_uploads": self._full_uploads,
+                "delta_updates": self._delta_updates,
+                "conflicts": self._conflicts
+            }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _aggregate_stats(self, dataset_id, class_id, student_list, start, end, first_month, last_month):
+        """집계 테이블에서 학급 통계를 만듭니다. _lock을 잡은 상태에서 호출합니다."""
+        import numpy as np
+        from ai_stats import COUNT_FIELDS, class_stats_from_counts
+
+        day_range, day_params = self._range_condition("date", start, end)
+        day_count, first_date, last_date = self._db.execute(
+            f"SELECT COUNT(*), MIN(date), MAX(date) FROM class_days "
+            f"WHERE dataset_id = ? AND class_id = ?{day_range}", (dataset_id, class_id, *day_params)
+        ).fetchone()
+        months = [month for month, in self._db.execute(
+            f"SELECT DISTINCT substr(date, 1, 7) FROM class_days "
+            f"WHERE dataset_id = ? AND class_id = ?{day_range} ORDER BY 1", (dataset_id, class_id, *day_params))]
+
+        # 같은 ID가 여러 번 있으면 build_status_matrix와 같이 마지막 학생에게 기록을 모음
+        column = {str(student.get("id")): index for index, student in enumerate(student_list)}
+        month_index = {month: index for index, month in enumerate(months)}
+        month_counts = np.zeros((len(months), COUNT_FIELDS, len(student_list)), dtype=np.int64)
+        weekday_counts = np.zeros((7, 2, len(student_list)), dtype=np.int64)
+
+        month_range, month_params = self._range_condition("month", first_month, last_month)
+        for student_id, month, *counts in self._db.execute(
+                f"SELECT student_id, month, recorded, present, late, absent FROM student_months "
+                f"WHERE dataset_id = ? AND class_id = ?{month_range}", (dataset_id, class_id, *month_params)):
+            if student_id in column and month in month_index:
+                month_counts[month_index[month], :, column[student_id]] = counts
+        for student_id, weekday, late, absent in self._db.execute(
+                f"SELECT student_id, weekday, SUM(late), SUM(absent) FROM student_weekdays "
+                f"WHERE dataset_id = ? AND class_id = ?{month_range} GROUP BY student_id, weekday",
+                (dataset_id, class_id, *month_params)):
+            if student_id in column:
+                weekday_counts[weekday, :, column[student_id]] = (late, absent)
+
+        return class_stats_from_counts(class_id, student_list, day_count, first_date, last_date, months,
+                                       month_counts, weekday_counts)
+
+    def _range_attendance(self, dataset_id, class_id, start, end):
+        """학급의 기간 내 기록을 날짜별 기록({날짜: {학급: {학생 ID: 기록}}})으로 읽습니다. _lock을 잡은 상태에서 호출합니다."""
+        day_range, day_params = self._range_condition("date", start, end)
+        attendance = {}
+        for date, student_id, record in self._db.execute(
+                f"SELECT date, student_id, record FROM records WHERE dataset_id = ? AND class_id = ?{day_range}",
+                (dataset_id, class_id, *day_params)):
+            attendance.setdefault(date, {}).setdefault(class_id, {})[student_id] = json.loads(record)
+        return attendance
+
+    @staticmethod
+    def _range_condition(column, start, end):
+        conditions, params = "", []
+        if start is not None:
+            conditions += f" AND {column} >= ?"
+            params.append(start)
+        if end is not None:
+            conditions += f" AND {column} <= ?"
+            params.append(end)
+        return conditions, params
+
+    def _record_rows(self, dataset_id, attendance):
+        for date, classes in attendance.items():
+            _check_date(date)
+            for class_id, records in (classes or {}).items():
+                for student_id, record in (records or {}).items():
+                    yield self._record_row(dataset_id, date, class_id, student_id, record)
+
+    @staticmethod
+    def _record_row(dataset_id, date, class_id, student_id, record):
+        status = _record_status(record)
+        return (dataset_id, str(class_id), date, str(student_id), status,
+                json.dumps(record or {}, ensure_ascii=False))
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """쓰기를 하나의 트랜잭션으로 묶고 예외가 나면 되돌립니다. _lock을 잡은 상태에서 사용합니다."""
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def _version(self, dataset_id):
+        row = self._db.execute("SELECT version FROM datasets WHERE dataset_id = ?", (str(dataset_id),)).fetchone()
+        return row[0] if row else None
+
+    def _require(self, dataset_id):
+        version = self._version(dataset_id)
+        if version is None:
+            raise UnknownDatasetError(f"알 수 없는 데이터셋입니다: {dataset_id}")
+        return version
+
+    def _bump(self, dataset_id, version):
+        updated_at = time.time()
+        self._db.execute(
+            "INSERT INTO datasets VALUES (?, ?, ?) "
+            "ON CONFLICT (dataset_id) DO UPDATE SET version = excluded.version, updated_at = excluded.updated_at",
+            (dataset_id, version, updated_at)
+        )
+        return AttendanceSnapshot(self, dataset_id, version, updated_at)
+
+    def _delete_dataset(self, dataset_id):
+        # 집계를 먼저 지워 두면 기록 삭제 트리거는 갱신할 행이 없어 빠르게 끝남
+        for table in ("student_weekdays", "student_months", "class_days", "records", "classes", "datasets"):
+            self._db.execute(f"DELETE FROM {table} WHERE dataset_id = ?", (dataset_id,))
+
+    def _evict(self):
+        """데이터셋 수가 한도를 넘으면 가장 오래전에 갱신된 데이터셋부터 제거합니다."""
+        for dataset_id, in self._db.execute(
+                "SELECT dataset_id FROM datasets ORDER BY updated_at DESC LIMIT -1 OFFSET ?",
+                (self.max_datasets,)).fetchall():
+            self._delete_dataset(dataset_id)
+            logger.info(f"출결 데이터셋 제거 (한도 {self.max_datasets}개 초과): {dataset_id}")
+
+    @staticmethod
+    def _check_id(dataset_id):
+        if not DATASET_ID_PATTERN.match(str(dataset_id)):
+            raise AttendanceError(f"데이터셋 ID는 영문, 숫자, '_', '-', '.'로 된 64자 이하여야 합니다: {dataset_id}")
+
+
+def summarize_request_data(data, students_key="students", attendance_key="attendance", class_ids=None):
+    """요청의 출결 데이터에 대한 (학급별 통계, 요약 텍스트)를 반환합니다.
+
+    data에 {"dataset": {"id": ..., "version": ...}}가 있으면 서버에 저장된 데이터셋을 사용하고,
+    없으면 요청에 포함된 데이터(일반 또는 열 형식)로 계산합니다.
+    {"period": {"from": ..., "to": ...}}가 있으면 그 기간의 기록만 사용합니다.
+    """
+    start, end = parse_period(data.get("period"))
+    reference = data.get("dataset")
+    if reference:
+        snapshot = get_attendance_store().get(reference.get("id"), reference.get("version"))
+        return snapshot.summarize(class_ids, start, end)
+
+    from ai_stats import summarize_attendance
+
+    students, attendance = decode_attendance(data, students_key, attendance_key)
+    if start is not None or end is not None:
+        attendance = {date: day for date, day in attendance.items()
+                      if (start is None or date >= start) and (end is None or date <= end)}
+    return summarize_attendance(students, attendance, class_ids)
+
+
+# 서버 전체에서 공유하는 출결 스냅샷 저장소
+_attendance_store = None
+_attendance_store_lock = threading.Lock()
+
+
+def configure_attendance_store(**kwargs):
+    """공유 출결 스냅샷 저장소를 주어진 설정으로 (재)생성합니다."""
+    global _attendance_store
+    with _attendance_store_lock:
+        _attendance_store = AttendanceStore(**kwargs)
+        return _attendance_store
+
+
+def get_attendance_store():
+    """공유 출결 스냅샷 저장소를 반환합니다. 아직 없으면 기본 설정으로 생성합니다."""
+    global _attendance_store
+    with _attendance_store_lock:
+        if _attendance_store is None:
+            _attendance_store = AttendanceStore()
+        return _attendance_store
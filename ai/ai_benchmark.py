@@ -0,0 +1,450 @@
+"""추론 서비스 벤치마크 도구
+
+실제 모델 대신 llama.cpp와 같은 인터페이스의 작은 가짜 모델(StubLlama)을 사용하면
+GPU나 네트워크 없이도 스케줄러, 캐시, HTTP 계층을 포함한 전체 경로를 재현 가능하게 측정할 수 있습니다.
+
+사용 예:
+    python ai/ai_benchmark.py --target both --requests 200 --concurrency 8 --output bench.json
+    python ai/ai_benchmark.py --target http --url http://localhost:8080 --compare bench.json
+"""
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 가짜 모델이 생성하는 문장에 쓰이는 단어
+STUB_WORDS = ["학생", "출석", "지각", "결석", "이번", "주", "월요일", "개선", "관리", "상담", "필요",
+              "합니다", "보입니다", "추세", "평균", "학급", "기록", "확인", "권장", "비율"]
+
+# 실제 화면에서 보내는 요청과 비슷한 분석/채팅 문장
+ANALYZE_PROMPTS = [
+    "학급 전체 출결 현황을 분석하고 개선 방안을 알려주세요.",
+    "지각이 잦은 학생들의 패턴을 분석해주세요.",
+    "이번 달 결석 현황을 요약해주세요.",
+    "요일별 출결 경향과 원인을 분석해주세요.",
+]
+CHAT_MESSAGES = [
+    "오늘 지각한 학생이 누구인가요?",
+    "이번 주 출석률은 어떤가요?",
+    "결석이 많은 학생에게 어떻게 상담하면 좋을까요?",
+    "지난달과 비교해서 좋아진 점이 있나요?",
+    "월요일 지각을 줄이는 방법을 알려주세요.",
+]
+
+
+class StubState:
+    """StubLlama.save_state()가 반환하는 상태입니다."""
+
+    def __init__(self, input_ids, n_tokens):
+        self.input_ids = input_ids
+        self.n_tokens = n_tokens
+        self.llama_state_size = input_ids.nbytes
+
+
+class StubLlama:
+    """llama_cpp.Llama와 같은 방식으로 호출되는 벤치마크용 가짜 모델입니다.
+
+    새로 평가하는 프롬프트 토큰마다 prompt_token_time, 생성하는 토큰마다 token_time만큼 시간을 소비하며,
+    같은 프롬프트에는 항상 같은 응답을 반환합니다. 이전 호출과 공통 접두어는 llama.cpp처럼 재평가하지 않습니다.
+    """
+
+    def __init__(self, prompt_token_time=0.0002, token_time=0.005, response_tokens=48, n_ctx=4096):
+        self.prompt_token_time = prompt_token_time
+        self.token_time = token_time
+        self.response_tokens = response_tokens
+        self._n_ctx = n_ctx
+        self.input_ids = np.zeros(n_ctx, dtype=np.intc)
+        self.n_tokens = 0
+        self._lock = threading.Lock()
+
+    def n_ctx(self):
+        return self._n_ctx
+
+    def tokenize(self, text, add_bos=True, special=False):
+        tokens = [zlib.crc32(word.encode("utf-8")) % 32000 for word in text.decode("utf-8").split()]
+        return ([1] if add_bos else []) + tokens
+
+    def eval(self, tokens):
+        with self._lock:
+            self._eval(tokens)
+
+    def save_state(self):
+        return StubState(self.input_ids[:self.n_tokens].copy(), self.n_tokens)
+
+    def load_state(self, state):
+        self.input_ids[:state.n_tokens] = state.input_ids
+        self.n_tokens = state.n_tokens
+
+    def close(self):
+        pass
+
+    def __call__(self, prompt, max_tokens=16, temperature=0.8, top_p=0.95, echo=False, stop=None, stream=False,
+                 stopping_criteria=None, **kwargs):
+        chunks = self._generate(prompt, max_tokens, stopping_criteria)
+        if stream:
+            return chunks
+        text = "".join(chunk["choices"][0]["text"] for chunk in chunks)
+        return {
+            "choices": [{"text": text}],
+            "usage": {"prompt_tokens": self._prompt_tokens, "completion_tokens": self._completion_tokens}
+        }
+
+    def _eval(self, tokens):
+        tokens = tokens[-self._n_ctx:]
+        current = self.input_ids[:self.n_tokens].tolist()
+        prefix = 0
+        for a, b in zip(current, tokens):
+            if a != b:
+                break
+            prefix += 1
+        time.sleep((len(tokens) - prefix) * self.prompt_token_time)
+        self.input_ids[:len(tokens)] = tokens
+        self.n_tokens = len(tokens)
+
+    def _generate(self, prompt, max_tokens, stopping_criteria):
+        with self._lock:
+            tokens = self.tokenize(prompt.encode("utf-8"))
+            self._eval(tokens)
+            self._prompt_tokens = len(tokens)
+            self._completion_tokens = 0
+            rng = random.Random(zlib.crc32(prompt.encode("utf-8")))
+            for _ in range(min(max_tokens, self.response_tokens)):
+                time.sleep(self.token_time)
+                word = rng.choice(STUB_WORDS)
+                if self.n_tokens < self._n_ctx:
+                    self.input_ids[self.n_tokens] = zlib.crc32(word.encode("utf-8")) % 32000
+                    self.n_tokens += 1
+                self._completion_tokens += 1
+                if stopping_criteria is not None and stopping_criteria(self.input_ids[:self.n_tokens], None):
+                    break
+                yield {"choices": [{"text": word + " "}]}
+
+
+def synthetic_attendance(rng, classes=3, students_per_class=25, days=120):
+    """화면에서 사용하는 형식과 같은 가상의 학생/출결 데이터를 만듭니다."""
+    students = {
+        str(class_id): [{"id": f"{class_id}-{number}", "number": number, "name": f"학생{class_id}-{number}"}
+                        for number in range(1, students_per_class + 1)]
+        for class_id in range(1, classes + 1)
+    }
+    attendance = {}
+    day = date(2025, 3, 3)
+    while len(attendance) < days:
+        if day.weekday() < 5:
+            attendance[day.isoformat()] = {
+                class_id: {
+                    student["id"]: {"status": rng.choices(["present", "late", "absent"], [0.88, 0.08, 0.04])[0],
+                                    "reason": "", "note": ""}
+                    for student in class_students
+                }
+                for class_id, class_students in students.items()
+            }
+        day += timedelta(days=1)
+    return students, attendance
+
+
+def build_workload(requests, seed=0, chat_ratio=0.6, sessions=8, classes=3, students_per_class=25, days=120):
+    """채팅과 분석 요청이 섞인 재현 가능한 작업 목록을 만듭니다.
+
+    각 항목은 {"kind": "chat" | "analyze", "body": HTTP 요청 본문} 형식입니다.
+    채팅은 sessions개의 대화가 번갈아 이어지며, 분석 요청은 화면과 같이 낮은 온도(0.2)를 사용해 일부가 캐시에 적중합니다.
+    """
+    rng = random.Random(seed)
+    students, attendance = synthetic_attendance(rng, classes, students_per_class, days)
+    histories = {f"bench-{index}": [] for index in range(sessions)}
+
+    items = []
+    for _ in range(requests):
+        class_id = rng.choice(list(students))
+        if rng.random() < chat_ratio:
+            session_id = rng.choice(list(histories))
+            history = histories[session_id]
+            message = rng.choice(CHAT_MESSAGES)
+            items.append({"kind": "chat", "body": {
+                "message": message,
+                "context": list(history[-10:]),
+                "attendanceData": {"studentData": students, "attendanceHistory": attendance,
+                                   "currentClass": class_id},
+                "session_id": session_id
+            }})
+            history.append({"role": "user", "content": message})
+            history.append({"role": "assistant", "content": "네, 확인해 보겠습니다."})
+        else:
+            items.append({"kind": "analyze", "body": {
+                "prompt": rng.choice(ANALYZE_PROMPTS),
+                "data": {"students": students, "attendance": attendance, "currentClass": class_id},
+                "temperature": 0.2
+            }})
+    return items
+
+
+def load_workload(path):
+    """JSONL 파일에서 작업 목록을 읽습니다. 각 줄은 {"kind": ..., "body": ...} 형식입니다."""
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def install_stub_model(**kwargs):
+    """가짜 모델을 기본 모델로 등록합니다.
+
+    swap_model()과 달리 model_info.json을 기록하지 않으므로 실제 서버의 모델 정보를 덮어쓰지 않습니다.
+    """
+    import ai_model
+    from ai_registry import ModelHandle, get_registry
+
+    handle = ModelHandle("stub", StubLlama(**kwargs), None, True, "stub")
+    get_registry().put(handle, make_default=True)
+    ai_model.model = handle.model
+    ai_model.model_name = handle.name
+    ai_model.is_llama_cpp = True
+    ai_model.is_loaded = True
+
+
+def peak_rss_mb():
+    """이 프로세스와 종료된 자식 프로세스의 최대 메모리 사용량(MB)을 반환합니다."""
+    # Linux의 ru_maxrss는 KB, macOS는 바이트 단위
+    unit = 1 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit
+    return round(max(own, children) / (1024 * 1024), 1)
+
+
+def summarize_latencies(latencies):
+    if not latencies:
+        return {"count": 0}
+    values = np.array(latencies) * 1000
+    return {
+        "count": len(latencies),
+        "mean_ms": round(float(values.mean()), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "max_ms": round(float(values.max()), 2)
+    }
+
+
+def run_load(items, concurrency, call):
+    """작업 목록을 concurrency개의 동시 클라이언트로 실행하고 처리량과 지연 시간 분포를 반환합니다.
+
+    call(item)은 성공하면 None, 실패하면 오류 종류 문자열을 반환해야 합니다.
+    """
+    latencies = {}
+    errors = {}
+    lock = threading.Lock()
+
+    def run_one(item):
+        start_time = time.perf_counter()
+        try:
+            error = call(item)
+        except Exception as e:
+            error = type(e).__name__
+        elapsed = time.perf_counter() - start_time
+        with lock:
+            if error is None:
+                latencies.setdefault(item["kind"], []).append(elapsed)
+            else:
+                errors[error] = errors.get(error, 0) + 1
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(run_one, items))
+    duration = time.perf_counter() - start_time
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "requests": len(items),
+        "succeeded": len(all_latencies),
+        "errors": errors,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(all_latencies) / duration, 2) if duration > 0 else 0.0,
+        "latency": summarize_latencies(all_latencies),
+        "by_kind": {kind: summarize_latencies(values) for kind, values in latencies.items()}
+    }
+
+
+def direct_caller(max_length):
+    """generate_response()를 직접 호출합니다. 모델 컨텍스트는 동시 호출에 안전하지 않으므로 호출을 직렬화합니다."""
+    from ai_model import generate_response
+    from ai_prompts import build_analyze_prompt, build_chat_prompt
+
+    model_lock = threading.Lock()
+
+    def call(item):
+        body = item["body"]
+        if item["kind"] == "chat":
+            prompt = build_chat_prompt(body["message"], body.get("context"), body.get("attendanceData"),
+                                       body.get("session_id"), max_length)
+            kwargs = {"session_id": body.get("session_id")}
+        else:
+            prompt, _ = build_analyze_prompt(body["prompt"], body.get("data") or {})
+            kwargs = {}
+        with model_lock:
+            response = generate_response(prompt, max_length, body.get("temperature", 0.7), **kwargs)
+        return "generation_error" if response.startswith("응답 생성 중 오류") else None
+
+    return call
+
+
+def http_caller(base_url, timeout=300):
+    """HTTP 엔드포인트(/api/chat, /api/analyze)를 호출합니다."""
+    def call(item):
+        request = urllib.request.Request(
+            f"{base_url}/api/{item['kind']}",
+            data=json.dumps(item["body"], ensure_ascii=False).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            return f"http_{e.code}"
+        return None
+
+    return call
+
+
+def start_local_server():
+    """벤치마크용 서버를 현재 프로세스의 임의 포트에서 시작하고 주소를 반환합니다."""
+    from werkzeug.serving import make_server
+    from ai_server import app
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-http", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare_results(current, previous_path):
+    """이전 결과 파일과 처리량, p95 지연 시간을 비교해 출력합니다."""
+    with open(previous_path, "r", encoding="utf-8") as f:
+        previous = json.load(f)
+    print(f"\n비교 기준: {previous_path} (커밋 {previous['meta'].get('git_revision')})")
+    for target, result in current["results"].items():
+        before = previous["results"].get(target)
+        if not before:
+            continue
+        for label, key in (("처리량(req/s)", ("throughput_rps",)), ("p95(ms)", ("latency", "p95_ms"))):
+            old, new = before, result
+            for part in key:
+                old, new = old.get(part), new.get(part)
+            if old and new is not None:
+                print(f"  [{target}] {label}: {old} -> {new} ({(new - old) / old * 100:+.1f}%)")
+
+
+def print_result(target, result):
+    latency = result["latency"]
+    print(f"\n[{target}] {result['succeeded']}/{result['requests']} 성공, {result['duration_s']}초, "
+          f"{result['throughput_rps']} req/s")
+    if latency.get("count"):
+        print(f"  지연 시간: p50 {latency['p50_ms']}ms, p95 {latency['p95_ms']}ms, p99 {latency['p99_ms']}ms")
+    for kind, values in result["by_kind"].items():
+        print(f"  {kind}: p50 {values['p50_ms']}ms, p95 {values['p95_ms']}ms ({values['count']}건)")
+    if result["errors"]:
+        print(f"  오류: {result['errors']}")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='AI 추론 서비스 벤치마크')
+    parser.add_argument('--target', choices=['direct', 'http', 'both'], default='both',
+                        help='측정 대상: generate_response 직접 호출, HTTP 엔드포인트, 또는 둘 다 (기본값: both)')
+    parser.add_argument('--url', type=str, default=None, help='이미 실행 중인 서버 주소 (지정하지 않으면 내장 서버 사용)')
+    parser.add_argument('--model', type=str, default='stub', help='사용할 모델 (기본값: stub, 가짜 모델)')
+    parser.add_argument('--requests', type=int, default=200, help='요청 수 (기본값: 200)')
+    parser.add_argument('--concurrency', type=int, default=8, help='동시 클라이언트 수 (기본값: 8)')
+    parser.add_argument('--chat-ratio', type=float, default=0.6, help='채팅 요청 비율 (기본값: 0.6)')
+    parser.add_argument('--max-length', type=int, default=64, help='직접 호출 시 최대 생성 토큰 수 (기본값: 64)')
+    parser.add_argument('--seed', type=int, default=0, help='작업 생성 시드 (기본값: 0)')
+    parser.add_argument('--workload', type=str, default=None, help='JSONL 작업 파일 (지정하지 않으면 가상 작업 생성)')
+    parser.add_argument('--stub-token-ms', type=float, default=5.0, help='가짜 모델의 토큰당 생성 시간(ms) (기본값: 5)')
+    parser.add_argument('--stub-prompt-token-ms', type=float, default=0.2,
+                        help='가짜 모델의 프롬프트 토큰당 평가 시간(ms) (기본값: 0.2)')
+    parser.add_argument('--no-response-cache', action='store_true', help='응답 캐시를 사용하지 않음')
+    parser.add_argument('--output', type=str, default=None, help='결과를 저장할 JSON 파일')
+    parser.add_argument('--compare', type=str, default=None, help='비교할 이전 결과 JSON 파일')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    for name in ("ai_model", "ai_server", "ai_scheduler", "ai_registry", "werkzeug"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    items = load_workload(args.workload) if args.workload else build_workload(
+        args.requests, args.seed, args.chat_ratio)
+
+    # 벤치마크가 실제 응답 캐시 파일을 덮어쓰지 않도록 메모리 캐시만 사용
+    from ai_response_cache import configure_response_cache
+    configure_response_cache(path=None, max_temperature=-1 if args.no_response_cache else 0.3)
+
+    if args.url is None or args.target == 'direct':
+        if args.model == 'stub':
+            install_stub_model(prompt_token_time=args.stub_prompt_token_ms / 1000, token_time=args.stub_token_ms / 1000)
+        else:
+            from ai_model import load_model
+            if not load_model(args.model):
+                print(f"모델 '{args.model}' 로드 실패")
+                sys.exit(1)
+
+    results = {}
+    targets = ['direct', 'http'] if args.target == 'both' else [args.target]
+    for target in targets:
+        if target == 'direct':
+            call = direct_caller(args.max_length)
+        else:
+            base_url = args.url
+            if base_url is None:
+                base_url, _ = start_local_server()
+            call = http_caller(base_url.rstrip('/'))
+
+        results[target] = run_load(items, args.concurrency, call)
+        print_result(target, results[target])
+
+    output = {
+        "meta": {
+            "git_revision": git_revision(),
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args)
+        },
+        "peak_rss_mb": peak_rss_mb(),
+        "results": results
+    }
+    print(f"\n최대 메모리 사용량(RSS): {output['peak_rss_mb']} MB")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+        print(f"결과 저장: {args.output}")
+    if args.compare:
+        compare_results(output, args.compare)
+
+
+if __name__ == "__main__":
+    main()
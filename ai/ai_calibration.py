@@ -0,0 +1,255 @@
+import hashlib
+import json
+import logging
+import os
+import platform
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CALIBRATION_PATH = os.path.join(ROOT_DIR, "models_cache", "calibration.json")
+
+# 시험해 볼 GGUF 양자화 종류 (품질이 낮은 것부터). 저장소에 없는 종류는 건너뜀
+QUANTIZATIONS = ("Q2_K", "Q3_K_M", "Q4_K_M", "Q5_K_M", "Q6_K", "Q8_0")
+# 가중치 외에 필요한 메모리 (n_ctx=2048 KV 캐시와 계산 버퍼)
+MEMORY_OVERHEAD_BYTES = 512 * 1024 ** 2
+# 가장 빠른 조합과 비교해 이 비율 이상의 속도를 내면 더 높은 품질의 양자화를 선택
+QUALITY_TOLERANCE = 0.9
+CALIBRATION_PROMPT = "학급 출결 관리 시스템 AI 비서로서 이번 주 3학년 1반의 지각과 결석 현황을 요약해주세요."
+CALIBRATION_TOKENS = 32
+CALIBRATION_RUNS = 2
+
+_cache_lock = threading.Lock()
+
+
+def host_info():
+    """보정 결과를 재사용할 수 있는지 판단하는 호스트 정보(CPU 모델, 코어 수, 메모리)를 반환합니다."""
+    from ai_workers import available_cores
+
+    cpu_model = platform.processor() or platform.machine()
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    cpu_model = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return {
+        "hostname": platform.node(),
+        "cpu": cpu_model,
+        "cores": len(available_cores()),
+        "memory_bytes": total_memory(),
+    }
+
+
+def total_memory():
+    """전체 물리 메모리(바이트)를 반환합니다. 알 수 없으면 None입니다."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def available_memory():
+    """지금 사용할 수 있는 메모리(바이트)를 반환합니다. /proc/meminfo가 없으면 전체 메모리를 사용합니다."""
+    try:
+        with open("/proc/meminfo", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return total_memory()
+
+
+def thread_candidates(cores, threads=None):
+    """시험해 볼 스레드 수 목록을 반환합니다. threads가 주어지면(워커 모드) 그 값만 사용합니다."""
+    if threads:
+        return [threads]
+    return sorted({max(1, cores * share // 4) for share in (1, 2, 3, 4)})
+
+
+def list_quantizations(model_name):
+    """모델의 GGUF 저장소에서 받을 수 있는 양자화 종류와 파일 크기를 반환합니다: [(양자화, 바이트)].
+
+    저장소를 조회할 수 없으면(오프라인) 이미 받아 둔 파일만 반환합니다.
+    """
+    from ai_model import GGUF_DIR, gguf_location
+
+    repo = gguf_location(model_name)[0]
+    names = {gguf_location(model_name, quant)[1]: quant for quant in QUANTIZATIONS}
+    sizes = {}
+    try:
+        from huggingface_hub import HfApi
+
+        info = HfApi().model_info(repo, files_metadata=True)
+        sizes = {names[s.rfilename]: s.size for s in info.siblings if s.rfilename in names and s.size}
+    except Exception as e:
+        logger.warning(f"GGUF 저장소 조회 실패, 받아 둔 파일만 사용합니다: {str(e)}")
+    for name, quant in names.items():
+        path = os.path.join(GGUF_DIR, name)
+        if quant not in sizes and os.path.exists(path):
+            sizes[quant] = os.path.getsize(path)
+    return [(quant, sizes[quant]) for quant in QUANTIZATIONS if quant in sizes]
+
+
+def measure(gguf_path, threads):
+    """보정용 프롬프트로 생성 속도(초당 토큰 수)를 측정합니다. 여러 번 실행해 가장 좋은 값을 사용합니다."""
+    from llama_cpp import Llama
+
+    model = Llama(model_path=gguf_path, n_ctx=512, n_batch=512, n_threads=threads, n_threads_batch=threads,
+                  use_mmap=True, verbose=False)
+    try:
+        # 가중치 페이지를 메모리에 올리는 첫 실행은 측정에서 제외
+        model(CALIBRATION_PROMPT, max_tokens=4, temperature=0.0)
+        best = 0.0
+        for _ in range(CALIBRATION_RUNS):
+            model.reset()
+            start_time = time.perf_counter()
+            result = model(CALIBRATION_PROMPT, max_tokens=CALIBRATION_TOKENS, temperature=0.0)
+            elapsed = time.perf_counter() - start_time
+            tokens = result["usage"]["completion_tokens"]
+            best = max(best, tokens / elapsed if elapsed > 0 else 0.0)
+        return best
+    finally:
+        model.close()
+
+
+def choose(results):
+    """측정 결과에서 사용할 조합을 고릅니다.
+
+    가장 빠른 조합의 QUALITY_TOLERANCE 이상 속도를 내는 것 중 가장 높은 품질의 양자화를 고르고,
+    그 양자화에서 가장 빠른 스레드 수를 사용합니다.
+    """
+    best = max(result["tokens_per_second"] for result in results)
+    eligible = [result for result in results if result["tokens_per_second"] >= best * QUALITY_TOLERANCE]
+    quant = max((result["quantization"] for result in eligible), key=QUANTIZATIONS.index)
+    return max((result for result in results if result["quantization"] == quant),
+               key=lambda result: result["tokens_per_second"])
+
+
+def _cache_key(model_name, host, threads):
+    import llama_cpp
+
+    key = {"model": model_name, "host": host, "threads": threads,
+           "llama_cpp": getattr(llama_cpp, "__version__", "unknown")}
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _reuse(cached, memory_limit):
+    """저장된 보정 결과를 현재 메모리 한도에 맞게 다시 고릅니다. 다시 측정해야 하면 None을 반환합니다.
+
+    한도가 측정 당시보다 작으면 한도 안에 드는 측정 결과 중에서 고르고, 크면 당시 한도를 넘어
+    측정하지 못한 양자화가 없을 때만 재사용합니다.
+    """
+    if memory_limit > cached["memory_limit"] and cached["skipped"]:
+        return None
+    fitting = [result for result in cached["results"] if result["bytes"] + MEMORY_OVERHEAD_BYTES <= memory_limit]
+    if not fitting:
+        return None
+    return dict(cached, **choose(fitting))
+
+
+def _read_cache():
+    try:
+        with open(CALIBRATION_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_cache(key, choice):
+    with _cache_lock:
+        cache = _read_cache()
+        cache[key] = choice
+        os.makedirs(os.path.dirname(CALIBRATION_PATH), exist_ok=True)
+        temp_path = CALIBRATION_PATH + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, CALIBRATION_PATH)
+
+
+def calibrate(model_name, memory_limit=None, threads=None, progress=None, force=False):
+    """이 호스트에서 가장 빠른 GGUF 양자화와 스레드 수를 찾아 반환합니다.
+
+    memory_limit(바이트) 안에 들어가는 양자화마다 스레드 수를 바꿔 가며 짧은 프롬프트의 생성 속도를 재고,
+    결과는 호스트·모델별로 models_cache/calibration.json에 저장되어 다음 시작부터는 측정을 건너뜁니다.
+    memory_limit이 없으면 모델 레지스트리 한도와 사용 가능한 메모리 중 작은 값을 사용합니다.
+    threads를 지정하면(워커 모드) 그 스레드 수에서 양자화만 비교합니다.
+    보정을 위해 새로 받은 파일 중 선택되지 않은 파일은 삭제합니다.
+    사용할 수 있는 양자화가 없으면 ValueError를 발생시킵니다.
+    """
+    from ai_model import GGUF_DIR, download_gguf_model, gguf_location
+    from ai_registry import get_registry
+
+    if memory_limit is None:
+        memory_limit = min(filter(None, (get_registry().max_bytes, available_memory())))
+    host = host_info()
+    key = _cache_key(model_name, host, threads)
+    if not force:
+        cached = _read_cache().get(key)
+        cached = _reuse(cached, memory_limit) if cached is not None else None
+        if cached is not None:
+            logger.info(f"저장된 보정 결과 사용: {model_name} → {cached['quantization']}, "
+                        f"스레드 {cached['threads']}개 ({cached['tokens_per_second']:.1f} 토큰/초)")
+            return {**cached, "cached": True}
+
+    available = list_quantizations(model_name)
+    candidates = [(quant, size) for quant, size in available if size + MEMORY_OVERHEAD_BYTES <= memory_limit]
+    if not candidates:
+        raise ValueError(f"메모리 한도({memory_limit // 1024 ** 2}MB) 안에 들어가는 '{model_name}'의 GGUF 양자화가 없습니다.")
+
+    logger.info(f"양자화/스레드 보정 시작: {model_name}, 후보 {[quant for quant, _ in candidates]}")
+    start_time = time.time()
+    results = []
+    downloaded = []
+    for quant, size in candidates:
+        existed = os.path.exists(os.path.join(GGUF_DIR, gguf_location(model_name, quant)[1]))
+        gguf_path = download_gguf_model(model_name, quantization=quant)
+        if progress is not None:
+            progress.update(stage="calibrating")
+        if not gguf_path:
+            continue
+        if not existed:
+            downloaded.append((quant, gguf_path))
+        for thread_count in thread_candidates(host["cores"], threads):
+            try:
+                tokens_per_second = measure(gguf_path, thread_count)
+            except Exception as e:
+                logger.warning(f"보정 측정 실패 ({quant}, 스레드 {thread_count}개): {str(e)}")
+                continue
+            logger.info(f"보정 측정: {quant}, 스레드 {thread_count}개 → {tokens_per_second:.1f} 토큰/초")
+            results.append({"quantization": quant, "threads": thread_count, "bytes": size,
+                            "tokens_per_second": round(tokens_per_second, 2)})
+    if not results:
+        raise ValueError(f"'{model_name}'의 보정 측정에 모두 실패했습니다.")
+
+    skipped = [quant for quant, size in available if (quant, size) not in candidates]
+    choice = dict(choose(results), results=results, skipped=skipped, host=host, memory_limit=memory_limit,
+                  calibrated_at=time.time(), calibration_seconds=round(time.time() - start_time, 1))
+    for quant, gguf_path in downloaded:
+        if quant != choice["quantization"]:
+            os.remove(gguf_path)
+    _write_cache(key, choice)
+    logger.info(f"보정 완료: {model_name} → {choice['quantization']}, 스레드 {choice['threads']}개 "
+                f"({choice['tokens_per_second']:.1f} 토큰/초, {choice['calibration_seconds']}초 소요)")
+    return {**choice, "cached": False}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description='GGUF 양자화와 스레드 수 보정')
+    parser.add_argument('--model', type=str, default="deepseek-ai/DeepSeek-R1-Distill-Qwen-7B", help='보정할 모델')
+    parser.add_argument('--memory-mb', type=int, default=None, help='모델이 사용할 수 있는 메모리 한도(MB) (기본값: 사용 가능한 메모리)')
+    parser.add_argument('--threads', type=int, default=None, help='스레드 수를 고정하고 양자화만 비교')
+    parser.add_argument('--force', action='store_true', help='저장된 결과를 무시하고 다시 측정')
+    args = parser.parse_args()
+
+    result = calibrate(args.model, args.memory_mb * 1024 ** 2 if args.memory_mb else None, args.threads, force=args.force)
+    print(json.dumps({key: value for key, value in result.items() if key != "host"}, ensure_ascii=False, indent=2))
@@ -0,0 +1,234 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 모델이 이 프로세스에 없을 때(워커 모드 등) 사용하는 기본 컨텍스트 크기 (llama.cpp 모델의 n_ctx와 같음)
+DEFAULT_CONTEXT_TOKENS = 2048
+DEFAULT_MAX_HISTORY_TOKENS = 1024   # 이전 대화(요약 포함)에 쓸 수 있는 최대 토큰 수
+DEFAULT_SUMMARY_TOKENS = 256        # 요약에 쓸 수 있는 최대 토큰 수
+DEFAULT_MAX_SESSIONS = 1000
+LOW_WATER_RATIO = 0.6               # 예산을 넘으면 이 비율까지 줄여서 요약 경계가 턴마다 바뀌지 않게 함
+SUMMARY_LINE_CHARS = 80             # 요약 한 줄에 남길 최대 글자 수
+TOKEN_CACHE_SIZE = 8192
+
+
+@contextmanager
+def _held_model(model_name=None):
+    """상주 중인 모델 핸들을 잡아 블록 안에서 해제되지 않게 합니다.
+
+    모델이 상주하지 않거나 이미 해제된(교체/제거된) 경우 None을 넘기며, 레지스트리와 달리 콜드 로드를 시작하지 않습니다.
+    """
+    from ai_registry import get_registry
+
+    handle = get_registry().get(model_name)
+    if handle is None:
+        yield None
+        return
+    handle.acquire()
+    try:
+        yield handle if handle.model is not None else None
+    finally:
+        handle.release()
+
+
+def format_turn(message):
+    """대화 한 턴을 프롬프트 형식으로 변환합니다."""
+    speaker = "User" if message.get('role') == 'user' else "A"
+    return f"{speaker}: {message.get('content', '')}\n\n"
+
+
+def estimate_tokens(text):
+    """토크나이저 없이 토큰 수를 보수적으로 추정합니다. 한글 등 ASCII가 아닌 문자는 글자당 1토큰으로 계산합니다."""
+    non_ascii = sum(1 for char in text if ord(char) > 127)
+    return non_ascii + (len(text) - non_ascii + 3) // 4
+
+
+def summarize_turn(message):
+    """오래된 대화 턴을 요약 한 줄로 줄입니다 (첫 문장만 남기는 추출 요약)."""
+    content = re.sub(r"\s+", " ", message.get('content', '')).strip()
+    first = re.split(r"(?<=[.!?。])\s", content, maxsplit=1)[0]
+    if len(first) > SUMMARY_LINE_CHARS:
+        first = first[:SUMMARY_LINE_CHARS].rstrip() + "…"
+    speaker = "사용자" if message.get('role') == 'user' else "AI"
+    return f"- {speaker}: {first}"
+
+
+def _digest(messages):
+    encoded = json.dumps([[m.get('role'), m.get('content')] for m in messages], ensure_ascii=False)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+class SessionWindow:
+    """한 세션에서 요약으로 접힌 앞쪽 대화와 그 요약입니다."""
+
+    def __init__(self):
+        self.summarized = 0       # 요약으로 접힌 앞쪽 메시지 수
+        self.digest = _digest([])
+        self.lines = []           # (요약 줄, 토큰 수)
+        self.last_used = time.time()
+
+    @property
+    def summary_tokens(self):
+        return sum(tokens for _, tokens in self.lines)
+
+    @property
+    def summary(self):
+        return "\n".join(line for line, _ in self.lines)
+
+
+class ChatHistoryManager:
+    """채팅 기록을 토큰 예산 안으로 줄이는 관리자입니다.
+
+    최근 대화는 그대로 두고, 예산을 넘는 오래된 대화는 세션별 요약으로 접습니다.
+    요약은 세션마다 캐시되어 새로 밀려난 턴만 추가로 요약하며, 예산을 넘을 때 여유 있게 줄여서
+    (LOW_WATER_RATIO) 프롬프트 앞부분이 자주 바뀌지 않으므로 세션 KV 캐시도 계속 재사용됩니다.
+    토큰 수는 실제 모델의 토크나이저로 세고 메시지별로 캐시합니다.
+    """
+
+    def __init__(self, max_history_tokens=DEFAULT_MAX_HISTORY_TOKENS, summary_tokens=DEFAULT_SUMMARY_TOKENS,
+                 max_sessions=DEFAULT_MAX_SESSIONS):
+        self.max_history_tokens = max_history_tokens
+        self.summary_tokens = summary_tokens
+        self.max_sessions = max_sessions
+
+        self._sessions = OrderedDict()
+        self._token_cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._summarized_messages = 0
+        self._resets = 0
+
+    def count_tokens(self, text, model_name=None):
+        """text의 토큰 수를 반환합니다. 모델이 이 프로세스에 있으면 실제 토크나이저를 사용합니다."""
+        with _held_model(model_name) as handle:
+            cache_key = (handle.handle_id if handle is not None else None, text)
+            with self._lock:
+                count = self._token_cache.get(cache_key)
+                if count is not None:
+                    self._token_cache.move_to_end(cache_key)
+                    return count
+
+            if handle is not None:
+                try:
+                    if handle.is_llama_cpp:
+                        count = len(handle.model.tokenize(text.encode("utf-8"), add_bos=False))
+                    elif handle.tokenizer is not None:
+                        count = len(handle.tokenizer.encode(text, add_special_tokens=False))
+                except Exception as e:
+                    logger.warning(f"토큰 수 계산 실패, 추정값 사용: {str(e)}")
+        if count is None:
+            count = estimate_tokens(text)
+
+        with self._lock:
+            self._token_cache[cache_key] = count
+            while len(self._token_cache) > TOKEN_CACHE_SIZE:
+                self._token_cache.popitem(last=False)
+        return count
+
+    def context_window(self, model_name=None):
+        """모델의 컨텍스트 크기(토큰)를 반환합니다. 모델이 없거나 읽는 중 해제되었으면 기본값을 사용합니다."""
+        with _held_model(model_name) as handle:
+            if handle is None:
+                return DEFAULT_CONTEXT_TOKENS
+            if handle.is_llama_cpp:
+                return handle.model.n_ctx()
+            config = getattr(handle.model, "config", None)
+            return getattr(config, "max_position_embeddings", None) or DEFAULT_CONTEXT_TOKENS
+
+    def fit(self, context, fixed_text, max_length=1000, session_id=None, model_name=None):
+        """이전 대화를 예산에 맞게 줄이고 (요약, 그대로 넣을 최근 메시지 목록)을 반환합니다.
+
+        fixed_text는 대화 기록 외에 항상 프롬프트에 들어가는 부분(출결 요약, 현재 메시지)입니다.
+        max_length는 이 요청이 실제로 생성할 수 있는 최대 토큰 수(스케줄러의 우선순위별 제한을 적용한 값)이며,
+        응답이 컨텍스트를 넘지 않도록 그만큼을 비워 둡니다.
+        """
+        context = [m for m in context or [] if isinstance(m, dict)]
+        budget = self.context_window(model_name) - max_length - self.count_tokens(fixed_text, model_name)
+        budget = max(min(budget, self.max_history_tokens), 0)
+
+        window = self._take_session(session_id, context)
+        recent = context[window.summarized:]
+        recent_tokens = [self.count_tokens(format_turn(m), model_name) for m in recent]
+
+        if window.summary_tokens + sum(recent_tokens) > budget:
+            target = int(budget * LOW_WATER_RATIO)
+            summarized_before = window.summarized
+            summary_budget = min(self.summary_tokens, target)
+            while recent and window.summary_tokens + sum(recent_tokens) > target:
+                message = recent.pop(0)
+                recent_tokens.pop(0)
+                line = summarize_turn(message)
+                window.lines.append((line, self.count_tokens(line + "\n", model_name)))
+                window.summarized += 1
+                # 요약도 예산을 넘으면 가장 오래된 줄부터 버림
+                while window.lines and window.summary_tokens > summary_budget:
+                    window.lines.pop(0)
+            window.digest = _digest(context[:window.summarized])
+            with self._lock:
+                self._summarized_messages += window.summarized - summarized_before
+            logger.info(f"대화 기록 정리: 세션 {session_id}, 요약 {window.summarized}개, 최근 {len(recent)}개 "
+                        f"({window.summary_tokens + sum(recent_tokens)}/{budget} 토큰)")
+
+        self._put_session(session_id, window)
+        return window.summary, recent
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_history_tokens": self.max_history_tokens,
+                "summarized_messages": self._summarized_messages,
+                "resets": self._resets,
+                "token_cache_entries": len(self._token_cache)
+            }
+
+    def _take_session(self, session_id, context):
+        """세션의 요약 상태를 반환합니다. 클라이언트가 대화 기록을 바꿨으면 새로 시작합니다."""
+        if not session_id:
+            return SessionWindow()
+        with self._lock:
+            window = self._sessions.pop(session_id, None)
+        if window is None:
+            return SessionWindow()
+        if window.summarized > len(context) or window.digest != _digest(context[:window.summarized]):
+            with self._lock:
+                self._resets += 1
+            return SessionWindow()
+        return window
+
+    def _put_session(self, session_id, window):
+        if not session_id:
+            return
+        window.last_used = time.time()
+        with self._lock:
+            self._sessions[session_id] = window
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+
+# 서버 전체에서 공유하는 대화 기록 관리자
+_history_manager = None
+_history_manager_lock = threading.Lock()
+
+
+def configure_history_manager(**kwargs):
+    """공유 대화 기록 관리자를 주어진 설정으로 (재)생성합니다."""
+    global _history_manager
+    with _history_manager_lock:
+        _history_manager = ChatHistoryManager(**kwargs)
+        return _history_manager
+
+
+def get_history_manager():
+    """공유 대화 기록 관리자를 반환합니다. 아직 없으면 기본 설정으로 생성합니다."""
+    global _history_manager
+    with _history_manager_lock:
+        if _history_manager is None:
+            _history_manager = ChatHistoryManager()
+        return _history_manager
@@ -0,0 +1,546 @@
+"""학급별 분석 보고서를 한꺼번에 생성하는 배치 작업 실행기
+
+입력은 한 줄에 한 학급씩 분석 요청을 담은 JSONL 파일입니다:
+    {"id": "3-1", "prompt": "학기말 출결 보고서를 작성해주세요.", "data": {"students": ..., "attendance": ..., "currentClass": "1"}}
+결과는 같은 순서가 보장되지 않는 JSONL로 기록됩니다:
+    {"id": "3-1", "response": "...", "stats": {...}}
+항목(또는 작업 기본값)에 "schema"(스키마 이름 또는 JSON 스키마)가 있으면 그 스키마를 따르는 JSON으로 생성하고
+파싱한 결과를 "result"에 함께 기록합니다.
+
+결과 파일이 체크포인트 역할을 하므로 서버가 재시작되어도 이미 처리한 항목은 건너뛰고 이어서 실행합니다.
+모델 로드 중이거나 대기 시간이 초과되는 등 일시적으로 처리하지 못한 항목은 기록하지 않고 다시 시도합니다.
+대화형 요청이 대기열에 없을 때만 다음 묶음을 제출하므로 교사들의 채팅/분석 요청을 막지 않습니다.
+
+서버 없이 실행:
+    python ai/ai_jobs.py reports.jsonl --output reports.out.jsonl
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# 입력과 결과에 학생 기록과 분석 내용이 들어 있으므로 정적 파일로 제공되는 저장소 폴더 밖에 저장
+DATA_DIR = os.environ.get("AI_DATA_DIR") or os.path.join(os.path.expanduser("~"), ".attendance_ai")
+JOBS_DIR = os.path.join(DATA_DIR, "jobs")
+
+DEFAULT_MAX_LENGTH = 1000
+DEFAULT_TEMPERATURE = 0.2     # 보고서는 재현성을 위해 낮은 온도로 생성 (응답 캐시 대상)
+IDLE_POLL_INTERVAL = 1.0      # 대화형 요청이 있거나 실행 시간대가 아닐 때 다시 확인하는 간격(초)
+RETRY_DELAY = 5.0             # 일시적인 오류(대기열 가득 참, 모델 로드 중 등) 후 처음 다시 제출하기까지 기다리는 시간(초)
+MAX_RETRY_DELAY = 60.0        # 다시 시도할 때마다 두 배로 늘리는 대기 시간의 상한(초)
+
+
+def parse_run_hours(value):
+    """'22-7' 형식의 실행 시간대를 (시작 시, 끝 시) 튜플로 변환합니다. 값이 없으면 None(항상 실행)입니다."""
+    if not value:
+        return None
+    start, end = (int(part) for part in str(value).split("-"))
+    if not (0 <= start < 24 and 0 <= end < 24):
+        raise ValueError(f"실행 시간대는 0~23시 범위여야 합니다: {value}")
+    return start, end
+
+
+def in_run_hours(run_hours, now=None):
+    """현재 시각이 실행 시간대 안에 있는지 확인합니다. 자정을 넘는 시간대(예: 22-7)도 지원합니다."""
+    if run_hours is None:
+        return True
+    hour = (now or datetime.now()).hour
+    start, end = run_hours
+    if start == end:
+        return True
+    if start < end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+def read_items(path):
+    """입력 JSONL 파일의 항목을 순서대로 반환합니다. id가 없으면 줄 번호를 사용합니다."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            item.setdefault("id", str(line_number))
+            yield item
+
+
+def read_completed_ids(path):
+    """결과 파일에 이미 기록된 항목 ID를 반환합니다. 마지막 줄이 중간에 잘렸으면 그 줄은 무시합니다.
+
+    결과 파일에는 생성 결과와 다시 시도해도 실패하는 항목 오류(잘못된 항목 등)만 기록되므로 기록된 항목은 모두 완료로 봅니다.
+    """
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                completed.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError):
+                continue
+    return completed
+
+
+def _has_torn_last_line(path):
+    """파일이 줄바꿈으로 끝나지 않는지 (마지막 줄을 기록하다 중단되었는지) 확인합니다."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return False
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b"\n"
+
+
+class BatchJob:
+    """입력 JSONL의 항목을 모델로 처리해 결과 JSONL에 기록하는 배치 작업입니다.
+
+    상태: queued → running ↔ waiting(실행 시간대 밖이거나 대화형 요청 처리 중) → completed, failed 또는 cancelled
+    """
+
+    def __init__(self, input_path, output_path, meta_path=None, job_id=None, run_hours=None, model_name=None,
+                 defaults=None):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.input_path = input_path
+        self.output_path = output_path
+        self.meta_path = meta_path
+        self.run_hours = run_hours
+        self.model_name = model_name
+        self.defaults = defaults or {}
+        self.state = "queued"
+        self.total = sum(1 for _ in read_items(input_path))
+        self.done = len(read_completed_ids(output_path))
+        self.failed = 0
+        self.cache_hits = 0
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._processed_this_run = 0
+        self._run_started_at = None
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, meta_path):
+        """저장된 작업 정보로 작업을 복원합니다."""
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        job = cls(meta["input_path"], meta["output_path"], meta_path, meta["job_id"],
+                  tuple(meta["run_hours"]) if meta.get("run_hours") else None, meta.get("model"), meta.get("defaults"))
+        job.state = meta["state"]
+        job.failed = meta.get("failed", 0)
+        job.error = meta.get("error")
+        job.created_at = meta.get("created_at", job.created_at)
+        job.finished_at = meta.get("finished_at")
+        return job
+
+    @property
+    def finished(self):
+        return self.state in ("completed", "failed", "cancelled")
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def to_dict(self):
+        with self._lock:
+            elapsed = time.time() - self._run_started_at if self._run_started_at else None
+            rate = self._processed_this_run / elapsed if elapsed and self._processed_this_run else None
+            remaining = self.total - self.done
+            return {
+                "job_id": self.job_id,
+                "state": self.state,
+                "total": self.total,
+                "done": self.done,
+                "failed": self.failed,
+                "cache_hits": self.cache_hits,
+                "progress": round(self.done / self.total, 4) if self.total else 1.0,
+                "items_per_second": round(rate, 3) if rate else None,
+                "eta": round(remaining / rate, 1) if rate and not self.finished else None,
+                "run_hours": list(self.run_hours) if self.run_hours else None,
+                "model": self.model_name,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at
+            }
+
+    def save(self):
+        """작업 정보를 디스크에 저장합니다 (재시작 시 이어서 실행하기 위해)."""
+        if not self.meta_path:
+            return
+        meta = self.to_dict()
+        meta.update(input_path=self.input_path, output_path=self.output_path, defaults=self.defaults)
+        temp_path = f"{self.meta_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(temp_path, self.meta_path)
+
+    def run(self, scheduler):
+        """남은 항목을 스케줄러 배치 크기만큼씩 묶어 처리합니다. 취소되면 현재 묶음까지만 처리하고 멈춥니다."""
+        self.started_at = self.started_at or time.time()
+        self._run_started_at = time.time()
+        self._set_state("running")
+
+        try:
+            completed = read_completed_ids(self.output_path)
+            pending = (item for item in read_items(self.input_path) if str(item["id"]) not in completed)
+            torn = _has_torn_last_line(self.output_path)
+            with open(self.output_path, "a", encoding="utf-8") as output:
+                # 기록 도중 중단되어 마지막 줄이 잘렸으면 새 줄에서 이어서 기록
+                if torn:
+                    output.write("\n")
+                while True:
+                    chunk = []
+                    chunk_size = self._chunk_size(scheduler)
+                    for item in pending:
+                        chunk.append(item)
+                        if len(chunk) >= chunk_size:
+                            break
+                    if not chunk:
+                        break
+                    if not self._wait_for_turn(scheduler):
+                        self._set_state("cancelled")
+                        return
+                    for result in self._process_chunk(scheduler, chunk):
+                        output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    # 묶음마다 디스크에 반영하여 체크포인트로 사용
+                    output.flush()
+                    os.fsync(output.fileno())
+                    self.save()
+            if self._cancel_event.is_set() and self.done < self.total:
+                self._set_state("cancelled")
+                return
+            self._set_state("completed")
+            logger.info(f"배치 작업 완료: {self.job_id} ({self.done}/{self.total}, 실패 {self.failed})")
+        except Exception as e:
+            self.error = str(e)
+            self._set_state("failed")
+            logger.error(f"배치 작업 실패: {self.job_id}: {str(e)}")
+
+    def _set_state(self, state):
+        with self._lock:
+            self.state = state
+            if self.finished:
+                self.finished_at = time.time()
+        self.save()
+
+    def _chunk_size(self, scheduler):
+        """한 번에 제출할 항목 수를 정합니다.
+
+        transformers는 묶음 전체를 한 배치로 디코딩하므로 최대 배치 크기만큼 제출하고,
+        llama.cpp는 배치 안의 요청을 순서대로 처리하므로 대화형 요청이 오래 기다리지 않도록 하나씩 제출합니다.
+        워커 모드에서는 대화형 요청을 위해 워커 하나를 남겨 둡니다.
+        """
+        from ai_registry import get_registry
+
+        if scheduler.executor is not None:
+            return max(1, scheduler.executor.size - 1)
+        handle = get_registry().get(self.model_name)
+        if handle is not None and handle.is_llama_cpp:
+            return 1
+        return scheduler.max_batch_size
+
+    def _model_ready(self, scheduler):
+        """작업에 사용할 모델(워커 모드에서는 준비된 워커)이 요청을 받을 수 있는지 확인합니다."""
+        from ai_loader import get_loader
+        from ai_registry import get_registry
+        from ai_scheduler import SchedulerError
+
+        if scheduler.executor is not None:
+            try:
+                scheduler.executor.check_available()
+            except SchedulerError:
+                return False
+            return True
+        if get_registry().get(self.model_name) is not None:
+            return True
+        # 상주하지 않는 모델을 지정했으면 제출할 때 콜드 로드가 시작되므로, 진행 중인 로드가 없을 때만 제출
+        return self.model_name is not None and not get_loader().active_jobs()
+
+    def _wait_for_turn(self, scheduler):
+        """실행 시간대 안이고, 모델이 준비되었고, 대기열에 대화형 요청이 없을 때까지 기다립니다. 취소되면 False를 반환합니다."""
+        while not self._cancel_event.is_set():
+            if (in_run_hours(self.run_hours) and scheduler.stats()["queue_depth"] == 0
+                    and self._model_ready(scheduler)):
+                if self.state != "running":
+                    self._set_state("running")
+                return True
+            if self.state != "waiting":
+                self._set_state("waiting")
+            self._cancel_event.wait(IDLE_POLL_INTERVAL)
+        return False
+
+    def _process_chunk(self, scheduler, chunk):
+        """한 묶음의 항목을 동시에 제출해 스케줄러가 하나의 배치로 생성하게 하고 결과 목록을 반환합니다.
+
+        스케줄러 오류(대기열 가득 참, 모델 로드 중, 대기 시간 초과 등)로 처리하지 못한 항목은 결과에 넣지 않고,
+        간격을 늘려 가며 모델이 준비될 때까지 기다렸다가 다시 제출합니다.
+        """
+        from ai_registry import get_registry
+        from ai_response_cache import get_response_cache
+        from ai_prompts import build_analyze_prompt
+        from ai_scheduler import SchedulerError
+        from ai_structured import resolve_schema, schema_key, structured_result
+
+        cache = get_response_cache()
+        results = []
+        pending = []
+        for item in chunk:
+            try:
+                schema = resolve_schema(item.get("schema", self.defaults.get("schema")))
+                prompt, stats = build_analyze_prompt(item["prompt"], item.get("data") or {}, schema)
+                max_length = item.get("max_length", self.defaults.get("max_length", DEFAULT_MAX_LENGTH))
+                temperature = item.get("temperature", self.defaults.get("temperature", DEFAULT_TEMPERATURE))
+                model_name = item.get("model") or self.model_name
+            except Exception as e:
+                results.append({"id": item["id"], "error": f"잘못된 항목: {str(e)}"})
+                continue
+
+            # /api/analyze와 같은 키를 사용하므로 교사가 같은 보고서를 다시 요청하면 바로 캐시에서 응답됨
+            key = None
+            if cache.is_cacheable(temperature):
+                key = cache.make_key(prompt, None, model=model_name or get_registry().default_name,
+                                     max_length=max_length, temperature=temperature, schema=schema_key(schema))
+                response = cache.get(key)
+                if response is not None:
+                    with self._lock:
+                        self.cache_hits += 1
+                    result = {"id": item["id"], "response": response, "stats": stats}
+                    if schema is not None:
+                        result.update(structured_result(response, schema))
+                    results.append(result)
+                    continue
+            pending.append((item, prompt, stats, key, schema, max_length, temperature, model_name))
+
+        attempt = 0
+        while pending:
+            retry = []
+            retry_after = 0
+            submitted = []
+            for entry in pending:
+                item, prompt, stats, key, schema, max_length, temperature, model_name = entry
+                try:
+                    req = scheduler.submit(prompt, max_length, temperature, model_name=model_name,
+                                           priority="bulk", client_id=f"job:{self.job_id}", schema=schema)
+                except SchedulerError as e:
+                    retry.append(entry)
+                    retry_after = max(retry_after, e.retry_after)
+                    continue
+                submitted.append((entry, req))
+
+            for entry, req in submitted:
+                item, prompt, stats, key = entry[:4]
+                try:
+                    response = req.future.result()
+                except SchedulerError as e:
+                    retry.append(entry)
+                    retry_after = max(retry_after, e.retry_after)
+                    continue
+                except Exception as e:
+                    results.append({"id": item["id"], "error": str(e)})
+                    continue
+                if key is not None:
+                    cache.put(key, response)
+                result = {"id": item["id"], "response": response, "stats": stats,
+                          "completion_tokens": (req.generation or {}).get("completion_tokens")}
+                if req.schema is not None:
+                    result.update(structured_result(response, req.schema))
+                results.append(result)
+
+            pending = retry
+            if not pending:
+                break
+            delay = min(max(RETRY_DELAY * 2 ** attempt, retry_after), MAX_RETRY_DELAY)
+            attempt += 1
+            logger.info(f"배치 작업 {self.job_id}: 항목 {len(pending)}개를 처리하지 못해 {delay:.0f}초 후 다시 시도합니다.")
+            if self._cancel_event.wait(delay) or not self._wait_for_turn(scheduler):
+                break
+
+        with self._lock:
+            for result in results:
+                self.done += 1
+                self._processed_this_run += 1
+                if "error" in result:
+                    self.failed += 1
+        # 취소로 처리하지 못한 항목은 결과에 기록하지 않으므로 다시 실행하면 처리됨
+        return results
+
+
+class JobManager:
+    """배치 작업을 저장하고 하나씩 순서대로 실행합니다.
+
+    작업 정보와 입력/결과 파일은 JOBS_DIR/<job_id>/에 저장되며, 서버를 다시 시작하면
+    resume()으로 끝나지 않은 작업을 이어서 실행합니다.
+    """
+
+    def __init__(self, jobs_dir=JOBS_DIR, run_hours=None):
+        self.jobs_dir = jobs_dir
+        self.run_hours = run_hours
+        self._jobs = {}
+        self._queue = []
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._thread = None
+
+    def create(self, items, run_hours=None, model_name=None, defaults=None):
+        """항목 목록으로 새 작업을 만들고 대기열에 추가합니다."""
+        from ai_structured import resolve_schema
+
+        if not items:
+            raise ValueError("작업 항목이 비어있습니다.")
+        for item in items:
+            if not isinstance(item, dict) or not item.get("prompt"):
+                raise ValueError("모든 항목에 prompt가 필요합니다.")
+            resolve_schema(item.get("schema", (defaults or {}).get("schema")))
+
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        input_path = os.path.join(job_dir, "input.jsonl")
+        with open(input_path, "w", encoding="utf-8") as f:
+            for line_number, item in enumerate(items, 1):
+                item.setdefault("id", str(line_number))
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+        job = BatchJob(input_path, os.path.join(job_dir, "output.jsonl"), os.path.join(job_dir, "job.json"), job_id,
+                       parse_run_hours(run_hours) if run_hours else self.run_hours, model_name, defaults)
+        job.save()
+        self._enqueue(job)
+        logger.info(f"배치 작업 등록: {job_id} ({job.total}개 항목)")
+        return job
+
+    def resume(self):
+        """디스크에 남아 있는 끝나지 않은 작업을 다시 대기열에 넣습니다."""
+        if not os.path.isdir(self.jobs_dir):
+            return 0
+        resumed = 0
+        for job_id in sorted(os.listdir(self.jobs_dir)):
+            meta_path = os.path.join(self.jobs_dir, job_id, "job.json")
+            if not os.path.exists(meta_path):
+                continue
+            try:
+                job = BatchJob.load(meta_path)
+            except Exception as e:
+                logger.warning(f"배치 작업 복원 실패: {job_id}: {str(e)}")
+                continue
+            if job.finished:
+                with self._lock:
+                    self._jobs[job.job_id] = job
+                continue
+            job.state = "queued"
+            self._enqueue(job)
+            resumed += 1
+        if resumed:
+            logger.info(f"끝나지 않은 배치 작업 {resumed}개를 이어서 실행합니다.")
+        return resumed
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job.to_dict() for job in sorted(jobs, key=lambda job: job.created_at)]
+
+    def cancel(self, job_id):
+        """작업을 취소합니다. 대기 중이면 바로, 실행 중이면 현재 묶음이 끝난 뒤 멈춥니다."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return False
+            job.cancel()
+            if job in self._queue:
+                self._queue.remove(job)
+                job._set_state("cancelled")
+        return True
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            "jobs": len(jobs),
+            "queued": sum(1 for job in jobs if job.state == "queued"),
+            "running": sum(1 for job in jobs if job.state in ("running", "waiting")),
+            "items_done": sum(job.done for job in jobs),
+            "items_failed": sum(job.failed for job in jobs)
+        }
+
+    def _enqueue(self, job):
+        with self._condition:
+            self._jobs[job.job_id] = job
+            self._queue.append(job)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="batch-jobs", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        from ai_scheduler import get_scheduler
+
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                job = self._queue.pop(0)
+            logger.info(f"배치 작업 시작: {job.job_id} ({job.done}/{job.total} 완료됨)")
+            job.run(get_scheduler())
+
+
+# 서버 전체에서 공유하는 작업 관리자
+_job_manager = None
+_job_manager_lock = threading.Lock()
+
+
+def configure_job_manager(**kwargs):
+    """공유 작업 관리자를 주어진 설정으로 생성합니다. 서버 시작 시 한 번 호출합니다."""
+    global _job_manager
+    with _job_manager_lock:
+        _job_manager = JobManager(**kwargs)
+        return _job_manager
+
+
+def get_job_manager():
+    """공유 작업 관리자를 반환합니다. 아직 없으면 기본 설정으로 생성합니다."""
+    global _job_manager
+    with _job_manager_lock:
+        if _job_manager is None:
+            _job_manager = JobManager()
+        return _job_manager
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='학급별 분석 배치 작업 실행 (서버 없이)')
+    parser.add_argument('input', type=str, help='입력 JSONL 파일')
+    parser.add_argument('--output', type=str, default=None, help='결과 JSONL 파일 (기본값: <입력>.out.jsonl)')
+    parser.add_argument('--model', type=str, default='deepseek-ai/DeepSeek-R1-Distill-Qwen-7B', help='사용할 모델')
+    parser.add_argument('--gpu', action='store_true', help='GPU 모드 사용 (기본값: CPU 모드)')
+    parser.add_argument('--max-batch', type=int, default=16, help='한 배치에 묶을 최대 항목 수 (기본값: 16)')
+    parser.add_argument('--max-length', type=int, default=DEFAULT_MAX_LENGTH, help='항목별 최대 생성 토큰 수')
+    parser.add_argument('--temperature', type=float, default=DEFAULT_TEMPERATURE, help='생성 온도')
+    args = parser.parse_args()
+
+    output_path = args.output or os.path.splitext(args.input)[0] + ".out.jsonl"
+
+    from ai_model import load_model
+    from ai_scheduler import configure_scheduler
+
+    if not load_model(args.model, use_cpu=not args.gpu):
+        print(f"모델 '{args.model}' 로드 실패")
+        raise SystemExit(1)
+    # 대화형 요청이 없으므로 대기 시간 제한 없이 큰 배치로 처리
+    scheduler = configure_scheduler(max_batch_size=args.max_batch, max_queue_size=args.max_batch * 2,
+                                    max_wait=24 * 60 * 60)
+
+    job = BatchJob(args.input, output_path, f"{output_path}.job.json",
+                   defaults={"max_length": args.max_length, "temperature": args.temperature})
+    print(f"배치 작업 시작: {job.total}개 중 {job.done}개 완료됨 -> {output_path}")
+    job.run(scheduler)
+    summary = job.to_dict()
+    print(f"배치 작업 {summary['state']}: {summary['done']}/{summary['total']} (실패 {summary['failed']})")
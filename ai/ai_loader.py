@@ -0,0 +1,178 @@
+import logging
+import threading
+import time
+import uuid
+
+from ai_scheduler import SchedulerError
+
+logger = logging.getLogger(__name__)
+
+# 완료된 작업 기록을 유지하는 최대 개수
+MAX_FINISHED_JOBS = 20
+
+
+class ModelLoadingError(SchedulerError):
+    """모델을 백그라운드에서 불러오는 중이라 아직 요청을 처리할 수 없을 때 발생합니다."""
+
+
+class LoadJob:
+    """백그라운드에서 실행되는 모델 로드 작업과 그 진행 상황입니다.
+
+    상태: pending → (calibrating) → downloading → loading → ready 또는 failed
+    """
+
+    def __init__(self, model_name, use_4bit, use_1bit, use_cpu, make_default=True, cold=False, draft_model=None,
+                 quantization=None):
+        self.job_id = uuid.uuid4().hex
+        self.model_name = model_name
+        self.options = {"use_4bit": use_4bit, "use_1bit": use_1bit, "use_cpu": use_cpu, "draft_model": draft_model,
+                        "quantization": quantization}
+        self.make_default = make_default
+        self.cold = cold
+        self.stage = "pending"
+        self.bytes_total = None
+        self.bytes_done = 0
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def update(self, stage=None, bytes_total=None, bytes_done=None):
+        """로드 단계나 바이트 진행 상황을 갱신합니다. ai_model.create_model()이 호출합니다."""
+        with self._lock:
+            if stage is not None:
+                self.stage = stage
+            if bytes_total is not None:
+                self.bytes_total = bytes_total
+            if bytes_done is not None:
+                self.bytes_done = bytes_done
+
+    @property
+    def finished(self):
+        return self.stage in ("ready", "failed")
+
+    def to_dict(self):
+        """작업 상태를 API 응답용 딕셔너리로 반환합니다. 진행률과 남은 시간(ETA)을 함께 계산합니다."""
+        with self._lock:
+            progress = None
+            eta = None
+            if self.bytes_total:
+                progress = round(min(self.bytes_done / self.bytes_total, 1.0), 4)
+                elapsed = time.time() - self.started_at if self.started_at else 0
+                if self.stage == "downloading" and self.bytes_done > 0 and elapsed > 0:
+                    rate = self.bytes_done / elapsed
+                    eta = round((self.bytes_total - self.bytes_done) / rate, 1)
+
+            return {
+                "job_id": self.job_id,
+                "model": self.model_name,
+                "options": self.options,
+                "make_default": self.make_default,
+                "cold": self.cold,
+                "stage": self.stage,
+                "bytes_total": self.bytes_total,
+                "bytes_loaded": self.bytes_done,
+                "progress": progress,
+                "eta": eta,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at
+            }
+
+
+class ModelLoader:
+    """모델 로드 작업을 백그라운드 스레드에서 하나씩 실행합니다.
+
+    로드가 끝나면 모델 레지스트리에 등록(기본 모델이면 교체)하므로 요청을 처리하는 스레드는 막히지 않고,
+    교체된 이전 모델은 진행 중인 요청이 끝난 뒤 해제됩니다.
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+        # 동시에 두 모델을 메모리에 올리지 않도록 로드 작업은 하나씩 실행
+        self._load_lock = threading.Lock()
+
+    def start(self, model_name, use_4bit=False, use_1bit=True, use_cpu=True, make_default=True, cold=False,
+              draft_model=None, quantization=None):
+        """로드 작업을 시작하고 LoadJob을 반환합니다. 같은 설정의 작업이 진행 중이면 그 작업을 반환합니다.
+
+        make_default가 False이면 기본 모델을 바꾸지 않고 레지스트리에 추가만 합니다.
+        cold는 요청이 상주하지 않은 모델을 요구해서 시작된 로드인지 표시합니다.
+        draft_model을 지정하면 그 모델을 초안 모델로 함께 로드하여 추측 디코딩을 사용합니다.
+        quantization은 GGUF 양자화 종류이며, "auto"이면 로드 전에 이 호스트에서 측정해 고릅니다.
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if (not job.finished and job.model_name == model_name and
+                        job.options == {"use_4bit": use_4bit, "use_1bit": use_1bit, "use_cpu": use_cpu,
+                                        "draft_model": draft_model, "quantization": quantization}):
+                    return job
+
+            job = LoadJob(model_name, use_4bit, use_1bit, use_cpu, make_default, cold, draft_model, quantization)
+            self._jobs[job.job_id] = job
+            self._prune()
+
+        thread = threading.Thread(target=self._run, args=(job,), name=f"model-loader-{job.job_id[:8]}", daemon=True)
+        thread.start()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def is_loading(self, model_name):
+        """해당 모델의 로드 작업이 진행 중인지 확인합니다."""
+        with self._lock:
+            return any(not job.finished and job.model_name == model_name for job in self._jobs.values())
+
+    def active_jobs(self):
+        """아직 끝나지 않은 작업 목록을 반환합니다."""
+        with self._lock:
+            return [job for job in self._jobs.values() if not job.finished]
+
+    def _prune(self):
+        """오래된 완료 작업 기록을 정리합니다. _lock을 잡은 상태에서 호출합니다."""
+        finished = sorted((job for job in self._jobs.values() if job.finished), key=lambda job: job.created_at)
+        for job in finished[:-MAX_FINISHED_JOBS]:
+            del self._jobs[job.job_id]
+
+    def _run(self, job):
+        from ai_model import create_model, swap_model
+        from ai_registry import get_registry
+
+        with self._load_lock:
+            job.started_at = time.time()
+            job.update(stage="loading")
+            try:
+                handle = create_model(job.model_name, progress=job, **job.options)
+                if job.make_default:
+                    swap_model(handle)
+                else:
+                    get_registry().put(handle)
+                if job.cold:
+                    get_registry().record_cold_load(time.time() - job.started_at)
+                job.update(stage="ready")
+                logger.info(f"모델 로드 작업 완료: {job.model_name} ({time.time() - job.started_at:.2f}초)")
+            except Exception as e:
+                job.error = str(e)
+                job.update(stage="failed")
+                logger.error(f"모델 로드 작업 실패: {job.model_name}: {str(e)}")
+            finally:
+                job.finished_at = time.time()
+
+
+# 서버 전체에서 공유하는 로더 인스턴스
+_loader = None
+_loader_lock = threading.Lock()
+
+
+def get_loader():
+    """공유 모델 로더를 반환합니다."""
+    global _loader
+    with _loader_lock:
+        if _loader is None:
+            _loader = ModelLoader()
+        return _loader
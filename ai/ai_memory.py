@@ -0,0 +1,437 @@
+import ctypes
+import ctypes.util
+import gc
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECK_INTERVAL = 30.0   # 메모리 가드가 메모리를 확인하는 간격 (초)
+DEFAULT_RECYCLE_COOLDOWN = 600.0  # 같은 모델/워커를 다시 재시작하기 전 최소 간격 (초)
+HISTORY_SIZE = 240              # 증가 추세 계산에 쓰는 최근 측정값 수 (기본 간격에서 2시간)
+TRACEMALLOC_TOP = 20            # /api/debug/memory에서 보여주는 할당 위치 수
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+class _MallInfo2(ctypes.Structure):
+    """glibc mallinfo2()가 반환하는 힙 통계 구조체입니다."""
+
+    _fields_ = [(name, ctypes.c_size_t) for name in (
+        "arena", "ordblks", "smblks", "hblks", "hblkhd", "usmblks", "fsmblks", "uordblks", "fordblks", "keepcost"
+    )]
+
+
+_libc = None
+_libc_loaded = False
+_libc_lock = threading.Lock()
+
+
+def _glibc():
+    """mallinfo2/malloc_trim을 제공하는 glibc를 반환합니다. glibc가 아니면(macOS, Windows, musl) None입니다."""
+    global _libc, _libc_loaded
+    with _libc_lock:
+        if not _libc_loaded:
+            _libc_loaded = True
+            if sys.platform.startswith("linux"):
+                try:
+                    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6")
+                    if hasattr(libc, "mallinfo2") and hasattr(libc, "malloc_trim"):
+                        libc.mallinfo2.restype = _MallInfo2
+                        libc.malloc_trim.argtypes = [ctypes.c_size_t]
+                        _libc = libc
+                except OSError as e:
+                    logger.warning(f"glibc를 불러올 수 없어 힙 통계를 사용하지 않습니다: {str(e)}")
+        return _libc
+
+
+def read_rss(pid=None):
+    """프로세스의 상주 메모리를 {"rss", "rss_anon"} 바이트로 반환합니다. /proc이 없으면 None입니다.
+
+    rss_anon은 파일과 공유 메모리를 뺀 값입니다. mmap으로 읽은 GGUF 가중치는 페이지 캐시에 있어
+    운영체제가 언제든 회수할 수 있으므로, 누수와 OOM 위험은 rss_anon으로 판단합니다.
+    """
+    try:
+        with open(f"/proc/{pid or 'self'}/statm", "r") as f:
+            fields = f.read().split()
+    except OSError:
+        return None
+    resident, shared = int(fields[1]) * _PAGE_SIZE, int(fields[2]) * _PAGE_SIZE
+    return {"rss": resident, "rss_anon": resident - shared}
+
+
+def peak_rss():
+    """이 프로세스의 최대 상주 메모리(바이트)를 반환합니다. resource 모듈이 없으면(Windows) None입니다."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Linux의 ru_maxrss는 KB, macOS는 바이트 단위
+    unit = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+
+
+def heap_stats():
+    """glibc 힙의 할당 통계를 반환합니다. glibc가 아니면 빈 딕셔너리입니다.
+
+    heap_in_use는 malloc으로 할당되어 사용 중인 바이트, heap_free는 해제되었지만 운영체제에 반환되지
+    않은 바이트입니다. heap_free가 계속 커지면 단편화로 RSS가 늘고 있는 것이며 malloc_trim으로 줄일 수 있습니다.
+    """
+    libc = _glibc()
+    if libc is None:
+        return {}
+    info = libc.mallinfo2()
+    return {"heap_bytes": info.arena + info.hblkhd, "heap_in_use": info.uordblks + info.hblkhd,
+            "heap_free": info.fordblks}
+
+
+def cuda_stats():
+    """torch CUDA 할당기의 사용량을 반환합니다. torch를 불러오지 않았거나 CUDA를 쓰지 않으면 빈 딕셔너리입니다."""
+    # torch를 이미 사용 중인 경우에만 확인 (llama.cpp 전용 환경에서 torch를 불러오지 않도록)
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available() or not torch.cuda.is_initialized():
+        return {}
+    return {"cuda_allocated": torch.cuda.memory_allocated(), "cuda_reserved": torch.cuda.memory_reserved(),
+            "cuda_peak": torch.cuda.max_memory_allocated()}
+
+
+def memory_sample():
+    """요청 전후의 차이를 계산할 때 쓰는 가벼운 측정값(RSS, 힙 사용량, CUDA 할당량)을 반환합니다."""
+    sample = read_rss() or {}
+    heap = heap_stats()
+    if heap:
+        sample["heap_in_use"] = heap["heap_in_use"]
+    cuda = cuda_stats()
+    if cuda:
+        sample["cuda_allocated"] = cuda["cuda_allocated"]
+    return sample
+
+
+def process_memory():
+    """이 프로세스의 메모리 상태(RSS, 최대 RSS, 힙, CUDA, tracemalloc, GC)를 반환합니다."""
+    import tracemalloc
+
+    memory = {**(read_rss() or {}), "peak_rss": peak_rss(), **heap_stats(), **cuda_stats(),
+              "gc_counts": gc.get_count(), "gc_garbage": len(gc.garbage)}
+    if tracemalloc.is_tracing():
+        memory["traced"], memory["traced_peak"] = tracemalloc.get_traced_memory()
+    return memory
+
+
+def memory_delta(before, after):
+    """두 memory_sample() 사이의 차이를 {"rss_delta", "heap_delta", "cuda_delta"}로 반환합니다."""
+    delta = {}
+    for key, name in (("rss", "rss_delta"), ("heap_in_use", "heap_delta"), ("cuda_allocated", "cuda_delta")):
+        if key in before and key in after:
+            delta[name] = after[key] - before[key]
+    return delta
+
+
+@contextmanager
+def track_memory(stats):
+    """블록 실행 전후의 메모리 차이를 stats에 누적합니다. stats가 None이면 측정하지 않습니다.
+
+    같은 프로세스에서 동시에 실행 중인 다른 작업의 할당도 함께 잡히므로 요청 하나의 정확한 사용량보다는
+    요청이 반복될 때 메모리가 계속 늘어나는지 확인하는 용도입니다.
+    """
+    if stats is None:
+        yield
+        return
+    before = memory_sample()
+    try:
+        yield
+    finally:
+        after = memory_sample()
+        for key, value in memory_delta(before, after).items():
+            stats[key] = stats.get(key, 0) + value
+        if "rss" in after:
+            stats["rss"] = after["rss"]
+
+
+def release_memory():
+    """GC를 실행하고 할당기가 쥐고 있는 빈 메모리를 운영체제에 돌려줍니다. 돌려준 RSS(바이트)를 반환합니다.
+
+    glibc에서는 malloc_trim으로 해제된 힙 영역을 반환하고, CUDA를 사용 중이면 캐시된 블록을 비웁니다.
+    """
+    before = read_rss()
+    gc.collect()
+    libc = _glibc()
+    if libc is not None:
+        libc.malloc_trim(0)
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available() and torch.cuda.is_initialized():
+        torch.cuda.empty_cache()
+    after = read_rss()
+    return before["rss"] - after["rss"] if before and after else 0
+
+
+def tracemalloc_top(limit=TRACEMALLOC_TOP, baseline=None):
+    """tracemalloc이 켜져 있으면 메모리를 가장 많이 할당한 위치를 반환합니다. 꺼져 있으면 None입니다.
+
+    baseline 스냅샷이 주어지면 그 이후 가장 많이 늘어난 위치를 반환합니다.
+    """
+    import tracemalloc
+
+    if not tracemalloc.is_tracing():
+        return None
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")
+    ))
+    if baseline is not None:
+        stats = snapshot.compare_to(baseline, "lineno")[:limit]
+        return [{"location": str(stat.traceback), "size": stat.size, "size_diff": stat.size_diff,
+                 "count": stat.count, "count_diff": stat.count_diff} for stat in stats]
+    return [{"location": str(stat.traceback), "size": stat.size, "count": stat.count}
+            for stat in snapshot.statistics("lineno")[:limit]]
+
+
+class MemoryGuard:
+    """프로세스 메모리를 주기적으로 확인하고, 한도를 넘으면 단계적으로 메모리를 회수합니다.
+
+    한도는 rss_anon(가중치 mmap을 뺀 상주 메모리) 기준이며 다음 순서로 한도 아래로 내려갈 때까지 진행합니다.
+    1. GC와 malloc_trim/CUDA 캐시 비우기
+    2. 세션 KV 캐시 비우기
+    3. 사용 중이 아닌 기본 모델 외 모델 제거
+    4. 기본 llama.cpp 모델을 다시 로드하여 컨텍스트 재생성 (새 모델로 교체된 뒤 이전 컨텍스트가 해제됨)
+    워커 모드에서는 한도를 넘은 워커 프로세스를 진행 중인 작업이 끝난 뒤 다시 시작합니다.
+    같은 모델이나 워커의 재시작은 cooldown 초에 한 번으로 제한합니다.
+    """
+
+    def __init__(self, limit_bytes=None, interval=DEFAULT_CHECK_INTERVAL, cooldown=DEFAULT_RECYCLE_COOLDOWN):
+        self.limit_bytes = limit_bytes
+        self.interval = interval
+        self.cooldown = cooldown
+        self.started_at = time.time()
+        self._history = deque(maxlen=HISTORY_SIZE)
+        self._recycled_at = {}
+        self._lock = threading.Lock()
+        self._check_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._baseline = None
+        self._checks = 0
+        self._over_limit = 0
+        self._released_bytes = 0
+        self._session_clears = 0
+        self._evictions = 0
+        self._recycles = 0
+        self._worker_recycles = 0
+        self._last_action = None
+
+    def start(self):
+        """한도가 설정되어 있으면 백그라운드 확인 스레드를 시작합니다."""
+        if not self.limit_bytes or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="memory-guard", daemon=True)
+        self._thread.start()
+        logger.info(f"메모리 가드 시작: 한도 {self.limit_bytes / 1024 ** 2:.0f}MB, 확인 간격 {self.interval:.0f}초")
+
+    def stop(self):
+        self._stop_event.set()
+
+    def start_tracing(self, frames=1):
+        """tracemalloc을 켜고 지금 상태를 비교 기준으로 저장합니다. 추적 중에는 할당이 느려집니다."""
+        import tracemalloc
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self._baseline = tracemalloc.take_snapshot()
+        logger.info(f"tracemalloc 추적 시작 (스택 {frames}단계)")
+
+    def top_allocations(self, limit=TRACEMALLOC_TOP):
+        """추적 시작 이후 가장 많이 늘어난 할당 위치를 반환합니다. 추적 중이 아니면 None입니다."""
+        return tracemalloc_top(limit, self._baseline)
+
+    def check(self):
+        """메모리를 한 번 확인하고 한도를 넘었으면 회수합니다. 수행한 조치 목록을 반환합니다."""
+        with self._check_lock:
+            sample = read_rss()
+            if sample is None:
+                return []
+            with self._lock:
+                self._checks += 1
+                self._history.append((time.time(), sample["rss"], sample["rss_anon"]))
+
+            actions = []
+            if self.limit_bytes and sample["rss_anon"] > self.limit_bytes:
+                with self._lock:
+                    self._over_limit += 1
+                logger.warning(f"메모리 한도 초과: {sample['rss_anon'] / 1024 ** 2:.0f}MB "
+                               f"(한도 {self.limit_bytes / 1024 ** 2:.0f}MB), 메모리를 회수합니다.")
+                actions = self._reclaim()
+            actions.extend(self._check_workers())
+            if actions:
+                with self._lock:
+                    self._last_action = {"time": time.time(), "actions": actions, "rss_before": sample["rss_anon"],
+                                         "rss_after": (read_rss() or sample)["rss_anon"]}
+            return actions
+
+    def stats(self):
+        """현재 메모리 상태와 가드가 수행한 조치 횟수를 반환합니다."""
+        memory = process_memory()
+        with self._lock:
+            return {
+                **memory,
+                "limit_bytes": self.limit_bytes,
+                "interval": self.interval,
+                "running": self._thread is not None and self._thread.is_alive(),
+                "growth_per_hour": self._growth_per_hour(),
+                "checks": self._checks,
+                "over_limit": self._over_limit,
+                "released_bytes": self._released_bytes,
+                "session_clears": self._session_clears,
+                "evictions": self._evictions,
+                "recycles": self._recycles,
+                "worker_recycles": self._worker_recycles,
+                "last_action": self._last_action
+            }
+
+    def history(self):
+        """최근 측정값 [(시각, rss, rss_anon), ...]을 반환합니다."""
+        with self._lock:
+            return list(self._history)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"메모리 확인 중 오류 발생: {str(e)}")
+
+    def _growth_per_hour(self):
+        """측정 기록의 처음과 끝을 비교한 시간당 rss_anon 증가량입니다. _lock을 잡은 상태에서 호출합니다."""
+        if len(self._history) < 2:
+            return None
+        (start, _, first), (end, _, last) = self._history[0], self._history[-1]
+        if end - start < 60:
+            return None
+        return int((last - first) * 3600 / (end - start))
+
+    def _under_limit(self):
+        sample = read_rss()
+        return sample is None or sample["rss_anon"] <= self.limit_bytes
+
+    def _reclaim(self):
+        """한도 아래로 내려갈 때까지 회수 단계를 차례로 수행합니다."""
+        from ai_registry import get_registry
+        from ai_session_cache import get_session_cache
+
+        actions = []
+        released = release_memory()
+        with self._lock:
+            self._released_bytes += max(released, 0)
+        actions.append("release")
+        if self._under_limit():
+            return actions
+
+        session_cache = get_session_cache()
+        if session_cache.stats()["sessions"]:
+            session_cache.clear()
+            release_memory()
+            with self._lock:
+                self._session_clears += 1
+            actions.append("clear_session_cache")
+            if self._under_limit():
+                return actions
+
+        evicted = get_registry().evict_idle()
+        if evicted:
+            release_memory()
+            with self._lock:
+                self._evictions += len(evicted)
+            actions.append("evict:" + ",".join(evicted))
+            if self._under_limit():
+                return actions
+
+        if self._recycle_default_model():
+            actions.append("recycle_model")
+        return actions
+
+    def _cooling_down(self, key):
+        with self._lock:
+            return time.time() - self._recycled_at.get(key, 0) < self.cooldown
+
+    def _mark_recycled(self, key):
+        with self._lock:
+            self._recycled_at[key] = time.time()
+
+    def _recycle_default_model(self):
+        """기본 llama.cpp 모델을 같은 옵션으로 다시 로드하도록 로더에 요청합니다.
+
+        새 모델이 준비되면 swap_model()이 교체하고, 이전 모델의 컨텍스트는 사용 중인 요청이 끝나면 해제됩니다.
+        가중치는 mmap으로 공유되므로 다시 로드하는 동안 늘어나는 메모리는 새 컨텍스트 크기 정도입니다.
+        transformers 모델은 다시 로드하는 동안 가중치가 두 벌이 되므로 재시작하지 않습니다.
+        """
+        from ai_loader import get_loader
+        from ai_registry import get_registry
+
+        handle = get_registry().get()
+        if handle is None or get_loader().active_jobs():
+            return False
+        if not handle.is_llama_cpp:
+            logger.warning(f"transformers 모델({handle.name})은 메모리 가드가 다시 로드하지 않습니다.")
+            return False
+        if self._cooling_down(handle.name):
+            return False
+        self._mark_recycled(handle.name)
+        logger.warning(f"메모리 회수를 위해 기본 모델을 다시 로드합니다: {handle.name} ({handle.handle_id})")
+        get_loader().start(handle.name, make_default=True, **handle.options)
+        with self._lock:
+            self._recycles += 1
+        return True
+
+    def _check_workers(self):
+        """워커 모드이면 한도를 넘은 워커 프로세스를 하나 골라 다시 시작하도록 요청합니다."""
+        from ai_workers import get_worker_pool
+
+        pool = get_worker_pool()
+        if pool is None or not self.limit_bytes:
+            return []
+        workers = pool.stats()["workers"]
+        if any(worker["state"] in ("starting", "recycling", "stopping") for worker in workers):
+            return []
+        over = [worker for worker in workers
+                if worker["state"] == "ready" and worker["memory"] and worker["memory"]["rss_anon"] > self.limit_bytes
+                and not self._cooling_down(f"worker-{worker['index']}")]
+        if not over:
+            return []
+        worker = max(over, key=lambda worker: worker["memory"]["rss_anon"])
+        logger.warning(f"워커 {worker['index']}의 메모리가 한도를 넘었습니다 "
+                       f"({worker['memory']['rss_anon'] / 1024 ** 2:.0f}MB). 진행 중인 작업이 끝나면 다시 시작합니다.")
+        self._mark_recycled(f"worker-{worker['index']}")
+        if not pool.recycle(worker["index"]):
+            return []
+        with self._lock:
+            self._worker_recycles += 1
+        return [f"recycle_worker:{worker['index']}"]
+
+
+# 서버 전체에서 공유하는 메모리 가드
+_guard = None
+_guard_lock = threading.Lock()
+
+
+def configure_memory_guard(**kwargs):
+    """공유 메모리 가드를 주어진 설정으로 생성하고 시작합니다."""
+    global _guard
+    with _guard_lock:
+        if _guard is not None:
+            _guard.stop()
+        _guard = MemoryGuard(**kwargs)
+        _guard.start()
+        return _guard
+
+
+def get_memory_guard():
+    """공유 메모리 가드를 반환합니다. 아직 없으면 한도 없이(측정만 하는) 기본 설정으로 생성합니다."""
+    global _guard
+    with _guard_lock:
+        if _guard is None:
+            _guard = MemoryGuard()
+        return _guard
@@ -0,0 +1,255 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 히스토그램 버킷 (초 단위 시간, 초당 토큰 수, 토큰 수)
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 200, 500)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+STEP_BUCKETS = (1, 1.25, 1.5, 2, 2.5, 3, 4, 5, 6, 8)
+# 요청 전후 메모리 차이 버킷 (바이트, 해제되면 음수)
+BYTE_BUCKETS = (-64 * 1024 ** 2, -1024 ** 2, 0, 64 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2,
+                64 * 1024 ** 2, 256 * 1024 ** 2, 1024 ** 3)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """레이블별로 누적되는 카운터입니다."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in self._values.items()]
+
+
+class Histogram:
+    """레이블별 관측값 분포를 누적 버킷으로 기록하는 히스토그램입니다."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if value is None:
+            return
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [버킷별 개수, 합계, 전체 개수]
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, ('le', bound))} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, ('le', '+Inf'))} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {round(total, 6)}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Metrics:
+    """서버 지표를 모아 Prometheus 텍스트 형식으로 내보냅니다.
+
+    생성 지표는 모델과 백엔드(llama_cpp, transformers) 레이블별로 기록되며,
+    캐시와 대기열 같은 상태 값은 내보낼 때 각 구성 요소의 stats()에서 읽어 옵니다.
+    """
+
+    def __init__(self):
+        generation_labels = ("model", "backend")
+        # 요청 단위 지표는 우선순위 클래스별로도 나눔 (대화형 요청의 지연 시간을 따로 확인)
+        request_labels = generation_labels + ("priority",)
+        self.http_requests = Counter("ai_http_requests_total", "HTTP 요청 수", ("endpoint", "method", "status"))
+        self.http_duration = Histogram("ai_http_request_duration_seconds", "HTTP 응답 헤더까지의 처리 시간",
+                                       ("endpoint",))
+        self.http_rss_delta = Histogram("ai_http_rss_delta_bytes", "API 요청 처리 전후의 RSS 차이", ("endpoint",),
+                                        BYTE_BUCKETS)
+        self.generation_requests = Counter("ai_generation_requests_total", "생성 요청 수 (결과별)",
+                                           request_labels + ("outcome",))
+        self.queue_wait = Histogram("ai_queue_wait_seconds", "대기열에서 기다린 시간", request_labels)
+        self.prompt_eval = Histogram("ai_prompt_eval_seconds", "프롬프트 평가(prefill) 시간", generation_labels)
+        self.ttft = Histogram("ai_time_to_first_token_seconds", "요청 접수부터 첫 토큰까지의 시간", request_labels)
+        self.generation_time = Histogram("ai_generation_seconds", "요청 접수부터 생성 완료까지의 시간",
+                                         request_labels)
+        self.tokens_per_second = Histogram("ai_tokens_per_second", "디코딩 속도 (초당 생성 토큰 수)",
+                                           generation_labels, RATE_BUCKETS)
+        self.prompt_tokens = Histogram("ai_prompt_tokens", "프롬프트 토큰 수", generation_labels, TOKEN_BUCKETS)
+        self.completion_tokens = Counter("ai_completion_tokens_total", "생성된 토큰 수", generation_labels)
+        self.batch_size = Histogram("ai_batch_size", "한 번에 생성한 요청 수", generation_labels, (1, 2, 4, 8, 16, 32))
+        self.draft_tokens = Counter("ai_speculative_draft_tokens_total", "추측 디코딩에서 초안 모델이 제안한 토큰 수",
+                                    generation_labels)
+        self.accepted_tokens = Counter("ai_speculative_accepted_tokens_total", "주 모델이 받아들인 초안 토큰 수",
+                                       generation_labels)
+        self.tokens_per_step = Histogram("ai_speculative_tokens_per_step",
+                                         "주 모델 검증 1회당 생성 토큰 수 (디코딩 스텝 기준 속도 향상 배율)",
+                                         generation_labels, STEP_BUCKETS)
+        self.generation_rss_delta = Histogram("ai_generation_rss_delta_bytes", "생성 전후의 RSS 차이 (배치 단위)",
+                                              generation_labels, BYTE_BUCKETS)
+        self.generation_heap_delta = Histogram("ai_generation_heap_delta_bytes",
+                                               "생성 전후의 malloc 힙 사용량 차이 (배치 단위)",
+                                               generation_labels, BYTE_BUCKETS)
+        self._metrics = [
+            self.http_requests, self.http_duration, self.http_rss_delta, self.generation_requests, self.queue_wait,
+            self.prompt_eval, self.ttft, self.generation_time, self.tokens_per_second, self.prompt_tokens,
+            self.completion_tokens, self.batch_size, self.draft_tokens, self.accepted_tokens, self.tokens_per_step,
+            self.generation_rss_delta, self.generation_heap_delta
+        ]
+
+    def record_http(self, endpoint, method, status, duration, rss_delta=None):
+        self.http_requests.inc(endpoint=endpoint, method=method, status=status)
+        self.http_duration.observe(duration, endpoint=endpoint)
+        self.http_rss_delta.observe(rss_delta, endpoint=endpoint)
+
+    def record_batch(self, batch):
+        """스케줄러가 처리를 마친 배치의 요청별 지표를 기록합니다."""
+        stats = batch[0].generation or {}
+        labels = {"model": stats.get("model") or batch[0].model_name or "default",
+                  "backend": stats.get("backend", "unknown")}
+
+        for req in batch:
+            if req.cancelled:
+                outcome = "cancelled"
+            elif req.future.done() and req.future.exception() is None:
+                outcome = "ok"
+            else:
+                outcome = "error"
+            request_labels = {**labels, "priority": req.priority}
+            self.generation_requests.inc(outcome=outcome, **request_labels)
+            if req.started_at:
+                self.queue_wait.observe(req.started_at - req.submitted_at, **request_labels)
+            if req.first_token_at:
+                self.ttft.observe(req.first_token_at - req.submitted_at, **request_labels)
+            if outcome == "ok" and req.finished_at:
+                self.generation_time.observe(req.finished_at - req.submitted_at, **request_labels)
+
+        if not stats:
+            return
+        self.batch_size.observe(len(batch), **labels)
+        self.prompt_eval.observe(stats.get("prompt_eval_time"), **labels)
+        if stats.get("prompt_tokens"):
+            self.prompt_tokens.observe(stats["prompt_tokens"] / len(batch), **labels)
+        completion_tokens = stats.get("completion_tokens") or 0
+        self.completion_tokens.inc(completion_tokens, **labels)
+        decode_time = stats.get("decode_time")
+        if completion_tokens and decode_time:
+            self.tokens_per_second.observe(completion_tokens / decode_time, **labels)
+        self.generation_rss_delta.observe(stats.get("rss_delta"), **labels)
+        self.generation_heap_delta.observe(stats.get("heap_delta"), **labels)
+        verify_steps = stats.get("verify_steps")
+        if verify_steps:
+            self.draft_tokens.inc(stats.get("draft_tokens", 0), **labels)
+            self.accepted_tokens.inc(stats.get("accepted_tokens", 0), **labels)
+            self.tokens_per_step.observe(completion_tokens / verify_steps, **labels)
+
+    def render(self):
+        """모든 지표를 Prometheus 텍스트 형식 문자열로 반환합니다."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        lines.extend(self._render_component_stats())
+        return "\n".join(lines) + "\n"
+
+    def _render_component_stats(self):
+        """스케줄러, 캐시, 모델 레지스트리, 메모리 가드의 현재 통계를 게이지/카운터로 변환합니다."""
+        from ai_context import get_history_manager
+        from ai_memory import get_memory_guard
+        from ai_registry import get_registry
+        from ai_response_cache import get_response_cache
+        from ai_scheduler import get_scheduler
+        from ai_session_cache import get_session_cache
+
+        sources = [
+            ("ai_scheduler", get_scheduler().stats, {
+                "queue_depth": "gauge", "estimated_wait": "gauge", "rejected": "counter", "timed_out": "counter"
+            }),
+            ("ai_response_cache", get_response_cache().stats, {
+                "entries": "gauge", "hits": "counter", "misses": "counter", "hit_rate": "gauge"
+            }),
+            ("ai_session_cache", get_session_cache().stats, {
+                "sessions": "gauge", "bytes": "gauge", "hits": "counter", "misses": "counter",
+                "evictions": "counter", "reused_tokens": "counter"
+            }),
+            ("ai_chat_history", get_history_manager().stats, {
+                "sessions": "gauge", "summarized_messages": "counter", "resets": "counter"
+            }),
+            ("ai_models", get_registry().stats, {
+                "bytes": "gauge", "hits": "counter", "cold_loads": "counter", "cold_load_seconds": "counter",
+                "evictions": "counter"
+            }),
+            ("ai_memory", get_memory_guard().stats, {
+                "rss": "gauge", "rss_anon": "gauge", "peak_rss": "gauge", "heap_in_use": "gauge", "heap_free": "gauge",
+                "cuda_allocated": "gauge", "cuda_reserved": "gauge", "limit_bytes": "gauge",
+                "growth_per_hour": "gauge", "over_limit": "counter", "released_bytes": "counter",
+                "session_clears": "counter", "evictions": "counter", "recycles": "counter",
+                "worker_recycles": "counter"
+            })
+        ]
+
+        lines = []
+        for prefix, stats_fn, fields in sources:
+            try:
+                stats = stats_fn()
+            except Exception as e:
+                logger.error(f"지표 수집 실패 ({prefix}): {str(e)}")
+                continue
+            for field, kind in fields.items():
+                value = stats.get(field)
+                if value is None:
+                    continue
+                name = f"{prefix}_{field}_total" if kind == "counter" else f"{prefix}_{field}"
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {value}")
+        return lines
+
+
+# 서버 전체에서 공유하는 지표 인스턴스
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """공유 지표 인스턴스를 반환합니다."""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+        return _metrics
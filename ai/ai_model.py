@@ -1,19 +1,23 @@
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+import hashlib
+import importlib.util
 import logging
+import pickle
+import threading
 import time
 import os
 import json
 import subprocess
 import sys
+from contextlib import contextmanager
 from pathlib import Path
 
-# llama.cpp 지원을 위한 imports 추가 (설치된 경우)
-try:
-    from llama_cpp import Llama
-    LLAMA_CPP_AVAILABLE = True
-except ImportError:
-    LLAMA_CPP_AVAILABLE = False
+from ai_memory import track_memory
+from ai_registry import ModelHandle, get_registry
+from ai_session_cache import common_prefix_length, get_session_cache
+
+# torch, transformers, llama_cpp는 불러오는 데 시간이 오래 걸리므로 선택된 백엔드가 필요로 할 때 함수 안에서 불러옴
+# llama.cpp 지원 여부 (설치된 경우)
+LLAMA_CPP_AVAILABLE = importlib.util.find_spec("llama_cpp") is not None
 
 # 로깅 설정
 logging.basicConfig(
@@ -31,73 +35,207 @@ os.environ["TRANSFORMERS_CACHE"] = CACHE_DIR
 os.environ["HF_HOME"] = CACHE_DIR
 os.environ["HF_HUB_DISABLE_SYMLINKS_WARNING"] = "1"
 
-# 전역 변수로 모델과 토크나이저 선언
+# 미리 평가해 둔 llama.cpp 상태(스냅샷) 저장 위치
+SNAPSHOT_DIR = os.path.join(CACHE_DIR, "snapshots")
+
+# 분석 요청이 공통으로 시작하는 지시문. 모델 로드 시 이 접두어까지 평가한 상태를 스냅샷으로 저장함
+SYSTEM_PROMPT = "학급 출결 관리 시스템 AI 비서로서 아래 출결 통계 요약을 바탕으로 요청에 답변해주세요."
+
+# 전역 변수로 모델과 토크나이저 선언 (현재 활성 모델 핸들의 내용을 반영)
 model = None
 tokenizer = None
 model_name = None
 is_loaded = False
 is_llama_cpp = False
 
+# 추측 디코딩에서 초안 모델이 한 번에 제안하는 토큰 수
+DEFAULT_DRAFT_TOKENS = 8
+
+# 추론에 사용할 CPU 스레드 수 (None이면 백엔드 기본값 사용, 워커 프로세스에서 코어 수에 맞춰 설정)
+thread_count = None
+
+@contextmanager
+def acquire_model(name=None):
+    """모델 핸들을 잡고 반환합니다. name이 없으면 기본 모델을 사용합니다.
+    
+    블록이 끝날 때까지 모델이 교체되거나 제거되어도 해제되지 않습니다.
+    """
+    handle = get_registry().acquire(name)
+    try:
+        yield handle
+    finally:
+        handle.release()
+
+def swap_model(handle):
+    """새 모델 핸들을 기본 모델로 원자적으로 등록하고, 같은 이름의 이전 모델은 사용 중인 요청이 끝나면 해제합니다."""
+    global model, tokenizer, model_name, is_loaded, is_llama_cpp
+    
+    get_registry().put(handle, make_default=True)
+    model = handle.model
+    tokenizer = handle.tokenizer
+    model_name = handle.name
+    is_llama_cpp = handle.is_llama_cpp
+    is_loaded = True
+    save_model_info(handle.name, handle.model_type)
+
+def get_active_model_info():
+    """현재 기본 모델의 정보를 반환합니다."""
+    handle = get_registry().get()
+    return handle.to_dict() if handle is not None else None
+
 def is_model_loaded():
     """모델이 로드되었는지 확인합니다."""
     return is_loaded
 
+def set_thread_count(threads):
+    """이 프로세스에서 추론에 사용할 CPU 스레드 수를 설정합니다. 이후 로드되는 모델에 적용됩니다."""
+    global thread_count
+    thread_count = threads
+    # torch를 이미 불러온 경우에만 바로 적용 (아니면 transformers 모델을 로드할 때 적용)
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(threads)
+
 def check_cuda_available():
     """CUDA 사용 가능 여부를 확인합니다."""
+    import torch
     return torch.cuda.is_available()
 
+@contextmanager
+def timed_phase(timings, name):
+    """블록의 소요 시간을 timings[name]에 기록하고 로그로 남깁니다."""
+    start_time = time.time()
+    try:
+        yield
+    finally:
+        timings[name] = round(time.time() - start_time, 3)
+        logger.info(f"[단계] {name}: {timings[name]:.2f}초")
+
 def install_llama_cpp():
     """llama-cpp-python을 설치합니다."""
+    global LLAMA_CPP_AVAILABLE
     try:
         subprocess.check_call([sys.executable, "-m", "pip", "install", "llama-cpp-python"])
+        importlib.invalidate_caches()
+        LLAMA_CPP_AVAILABLE = True
         logger.info("llama-cpp-python 설치 완료!")
         return True
     except Exception as e:
         logger.error(f"llama-cpp-python 설치 실패: {str(e)}")
         return False
 
-def download_gguf_model(model_name):
-    """해당 모델의 1bit 양자화 GGUF 모델을 다운로드합니다."""
-    os.makedirs(GGUF_DIR, exist_ok=True)
-    
-    # 모델명에 따라 적절한 GGUF 모델 매핑
-    gguf_models = {
-        "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B": {
-            "repo": "TheBloke/deepseek-llm-7B-chat-GGUF",  # B가 대문자
-            "file": "deepseek-llm-7b-chat.Q2_K.gguf"  # Q2_K가 정확한 파일명
-        },
-        "deepseek-ai/DeepSeek-V3-lite": {
-            "repo": "TheBloke/DeepSeek-Coder-V2-Lite-GGUF",
-            "file": "deepseek-coder-v2-lite.Q2_K.gguf"
-        },
-        "deepseek-ai/DeepSeek-R1-Distill-Llama-8B": {
-            "repo": "TheBloke/deepseek-llm-7B-chat-GGUF",  # B가 대문자
-            "file": "deepseek-llm-7b-chat.Q2_K.gguf"
-        }
+def _watch_download(directory, progress, stop_event, interval=0.5):
+    """다운로드 중인 임시 파일(*.incomplete)의 크기를 주기적으로 진행 상황에 반영합니다."""
+    while not stop_event.wait(interval):
+        downloaded = 0
+        for path in Path(directory).rglob("*.incomplete"):
+            try:
+                downloaded += path.stat().st_size
+            except OSError:
+                pass
+        if downloaded:
+            progress.update(bytes_done=downloaded)
+
+# 모델명에 따라 적절한 GGUF 모델 매핑 (file의 {quant} 자리에 양자화 종류가 들어감)
+GGUF_MODELS = {
+    "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B": {
+        "repo": "TheBloke/deepseek-llm-7B-chat-GGUF",  # B가 대문자
+        "file": "deepseek-llm-7b-chat.{quant}.gguf",
+        "quant": "Q2_K",  # Q2_K가 정확한 파일명
+        "tokenizer": "deepseek-llm"
+    },
+    "deepseek-ai/DeepSeek-V3-lite": {
+        "repo": "TheBloke/DeepSeek-Coder-V2-Lite-GGUF",
+        "file": "deepseek-coder-v2-lite.{quant}.gguf",
+        "quant": "Q2_K",
+        "tokenizer": "deepseek-coder-v2"
+    },
+    "deepseek-ai/DeepSeek-R1-Distill-Llama-8B": {
+        "repo": "TheBloke/deepseek-llm-7B-chat-GGUF",  # B가 대문자
+        "file": "deepseek-llm-7b-chat.{quant}.gguf",
+        "quant": "Q2_K",
+        "tokenizer": "deepseek-llm"
+    },
+    "deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B": {
+        "repo": "bartowski/DeepSeek-R1-Distill-Qwen-1.5B-GGUF",
+        "file": "DeepSeek-R1-Distill-Qwen-1.5B-{quant}.gguf",
+        "quant": "Q4_K_M",
+        "tokenizer": "qwen2"
     }
-    
-    model_info = gguf_models.get(model_name)
+}
+
+# transformers 백엔드에서 각 모델이 쓰는 토크나이저 (같은 값끼리만 추측 디코딩의 주 모델/초안 모델로 묶을 수 있음)
+MODEL_TOKENIZERS = {
+    "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B": "qwen2",
+    "deepseek-ai/DeepSeek-V3-lite": "deepseek-v3",
+    "deepseek-ai/DeepSeek-R1-Distill-Llama-8B": "llama3",
+    "deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B": "qwen2"
+}
+
+def gguf_location(model_name, quantization=None):
+    """모델의 GGUF 저장소와 파일명을 (저장소, 파일명)으로 반환합니다. quantization이 없으면 기본 양자화를 사용합니다."""
+    model_info = GGUF_MODELS.get(model_name)
     if not model_info:
         logger.warning(f"모델 '{model_name}'에 대한 GGUF 버전을 찾을 수 없습니다. 기본 모델을 사용합니다.")
-        model_info = {
-            "repo": "TheBloke/deepseek-llm-7B-chat-GGUF",  # B가 대문자
-            "file": "deepseek-llm-7b-chat.Q2_K.gguf"
-        }
+        model_info = GGUF_MODELS["deepseek-ai/DeepSeek-R1-Distill-Qwen-7B"]
+    return model_info["repo"], model_info["file"].format(quant=quantization or model_info["quant"])
+
+def uses_llama_cpp(use_1bit=True, use_cpu=True, quantization=None):
+    """로드 옵션이 llama.cpp(GGUF) 백엔드를 사용하는지 확인합니다 (llama-cpp-python이 없으면 설치 후 사용)."""
+    return use_cpu and bool(use_1bit or quantization)
+
+def check_draft_model(model_name, draft_model, use_1bit=True, use_cpu=True, quantization=None):
+    """초안 모델이 주 모델과 같은 토크나이저를 쓰는지 로드 전에 확인합니다. 맞지 않으면 ValueError를 발생시킵니다.
+    
+    llama.cpp 백엔드는 실제로 받는 GGUF 파일의 토크나이저를, transformers 백엔드는 원본 모델의 토크나이저를 비교합니다.
+    목록에 없는 모델이면 확인하지 않고 로드 후 어휘 비교에 맡깁니다.
+    """
+    if not draft_model:
+        return
+    if uses_llama_cpp(use_1bit=use_1bit, use_cpu=use_cpu, quantization=quantization):
+        default = GGUF_MODELS["deepseek-ai/DeepSeek-R1-Distill-Qwen-7B"]
+        main = GGUF_MODELS.get(model_name, default)["tokenizer"]
+        draft = GGUF_MODELS.get(draft_model, default)["tokenizer"]
+        backend = "llama.cpp(GGUF)"
+    else:
+        main, draft = MODEL_TOKENIZERS.get(model_name), MODEL_TOKENIZERS.get(draft_model)
+        backend = "transformers"
+        if main is None or draft is None:
+            return
+    if main != draft:
+        raise ValueError(f"{backend} 백엔드에서 초안 모델 '{draft_model}'의 토크나이저({draft})가 주 모델 "
+                         f"'{model_name}'({main})과 달라 추측 디코딩에 사용할 수 없습니다.")
+
+def download_gguf_model(model_name, progress=None, quantization=None):
+    """해당 모델의 양자화 GGUF 모델을 다운로드합니다 (기본값: 모델별 최소 크기 양자화).
+    
+    progress가 주어지면 다운로드한 바이트 수를 진행 상황에 반영합니다.
+    """
+    os.makedirs(GGUF_DIR, exist_ok=True)
     
-    target_repo = model_info["repo"]
-    target_file = model_info["file"]
+    target_repo, target_file = gguf_location(model_name, quantization)
     gguf_path = os.path.join(GGUF_DIR, target_file)
     
     if os.path.exists(gguf_path):
         logger.info(f"GGUF 모델이 이미 존재합니다: {gguf_path}")
+        if progress is not None:
+            size = os.path.getsize(gguf_path)
+            progress.update(bytes_total=size, bytes_done=size)
         return gguf_path
     
+    stop_event = threading.Event()
     try:
         logger.info(f"GGUF 모델 다운로드 중: {target_repo}/{target_file}")
         print(f"1bit 양자화 모델 다운로드 중: {target_file}. 파일 크기가 크므로 시간이 걸릴 수 있습니다...")
         
         # Hugging Face Hub에서 모델 다운로드
-        from huggingface_hub import hf_hub_download
+        from huggingface_hub import get_hf_file_metadata, hf_hub_download, hf_hub_url
+        
+        if progress is not None:
+            metadata = get_hf_file_metadata(hf_hub_url(target_repo, target_file))
+            progress.update(stage="downloading", bytes_total=metadata.size, bytes_done=0)
+            threading.Thread(target=_watch_download, args=(GGUF_DIR, progress, stop_event), daemon=True).start()
+        
         gguf_file = hf_hub_download(
             repo_id=target_repo,
             filename=target_file,
@@ -105,77 +243,149 @@ def download_gguf_model(model_name):
             local_dir_use_symlinks=False
         )
         
+        if progress is not None:
+            size = os.path.getsize(gguf_file)
+            progress.update(bytes_total=size, bytes_done=size)
         logger.info(f"GGUF 모델 다운로드 완료: {gguf_file}")
         return gguf_file
     except Exception as e:
         logger.error(f"GGUF 모델 다운로드 실패: {str(e)}")
         return None
+    finally:
+        stop_event.set()
 
-def load_model(model_name_or_path="deepseek-ai/DeepSeek-R1-Distill-Qwen-7B", use_4bit=False, use_1bit=True, use_cpu=True):
-    """모델과 토크나이저를 로드합니다."""
-    global model, tokenizer, model_name, is_loaded, is_llama_cpp
+def create_model(model_name_or_path="deepseek-ai/DeepSeek-R1-Distill-Qwen-7B", use_4bit=False, use_1bit=True, use_cpu=True,
+                 draft_model=None, quantization=None, progress=None):
+    """모델과 토크나이저를 로드하여 ModelHandle로 반환합니다. 현재 활성 모델은 바꾸지 않습니다.
     
-    model_name = model_name_or_path
-    logger.info(f"모델 로딩 시작: {model_name_or_path}")
+    draft_model을 지정하면 같은 어휘를 쓰는 작은 모델을 초안 모델로 함께 로드하여 추측 디코딩을 사용합니다.
+    quantization으로 GGUF 양자화 종류(예: Q4_K_M)를 고르며, "auto"이면 이 호스트에서 측정한 가장 빠른
+    양자화와 스레드 수를 사용합니다 (ai_calibration 참고). 지정하면 CPU 모드에서 llama.cpp 백엔드를 사용합니다.
+    로드에 실패하면 예외를 발생시킵니다. progress가 주어지면 로드 단계와 바이트 수를 반영합니다.
+    """
+    logger.info(f"모델 로딩 시작: {model_name_or_path}" + (f" (초안 모델: {draft_model})" if draft_model else ""))
     start_time = time.time()
+    options = {"use_4bit": use_4bit, "use_1bit": use_1bit, "use_cpu": use_cpu, "draft_model": draft_model,
+               "quantization": quantization}
+    timings = {}
     
     # 캐시 디렉토리 생성
     os.makedirs(CACHE_DIR, exist_ok=True)
     logger.info(f"모델 캐시 디렉토리: {CACHE_DIR}")
     
-    # CUDA 사용 가능 여부 확인
-    cuda_available = check_cuda_available()
-    if not cuda_available and not use_cpu:
+    # CUDA 사용 가능 여부 확인 (CPU 모드에서는 torch를 불러오지 않도록 GPU 모드에서만 확인)
+    if not use_cpu and not check_cuda_available():
         logger.warning("CUDA를 사용할 수 없습니다. CPU 모드로 전환합니다.")
         use_cpu = True
     
+    # 토크나이저가 다른 초안 모델은 두 모델을 모두 받고 로드하기 전에 거부
+    check_draft_model(model_name_or_path, draft_model, use_1bit, use_cpu, quantization)
+    
+    llama_cpp_backend = uses_llama_cpp(use_1bit=use_1bit, use_cpu=use_cpu, quantization=quantization)
     try:
         # CPU 모드에서 1bit 양자화를 위해 llama.cpp 사용
-        if use_cpu and use_1bit and LLAMA_CPP_AVAILABLE:
+        if llama_cpp_backend and LLAMA_CPP_AVAILABLE:
             logger.info("CPU에서 1bit 양자화를 위해 llama.cpp 사용")
             
-            # GGUF 모델 다운로드
-            gguf_path = download_gguf_model(model_name_or_path)
+            # 자동 선택: 저장된 보정 결과가 없으면 후보 양자화와 스레드 수를 측정 (워커 모드에서는 스레드 수 고정)
+            threads = thread_count
+            calibration = None
+            if quantization == "auto":
+                from ai_calibration import calibrate
+                
+                if progress is not None:
+                    progress.update(stage="calibrating")
+                with timed_phase(timings, "calibrate"):
+                    try:
+                        calibration = calibrate(model_name_or_path, threads=thread_count, progress=progress)
+                    except Exception as e:
+                        logger.warning(f"양자화 자동 선택 실패, 기본 양자화를 사용합니다: {str(e)}")
+                if calibration is not None:
+                    quantization = calibration["quantization"]
+                    threads = calibration["threads"]
+                else:
+                    quantization = None
+            
+            # GGUF 모델 다운로드 (이미 있으면 바로 경로를 반환)
+            with timed_phase(timings, "download"):
+                gguf_path = download_gguf_model(model_name_or_path, progress, quantization)
             if not gguf_path:
                 raise ValueError("GGUF 모델 다운로드 실패")
             
-            # llama.cpp로 모델 로드
-            model = Llama(
-                model_path=gguf_path,
-                n_ctx=2048,
-                n_batch=512,
-                verbose=False
-            )
+            if progress is not None:
+                progress.update(stage="loading")
+            
+            # llama.cpp로 모델 로드 (mmap으로 읽어 여러 프로세스가 가중치 페이지를 공유하고, 재시작 시 페이지 캐시를 재사용)
+            with timed_phase(timings, "import"):
+                from llama_cpp import Llama
+            draft = None
+            if draft_model:
+                with timed_phase(timings, "draft"):
+                    draft = _load_llama_draft(draft_model)
+            with timed_phase(timings, "load_weights"):
+                model = Llama(
+                    model_path=gguf_path,
+                    n_ctx=2048,
+                    n_batch=512,
+                    n_threads=threads,
+                    n_threads_batch=threads,
+                    use_mmap=True,
+                    draft_model=draft,
+                    verbose=False
+                )
+            if draft is not None:
+                # 닫은 뒤에는 어휘 크기를 읽을 수 없으므로 먼저 읽어 둠
+                draft_vocab, model_vocab = draft.model.n_vocab(), model.n_vocab()
+                if draft_vocab != model_vocab:
+                    draft.close()
+                    model.close()
+                    raise ValueError(f"초안 모델 '{draft_model}'의 어휘 크기({draft_vocab})가 "
+                                     f"주 모델({model_vocab})과 달라 추측 디코딩에 사용할 수 없습니다.")
+            with timed_phase(timings, "snapshot"):
+                _restore_or_build_snapshot(model, gguf_path)
             
             # 토크나이저는 사용하지 않음 (llama.cpp 내장 토크나이저 사용)
-            tokenizer = None
-            is_llama_cpp = True
             logger.info(f"llama.cpp로 1bit 양자화 모델 로드 완료! 소요 시간: {time.time() - start_time:.2f}초")
-            is_loaded = True
-            save_model_info(model_name_or_path, "llama_cpp_1bit")
-            return True
+            nbytes = os.path.getsize(gguf_path) + (draft.nbytes if draft is not None else 0)
+            return ModelHandle(model_name_or_path, model, None, True, "llama_cpp_1bit",
+                               nbytes=nbytes, options=options, load_timings=timings, draft=draft,
+                               calibration=calibration)
+        if llama_cpp_backend:
+            # transformers float16으로 조용히 넘어가지 않고 아래에서 llama-cpp-python을 설치한 뒤 다시 시도
+            raise ImportError("llama-cpp-python이 설치되지 않아 GGUF 모델을 로드할 수 없습니다.")
             
+        with timed_phase(timings, "import"):
+            import torch
+            from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+        if thread_count:
+            torch.set_num_threads(thread_count)
+        
         # CPU 모드에서 양자화 없이 float16 사용
-        elif use_cpu:
+        if use_cpu:
             logger.info("CPU 모드에서 float16으로 모델 로드")
+            if progress is not None:
+                progress.update(stage="loading")
             device_map = "cpu"
             
-            model = AutoModelForCausalLM.from_pretrained(
-                model_name_or_path,
-                device_map=device_map,
-                torch_dtype=torch.float16,
-                low_cpu_mem_usage=True,
-                cache_dir=CACHE_DIR
-            )
+            with timed_phase(timings, "load_weights"):
+                model = AutoModelForCausalLM.from_pretrained(
+                    model_name_or_path,
+                    device_map=device_map,
+                    torch_dtype=torch.float16,
+                    low_cpu_mem_usage=True,
+                    cache_dir=CACHE_DIR
+                )
             
             # 토크나이저 로드
-            tokenizer = AutoTokenizer.from_pretrained(model_name_or_path, cache_dir=CACHE_DIR)
-            is_llama_cpp = False
+            with timed_phase(timings, "tokenizer"):
+                tokenizer = AutoTokenizer.from_pretrained(model_name_or_path, cache_dir=CACHE_DIR)
             
         # GPU 환경에서의 양자화 설정
         else:
             device_map = "auto"
             logger.info("GPU 모드로 모델 로드")
+            if progress is not None:
+                progress.update(stage="loading")
             
             if use_1bit:
                 logger.info("1bit 양자화 모드로 모델 로드 (메모리 사용량 최소화)")
@@ -200,43 +410,250 @@ def load_model(model_name_or_path="deepseek-ai/DeepSeek-R1-Distill-Qwen-7B", use
                 quantization_config = None
             
             # 양자화 설정에 따라 모델 로드
-            if quantization_config:
-                model = AutoModelForCausalLM.from_pretrained(
-                    model_name_or_path,
-                    device_map=device_map,
-                    quantization_config=quantization_config,
-                    low_cpu_mem_usage=True,
-                    cache_dir=CACHE_DIR
-                )
-            else:
-                model = AutoModelForCausalLM.from_pretrained(
-                    model_name_or_path, 
-                    device_map=device_map,
-                    low_cpu_mem_usage=True,
-                    cache_dir=CACHE_DIR
-                )
+            with timed_phase(timings, "load_weights"):
+                if quantization_config:
+                    model = AutoModelForCausalLM.from_pretrained(
+                        model_name_or_path,
+                        device_map=device_map,
+                        quantization_config=quantization_config,
+                        low_cpu_mem_usage=True,
+                        cache_dir=CACHE_DIR
+                    )
+                else:
+                    model = AutoModelForCausalLM.from_pretrained(
+                        model_name_or_path, 
+                        device_map=device_map,
+                        low_cpu_mem_usage=True,
+                        cache_dir=CACHE_DIR
+                    )
             
             # 토크나이저 로드
-            tokenizer = AutoTokenizer.from_pretrained(model_name_or_path, cache_dir=CACHE_DIR)
-            is_llama_cpp = False
+            with timed_phase(timings, "tokenizer"):
+                tokenizer = AutoTokenizer.from_pretrained(model_name_or_path, cache_dir=CACHE_DIR)
+        
+        draft = None
+        if draft_model:
+            with timed_phase(timings, "draft"):
+                draft = _load_transformers_draft(draft_model, model, tokenizer, device_map)
         
         logger.info(f"모델 로딩 완료! 소요 시간: {time.time() - start_time:.2f}초")
-        is_loaded = True
-        save_model_info(model_name_or_path)
-        return True
+        nbytes = model.get_memory_footprint() + (draft.nbytes if draft is not None else 0)
+        return ModelHandle(model_name_or_path, model, tokenizer, False, "transformers",
+                           nbytes=nbytes, options=options, load_timings=timings, draft=draft)
         
     except Exception as e:
         logger.error(f"모델 로드 실패: {str(e)}")
         
-        # llama-cpp-python이 설치되지 않았고 CPU에서 1bit 양자화를 시도하는 경우 설치 시도
-        if use_cpu and use_1bit and not LLAMA_CPP_AVAILABLE:
+        # llama-cpp-python이 설치되지 않았고 CPU에서 1bit 양자화나 GGUF 양자화를 시도하는 경우 설치 시도
+        if llama_cpp_backend and not LLAMA_CPP_AVAILABLE:
             logger.info("llama-cpp-python 설치 시도...")
             if install_llama_cpp():
                 logger.info("llama-cpp-python 설치 완료. 모델 로드 재시도...")
-                return load_model(model_name_or_path, use_4bit, use_1bit, use_cpu)
+                return create_model(model_name_or_path, use_4bit, use_1bit, use_cpu, draft_model, quantization=quantization, progress=progress)
         
-        is_loaded = False
+        raise
+
+def _snapshot_path(model, gguf_path):
+    """GGUF 파일, 컨텍스트 설정, llama.cpp 버전, 시스템 프롬프트가 같을 때만 재사용되는 스냅샷 경로를 반환합니다."""
+    import llama_cpp
+    
+    stat = os.stat(gguf_path)
+    key_source = f"{os.path.abspath(gguf_path)}|{stat.st_size}|{int(stat.st_mtime)}|{model.n_ctx()}|" \
+                 f"{llama_cpp.__version__}|{SYSTEM_PROMPT}"
+    key = hashlib.sha256(key_source.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(SNAPSHOT_DIR, f"{os.path.basename(gguf_path)}.{key}.state")
+
+def _restore_or_build_snapshot(model, gguf_path):
+    """시스템 프롬프트까지 평가한 llama.cpp 상태를 디스크에서 복원합니다. 없으면 평가한 뒤 저장합니다.
+    
+    복원된 토큰은 이후 같은 접두어로 시작하는 요청에서 재평가 없이 재사용됩니다.
+    스냅샷 처리에 실패해도 모델 로드는 계속 진행됩니다.
+    """
+    try:
+        path = _snapshot_path(model, gguf_path)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                model.load_state(pickle.load(f))
+            logger.info(f"모델 스냅샷 복원: {path} ({model.n_tokens} 토큰)")
+            return
+        
+        model.eval(model.tokenize(f"User: {SYSTEM_PROMPT}".encode("utf-8")))
+        state = model.save_state()
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump(state, f)
+        os.replace(temp_path, path)
+        logger.info(f"모델 스냅샷 저장: {path} ({model.n_tokens} 토큰, {state.llama_state_size} 바이트)")
+    except Exception as e:
+        logger.warning(f"모델 스냅샷 처리 실패 (무시하고 계속): {str(e)}")
+
+class SpeculativeDraft:
+    """추측 디코딩에 쓰는 초안 모델과 누적 통계입니다.
+    
+    drafted는 초안 모델이 제안한 토큰 수, accepted는 주 모델이 검증하여 받아들인 토큰 수,
+    steps는 주 모델의 검증 횟수(순전파 횟수)입니다.
+    """
+    
+    def __init__(self, name, model, nbytes=0):
+        self.name = name
+        self.model = model
+        self.nbytes = nbytes
+        self.drafted = 0
+        self.accepted = 0
+        self.steps = 0
+        self._lock = threading.Lock()
+    
+    def counters(self):
+        with self._lock:
+            return self.drafted, self.accepted, self.steps
+    
+    def to_dict(self):
+        drafted, accepted, steps = self.counters()
+        return {
+            "model_name": self.name,
+            "bytes": self.nbytes,
+            "drafted_tokens": drafted,
+            "accepted_tokens": accepted,
+            "verify_steps": steps,
+            "acceptance_rate": round(accepted / drafted, 3) if drafted else None
+        }
+    
+    def begin(self):
+        """새 생성을 시작할 때 호출합니다."""
+    
+    def close(self):
+        self.model = None
+
+class _LlamaDraft(SpeculativeDraft):
+    """작은 llama.cpp 모델로 다음 토큰들을 미리 생성하는 초안 모델입니다.
+    
+    llama_cpp.llama_speculative.LlamaDraftModel과 같은 방식으로 호출되며, 주 모델은 제안된 토큰을
+    한 번의 배치로 평가해 자신의 샘플과 일치하는 토큰까지만 받아들입니다.
+    받아들여진 토큰 수는 다음 호출의 입력(주 모델이 확정한 토큰)과 직전 제안을 비교해 계산합니다.
+    """
+    
+    def __init__(self, name, model, nbytes=0, num_pred_tokens=DEFAULT_DRAFT_TOKENS):
+        super().__init__(name, model, nbytes)
+        self.num_pred_tokens = num_pred_tokens
+        self._pending = None  # (제안 시점의 입력 길이, 제안한 토큰)
+    
+    def begin(self):
+        self._pending = None
+    
+    def settle(self, input_ids):
+        """주 모델이 확정한 토큰과 직전 제안을 비교해 받아들여진 토큰 수를 기록합니다."""
+        if self._pending is None:
+            return
+        start, drafted = self._pending
+        self._pending = None
+        with self._lock:
+            self.accepted += common_prefix_length(list(input_ids[start:]), drafted)
+    
+    def __call__(self, input_ids, **kwargs):
+        import numpy as np
+        
+        tokens = input_ids.tolist()
+        self.settle(tokens)
+        with self._lock:
+            self.steps += 1
+        
+        count = min(self.num_pred_tokens, self.model.n_ctx() - len(tokens) - 1)
+        drafted = []
+        if count > 0:
+            # 초안 모델도 이전 호출과 공통 접두어는 재평가하지 않음
+            generator = self.model.generate(tokens, top_k=1, top_p=1.0, temp=0.0)
+            try:
+                for token in generator:
+                    drafted.append(token)
+                    if len(drafted) >= count:
+                        break
+            finally:
+                generator.close()
+            self._pending = (len(tokens), drafted)
+        with self._lock:
+            self.drafted += len(drafted)
+        return np.array(drafted, dtype=np.intc)
+    
+    def close(self):
+        if self.model is not None:
+            self.model.close()
+        self.model = None
+
+class _TransformersDraft(SpeculativeDraft):
+    """transformers 추측 디코딩(assisted generation)의 보조 모델입니다.
+    
+    보조 모델의 순전파 한 번이 초안 토큰 하나이므로 순전파 횟수로 제안 토큰 수를 세고,
+    주 모델의 검증 횟수와 생성 토큰 수로 받아들여진 토큰 수를 계산합니다 (검증마다 주 모델이 한 토큰을 직접 생성).
+    """
+    
+    def __init__(self, name, model, nbytes=0):
+        super().__init__(name, model, nbytes)
+        self._hook = model.register_forward_hook(self._count_forward)
+    
+    def _count_forward(self, module, inputs, output):
+        with self._lock:
+            self.drafted += 1
+    
+    def record_verification(self, steps, completion_tokens):
+        with self._lock:
+            self.steps += steps
+            self.accepted += max(completion_tokens - steps, 0)
+    
+    def close(self):
+        if self.model is not None:
+            self._hook.remove()
+        self.model = None
+
+def _load_llama_draft(draft_model):
+    """초안 모델의 GGUF를 받아 llama.cpp로 로드합니다."""
+    from llama_cpp import Llama
+    
+    gguf_path = download_gguf_model(draft_model)
+    if not gguf_path:
+        raise ValueError(f"초안 모델 '{draft_model}' GGUF 다운로드 실패")
+    model = Llama(
+        model_path=gguf_path,
+        n_ctx=2048,
+        n_batch=512,
+        n_threads=thread_count,
+        n_threads_batch=thread_count,
+        use_mmap=True,
+        verbose=False
+    )
+    logger.info(f"초안 모델 로드 완료 (llama.cpp): {draft_model}")
+    return _LlamaDraft(draft_model, model, os.path.getsize(gguf_path))
+
+def _load_transformers_draft(draft_model, model, tokenizer, device_map):
+    """주 모델과 같은 장치와 자료형으로 보조 모델을 로드합니다. 토크나이저 어휘가 다르면 ValueError를 발생시킵니다."""
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    
+    draft_tokenizer = AutoTokenizer.from_pretrained(draft_model, cache_dir=CACHE_DIR)
+    if draft_tokenizer.get_vocab() != tokenizer.get_vocab():
+        raise ValueError(f"초안 모델 '{draft_model}'의 토크나이저가 주 모델과 달라 추측 디코딩에 사용할 수 없습니다.")
+    
+    assistant = AutoModelForCausalLM.from_pretrained(
+        draft_model,
+        device_map=device_map,
+        torch_dtype=model.dtype,
+        low_cpu_mem_usage=True,
+        cache_dir=CACHE_DIR
+    )
+    logger.info(f"초안 모델 로드 완료 (transformers): {draft_model}")
+    return _TransformersDraft(draft_model, assistant, assistant.get_memory_footprint())
+
+def load_model(model_name_or_path="deepseek-ai/DeepSeek-R1-Distill-Qwen-7B", use_4bit=False, use_1bit=True, use_cpu=True,
+               draft_model=None, quantization=None):
+    """모델과 토크나이저를 로드하고 활성 모델로 교체합니다.
+    
+    로드에 실패하면 기존 모델을 그대로 유지하고 False를 반환합니다.
+    """
+    try:
+        handle = create_model(model_name_or_path, use_4bit, use_1bit, use_cpu, draft_model, quantization)
+    except Exception:
         return False
+    swap_model(handle)
+    return True
 
 def save_model_info(model_name, model_type="transformers"):
     """현재 로드된 모델 정보를 저장합니다."""
@@ -257,68 +674,480 @@ def get_available_models():
     return [
         {"id": "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B", "name": "DeepSeek R1 Distill 7B (권장)", "size": "7B"},
         {"id": "deepseek-ai/DeepSeek-V3-lite", "name": "DeepSeek V3 Lite (저사양 권장)", "size": "3B"},
-        {"id": "deepseek-ai/DeepSeek-R1-Distill-Llama-8B", "name": "DeepSeek R1 Llama 8B", "size": "8B"}
+        {"id": "deepseek-ai/DeepSeek-R1-Distill-Llama-8B", "name": "DeepSeek R1 Llama 8B", "size": "8B"},
+        {"id": "deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B", "name": "DeepSeek R1 Distill 1.5B (초안 모델용)", "size": "1.5B"}
     ]
 
-def generate_response(prompt, max_length=1000, temperature=0.7):
-    """프롬프트에 대한 응답을 생성합니다."""
-    global model, tokenizer, is_loaded, is_llama_cpp
+def format_prompt(prompt):
+    """프롬프트를 DeepSeek 모델의 대화 형식으로 변환합니다."""
+    if not prompt.startswith("User:") and not "User:" in prompt:
+        formatted_prompt = f"User: {prompt}\n\nA:"
+    else:
+        formatted_prompt = prompt
+        if not formatted_prompt.endswith("A:"):
+            formatted_prompt += "\n\nA:"
+    return formatted_prompt
+
+def _ensure_model_loaded(model_name=None):
+    """기본 모델이 로드되지 않았다면 기본 모델 로드를 시도합니다.
     
-    if not is_loaded:
-        result = load_model()  # 기본 모델 로드 시도
-        if not result:
-            return "모델이 로드되지 않았습니다. 서버 로그를 확인해주세요."
+    백그라운드 로드 작업이 진행 중이면 기다리지 않고 ModelLoadingError를 발생시킵니다.
+    특정 모델을 요청한 경우에는 모델 레지스트리가 콜드 로드를 처리합니다.
+    """
+    if is_loaded or model_name:
+        return True
     
-    try:
-        # DeepSeek 모델 프롬프트 형식으로 변환
-        if not prompt.startswith("User:") and not "User:" in prompt:
-            formatted_prompt = f"User: {prompt}\n\nA:"
-        else:
-            formatted_prompt = prompt
-            if not formatted_prompt.endswith("A:"):
-                formatted_prompt += "\n\nA:"
-        
-        logger.info(f"최종 프롬프트: {formatted_prompt[:100]}...")
-        
+    from ai_loader import ModelLoadingError, get_loader
+    jobs = get_loader().active_jobs()
+    if jobs:
+        raise ModelLoadingError("모델을 불러오는 중입니다. 잠시 후 다시 시도해주세요.", jobs[0].to_dict()["eta"] or 5)
+    return load_model()  # 기본 모델 로드 시도
+
+class _FirstTokenTimer:
+    """생성을 멈추지 않고 첫 토큰 시각과 디코딩 스텝 수만 기록합니다. llama.cpp와 transformers에서 함께 사용합니다."""
+    
+    def __init__(self):
+        self.started_at = time.time()
+        self.first_token_at = None
+        self.steps = 0
+    
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.first_token_at is None:
+            self.first_token_at = time.time()
+        self.steps += 1
+        return False
+
+def _begin_draft(handle):
+    """추측 디코딩을 사용하는 모델이면 생성 시작 전의 초안 통계를 반환합니다."""
+    if handle.draft is None:
+        return None
+    handle.draft.begin()
+    return handle.draft.counters()
+
+def _record_stats(stats, handle, timer, prompt_tokens, completion_tokens, draft_start=None):
+    """생성 지표(토큰 수, 프롬프트 평가 시간, 디코딩 시간)를 stats에 누적합니다. stats가 None이면 무시합니다.
+    
+    llama.cpp 배치처럼 여러 번 나눠 생성한 경우 값이 합산되고, 첫 토큰 시각은 프롬프트 순서대로 쌓입니다.
+    draft_start가 주어지면 그 이후의 추측 디코딩 제안/수락 토큰 수와 검증 횟수도 기록합니다.
+    """
+    if stats is None:
+        return
+    if draft_start is not None and handle.draft is not None:
+        for key, start, value in zip(("draft_tokens", "accepted_tokens", "verify_steps"), draft_start,
+                                     handle.draft.counters()):
+            stats[key] = stats.get(key, 0) + value - start
+    stats["model"] = handle.name
+    stats["backend"] = "llama_cpp" if handle.is_llama_cpp else "transformers"
+    stats["prompt_tokens"] = stats.get("prompt_tokens", 0) + prompt_tokens
+    stats["completion_tokens"] = stats.get("completion_tokens", 0) + completion_tokens
+    if timer.first_token_at is not None:
+        stats["prompt_eval_time"] = stats.get("prompt_eval_time", 0.0) + timer.first_token_at - timer.started_at
+        stats["decode_time"] = stats.get("decode_time", 0.0) + time.time() - timer.first_token_at
+        stats.setdefault("first_token_times", []).append(timer.first_token_at)
+
+def _session_key(handle, session_id):
+    """세션 캐시 키에 모델 핸들을 포함하여 다른 모델의 상태가 섞이지 않게 합니다."""
+    return f"{handle.handle_id}:{session_id}"
+
+def _restore_llama_session(handle, formatted_prompt, session_id):
+    """세션에 저장된 llama.cpp 상태를 복원하여 공통 접두어의 재평가를 건너뜁니다.
+    
+    Llama는 현재 컨텍스트의 토큰과 새 프롬프트의 가장 긴 공통 접두어를 자동으로 재사용하므로,
+    현재 컨텍스트보다 세션 상태가 더 많은 토큰을 재사용할 수 있을 때만 상태를 불러옵니다.
+    """
+    model = handle.model
+    tokens = model.tokenize(formatted_prompt.encode("utf-8"))
+    entry, prefix = get_session_cache().take(_session_key(handle, session_id), tokens)
+    if entry is None:
+        return
+    
+    current_tokens = model.input_ids[:model.n_tokens].tolist()
+    current_prefix = common_prefix_length(current_tokens, tokens)
+    if prefix > current_prefix:
+        model.load_state(entry.state)
+        logger.info(f"세션 상태 복원: {session_id} ({prefix}/{len(tokens)} 토큰 재사용)")
+
+def _save_llama_session(handle, session_id):
+    """현재 llama.cpp 컨텍스트 상태를 세션 캐시에 저장합니다."""
+    model = handle.model
+    state = model.save_state()
+    tokens = model.input_ids[:model.n_tokens].tolist()
+    get_session_cache().put(_session_key(handle, session_id), tokens, state, state.llama_state_size)
+
+class _LlamaStoppingCriteria(list):
+    """llama_cpp.StoppingCriteriaList와 같은 방식으로 동작하는 중지 조건 목록입니다 (llama_cpp를 불러오지 않기 위해 직접 정의)."""
+    
+    def __call__(self, input_ids, logits):
+        return any(criteria(input_ids, logits) for criteria in self)
+
+def _llama_stopping_criteria(*criteria):
+    return _LlamaStoppingCriteria(criteria)
+
+def _llama_grammar(schema):
+    """JSON 스키마가 주어지면 llama.cpp 생성을 제약할 문법을 반환합니다."""
+    if schema is None:
+        return None
+    from ai_structured import llama_grammar
+    return llama_grammar(schema)
+
+def _generate_llama_cpp(handle, formatted_prompt, max_length, temperature, session_id=None, stats=None, schema=None):
+    """llama.cpp 모델로 단일 프롬프트에 대한 응답을 생성합니다. schema가 주어지면 그 JSON 스키마로 출력을 제약합니다."""
+    model = handle.model
+    timer = _FirstTokenTimer()
+    if session_id:
+        _restore_llama_session(handle, formatted_prompt, session_id)
+    draft_start = _begin_draft(handle)
+    
+    output = model(
+        formatted_prompt,
+        max_tokens=max_length,
+        temperature=temperature,
+        top_p=0.9,
+        echo=False,
+        stop=["User:", "\n\nUser:"],  # DeepSeek 모델의 중지 토큰
+        stopping_criteria=_llama_stopping_criteria(timer),
+        grammar=_llama_grammar(schema)
+    )
+    
+    if isinstance(output, dict) and "choices" in output and len(output["choices"]) > 0:
+        response = output["choices"][0]["text"].strip()
+        usage = output.get("usage", {})
+        if handle.draft is not None:
+            handle.draft.settle(model.input_ids[:model.n_tokens])
+        _record_stats(stats, handle, timer, usage.get("prompt_tokens", 0), usage.get("completion_tokens", timer.steps),
+                      draft_start)
+        logger.info(f"응답 생성 완료 (llama.cpp): {response[:50]}...")
+    else:
+        logger.error(f"llama.cpp 응답 형식 오류: {output}")
+        response = "응답 생성 중 오류가 발생했습니다. 응답 형식이 잘못되었습니다."
+    
+    if session_id:
+        _save_llama_session(handle, session_id)
+    return response
+
+def _assistant_kwargs(handle, batch_size=1):
+    """초안 모델이 있으면 generate()에 넘길 보조 모델 인자를 반환합니다.
+    
+    transformers의 추측 디코딩은 배치 크기 1만 지원하므로 여러 프롬프트를 묶은 배치에서는 사용하지 않습니다.
+    """
+    if handle.draft is None or batch_size > 1:
+        return {}
+    return {"assistant_model": handle.draft.model}
+
+def _finish_assisted(handle, timer, completion_tokens, assistant_kwargs):
+    """보조 모델을 사용한 생성이 끝나면 주 모델의 검증 횟수와 생성 토큰 수를 초안 통계에 반영합니다."""
+    if assistant_kwargs:
+        handle.draft.record_verification(timer.steps, completion_tokens)
+
+def _structured_kwargs(handle, schema, prompt_length, batch_size=1):
+    """JSON 스키마가 주어지면 transformers generate()에 넘길 제약 인자와 중지 조건 목록을 반환합니다.
+    
+    lm-format-enforcer가 있으면 스키마에 맞는 토큰만 허용하고, 어느 경우든 JSON이 닫히면 디코딩을 멈춥니다.
+    """
+    if schema is None:
+        return {}, []
+    from ai_structured import JsonCompletionCriteria, transformers_constraint
+    
+    allowed_tokens = transformers_constraint(handle.tokenizer, schema)
+    kwargs = {"prefix_allowed_tokens_fn": allowed_tokens} if allowed_tokens is not None else {}
+    return kwargs, [JsonCompletionCriteria(handle.tokenizer, prompt_length, batch_size)]
+
+def _generate_transformers(handle, formatted_prompts, max_length, temperature, stats=None, schema=None):
+    """transformers 모델로 여러 프롬프트를 하나의 배치로 묶어 응답을 생성합니다.
+    
+    프롬프트 길이가 달라도 왼쪽 패딩을 사용하므로 모든 시퀀스가 같은 디코딩 스텝을 공유합니다.
+    """
+    import torch
+    from transformers import StoppingCriteriaList
+    
+    model, tokenizer = handle.model, handle.tokenizer
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+    
+    inputs = tokenizer(formatted_prompts, return_tensors="pt", padding=True).to(model.device)
+    timer = _FirstTokenTimer()
+    assistant_kwargs = _assistant_kwargs(handle, len(formatted_prompts))
+    draft_start = _begin_draft(handle) if assistant_kwargs else None
+    structured_kwargs, structured_criteria = _structured_kwargs(
+        handle, schema, inputs["input_ids"].shape[1], len(formatted_prompts))
+    
+    with torch.no_grad():
+        outputs = model.generate(
+            inputs["input_ids"],
+            attention_mask=inputs["attention_mask"],
+            max_new_tokens=max_length,
+            temperature=temperature,
+            do_sample=True,
+            top_p=0.9,
+            pad_token_id=tokenizer.pad_token_id,
+            stopping_criteria=StoppingCriteriaList([timer, *structured_criteria]),
+            **assistant_kwargs,
+            **structured_kwargs
+        )
+    
+    prompt_length = inputs["input_ids"].shape[1]
+    completion_tokens = int((outputs[:, prompt_length:] != tokenizer.pad_token_id).sum())
+    _finish_assisted(handle, timer, completion_tokens, assistant_kwargs)
+    _record_stats(stats, handle, timer, int(inputs["attention_mask"].sum()), completion_tokens, draft_start)
+    responses = [
+        tokenizer.decode(output[prompt_length:], skip_special_tokens=True)
+        for output in outputs
+    ]
+    logger.info(f"응답 생성 완료 (transformers, 배치 크기 {len(responses)}): {responses[0][:50]}...")
+    return responses
+
+def _cache_nbytes(past_key_values):
+    """past_key_values가 차지하는 메모리 크기(바이트)를 계산합니다."""
+    legacy = past_key_values.to_legacy_cache() if hasattr(past_key_values, "to_legacy_cache") else past_key_values
+    return sum(
+        tensor.numel() * tensor.element_size()
+        for layer in legacy
+        for tensor in layer
+    )
+
+def _prepare_transformers_session(handle, formatted_prompt, session_id):
+    """프롬프트를 토큰화하고, 세션에 저장된 past_key_values 중 재사용 가능한 부분을 반환합니다."""
+    model, tokenizer = handle.model, handle.tokenizer
+    inputs = tokenizer(formatted_prompt, return_tensors="pt").to(model.device)
+    past_key_values = None
+    
+    if session_id:
+        tokens = inputs["input_ids"][0].tolist()
+        entry, prefix = get_session_cache().take(_session_key(handle, session_id), tokens)
+        # 최소 한 개의 새 토큰은 모델에 입력되어야 다음 토큰을 예측할 수 있음
+        prefix = min(prefix, len(tokens) - 1)
+        if entry is not None and prefix > 0:
+            from transformers import DynamicCache
+            
+            past_key_values = entry.state
+            if not isinstance(past_key_values, DynamicCache):
+                past_key_values = DynamicCache.from_legacy_cache(past_key_values)
+            past_key_values.crop(prefix)
+            logger.info(f"세션 KV 캐시 재사용: {session_id} ({prefix}/{len(tokens)} 토큰)")
+    
+    return inputs, past_key_values
+
+def _save_transformers_session(handle, session_id, sequence, past_key_values):
+    """생성이 끝난 시퀀스의 past_key_values를 세션 캐시에 저장합니다."""
+    cached_length = past_key_values.get_seq_length() if hasattr(past_key_values, "get_seq_length") else past_key_values[0][0].shape[-2]
+    tokens = sequence[:cached_length].tolist()
+    get_session_cache().put(_session_key(handle, session_id), tokens, past_key_values, _cache_nbytes(past_key_values))
+
+def _generate_transformers_session(handle, formatted_prompt, max_length, temperature, session_id, stats=None,
+                                   schema=None):
+    """세션 KV 캐시를 사용해 새로 추가된 토큰만 평가하여 응답을 생성합니다."""
+    import torch
+    from transformers import StoppingCriteriaList
+    
+    model, tokenizer = handle.model, handle.tokenizer
+    timer = _FirstTokenTimer()
+    inputs, past_key_values = _prepare_transformers_session(handle, formatted_prompt, session_id)
+    assistant_kwargs = _assistant_kwargs(handle)
+    draft_start = _begin_draft(handle)
+    structured_kwargs, structured_criteria = _structured_kwargs(handle, schema, inputs["input_ids"].shape[1])
+    
+    with torch.no_grad():
+        outputs = model.generate(
+            inputs["input_ids"],
+            attention_mask=inputs["attention_mask"],
+            past_key_values=past_key_values,
+            max_new_tokens=max_length,
+            temperature=temperature,
+            do_sample=True,
+            top_p=0.9,
+            pad_token_id=tokenizer.eos_token_id,
+            return_dict_in_generate=True,
+            stopping_criteria=StoppingCriteriaList([timer, *structured_criteria]),
+            **assistant_kwargs,
+            **structured_kwargs
+        )
+    
+    sequence = outputs.sequences[0]
+    prompt_length = inputs["input_ids"].shape[1]
+    _finish_assisted(handle, timer, len(sequence) - prompt_length, assistant_kwargs)
+    _record_stats(stats, handle, timer, prompt_length, len(sequence) - prompt_length, draft_start)
+    _save_transformers_session(handle, session_id, sequence, outputs.past_key_values)
+    
+    response = tokenizer.decode(sequence[inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+    logger.info(f"응답 생성 완료 (transformers, 세션 {session_id}): {response[:50]}...")
+    return response
+
+def generate_session(prompt, max_length=1000, temperature=0.7, session_id=None, model_name=None, stats=None,
+                     schema=None):
+    """세션 KV 캐시를 사용해 단일 프롬프트에 대한 응답을 생성합니다.
+    
+    session_id가 없으면 캐시 없이 생성합니다. model_name이 없으면 기본 모델을 사용합니다.
+    stats 딕셔너리가 주어지면 토큰 수와 프롬프트 평가/디코딩 시간, 생성 전후의 메모리 차이를 기록합니다.
+    schema(JSON 스키마)가 주어지면 그 스키마를 따르는 JSON만 생성하고 JSON이 닫히면 멈춥니다.
+    오류는 예외로 전달됩니다.
+    """
+    if not _ensure_model_loaded(model_name):
+        raise RuntimeError("모델이 로드되지 않았습니다. 서버 로그를 확인해주세요.")
+    
+    formatted_prompt = format_prompt(prompt)
+    logger.info(f"최종 프롬프트: {formatted_prompt[:100]}...")
+    
+    with acquire_model(model_name) as handle, track_memory(stats):
         # llama.cpp 모델과 transformers 모델 구분하여 처리
-        if is_llama_cpp:
-            # llama.cpp 모델 사용
-            output = model(
-                formatted_prompt,
-                max_tokens=max_length,
+        if handle.is_llama_cpp:
+            return _generate_llama_cpp(handle, formatted_prompt, max_length, temperature, session_id, stats, schema)
+        if session_id:
+            return _generate_transformers_session(handle, formatted_prompt, max_length, temperature, session_id, stats,
+                                                  schema)
+        return _generate_transformers(handle, [formatted_prompt], max_length, temperature, stats, schema)[0]
+
+def generate_response(prompt, max_length=1000, temperature=0.7, session_id=None, model_name=None, schema=None):
+    """프롬프트에 대한 응답을 생성합니다. schema가 주어지면 그 JSON 스키마를 따르는 JSON 문자열을 반환합니다."""
+    try:
+        return generate_session(prompt, max_length, temperature, session_id, model_name, schema=schema)
+    except Exception as e:
+        logger.error(f"응답 생성 중 오류 발생: {str(e)}")
+        return f"응답 생성 중 오류가 발생했습니다: {str(e)}"
+
+class _CancelCriteria:
+    """취소 이벤트 중 하나라도 설정되면 transformers 디코딩을 중단합니다."""
+    
+    def __init__(self, *events):
+        self.events = events
+    
+    def __call__(self, input_ids, scores, **kwargs):
+        return any(event.is_set() for event in self.events)
+
+def _stream_llama_cpp(handle, formatted_prompt, max_length, temperature, cancel_event, session_id=None, stats=None,
+                      schema=None):
+    """llama.cpp 모델이 생성하는 토큰을 순서대로 반환합니다."""
+    model = handle.model
+    timer = _FirstTokenTimer()
+    if session_id:
+        _restore_llama_session(handle, formatted_prompt, session_id)
+    draft_start = _begin_draft(handle)
+    
+    stream = model(
+        formatted_prompt,
+        max_tokens=max_length,
+        temperature=temperature,
+        top_p=0.9,
+        echo=False,
+        stop=["User:", "\n\nUser:"],
+        stream=True,
+        stopping_criteria=_llama_stopping_criteria(timer),
+        grammar=_llama_grammar(schema)
+    )
+    try:
+        for chunk in stream:
+            if cancel_event.is_set():
+                break
+            text = chunk["choices"][0]["text"]
+            if text:
+                yield text
+    finally:
+        # 제너레이터를 닫아 llama.cpp가 남은 토큰을 디코딩하지 않도록 함
+        stream.close()
+        if handle.draft is not None:
+            handle.draft.settle(model.input_ids[:model.n_tokens])
+        _record_stats(stats, handle, timer, max(model.n_tokens - timer.steps, 0), timer.steps, draft_start)
+        if session_id:
+            _save_llama_session(handle, session_id)
+
+def _stream_transformers(handle, formatted_prompt, max_length, temperature, cancel_event, session_id=None, stats=None,
+                         schema=None):
+    """transformers 모델이 생성하는 토큰을 순서대로 반환합니다."""
+    import torch
+    from transformers import StoppingCriteriaList, TextIteratorStreamer
+    
+    model, tokenizer = handle.model, handle.tokenizer
+    timer = _FirstTokenTimer()
+    inputs, past_key_values = _prepare_transformers_session(handle, formatted_prompt, session_id)
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    stop_event = threading.Event()
+    assistant_kwargs = _assistant_kwargs(handle)
+    draft_start = _begin_draft(handle)
+    structured_kwargs, structured_criteria = _structured_kwargs(handle, schema, inputs["input_ids"].shape[1])
+    
+    def run_generate():
+        with torch.no_grad():
+            outputs = model.generate(
+                inputs["input_ids"],
+                attention_mask=inputs["attention_mask"],
+                past_key_values=past_key_values,
+                return_dict_in_generate=True,
+                max_new_tokens=max_length,
                 temperature=temperature,
+                do_sample=True,
                 top_p=0.9,
-                echo=False,
-                stop=["User:", "\n\nUser:"]  # DeepSeek 모델의 중지 토큰
+                pad_token_id=tokenizer.eos_token_id,
+                streamer=streamer,
+                stopping_criteria=StoppingCriteriaList([timer, _CancelCriteria(cancel_event, stop_event),
+                                                        *structured_criteria]),
+                **assistant_kwargs,
+                **structured_kwargs
             )
-            
-            if isinstance(output, dict) and "choices" in output and len(output["choices"]) > 0:
-                response = output["choices"][0]["text"].strip()
-                logger.info(f"응답 생성 완료 (llama.cpp): {response[:50]}...")
-            else:
-                logger.error(f"llama.cpp 응답 형식 오류: {output}")
-                response = "응답 생성 중 오류가 발생했습니다. 응답 형식이 잘못되었습니다."
+        prompt_length = inputs["input_ids"].shape[1]
+        completion_tokens = outputs.sequences.shape[1] - prompt_length
+        _finish_assisted(handle, timer, completion_tokens, assistant_kwargs)
+        _record_stats(stats, handle, timer, prompt_length, completion_tokens, draft_start)
+        if session_id:
+            _save_transformers_session(handle, session_id, outputs.sequences[0], outputs.past_key_values)
+    
+    thread = threading.Thread(target=run_generate, daemon=True)
+    thread.start()
+    try:
+        for text in streamer:
+            if text:
+                yield text
+    finally:
+        # 소비자가 중간에 멈춘 경우에도 디코딩을 중단하고 스레드를 정리함
+        stop_event.set()
+        thread.join()
+
+def generate_stream(prompt, max_length=1000, temperature=0.7, cancel_event=None, session_id=None, model_name=None,
+                    stats=None, schema=None):
+    """프롬프트에 대한 응답을 생성되는 대로 조각(토큰) 단위로 반환하는 제너레이터입니다.
+    
+    cancel_event가 설정되면 다음 토큰에서 디코딩을 멈춥니다.
+    session_id가 주어지면 세션 KV 캐시를, model_name이 주어지면 해당 모델을 사용합니다.
+    stats 딕셔너리가 주어지면 생성이 끝난 뒤 지표를 기록합니다. schema는 generate_session과 같습니다.
+    """
+    if not _ensure_model_loaded(model_name):
+        raise RuntimeError("모델이 로드되지 않았습니다. 서버 로그를 확인해주세요.")
+    
+    if cancel_event is None:
+        cancel_event = threading.Event()
+    
+    formatted_prompt = format_prompt(prompt)
+    logger.info(f"스트리밍 생성 시작: {formatted_prompt[:100]}...")
+    
+    with acquire_model(model_name) as handle, track_memory(stats):
+        if handle.is_llama_cpp:
+            yield from _stream_llama_cpp(handle, formatted_prompt, max_length, temperature, cancel_event, session_id,
+                                         stats, schema)
         else:
-            # transformers 모델 사용
-            inputs = tokenizer(formatted_prompt, return_tensors="pt").to(model.device)
-            
-            with torch.no_grad():
-                outputs = model.generate(
-                    inputs["input_ids"],
-                    max_new_tokens=max_length,
-                    temperature=temperature,
-                    do_sample=True,
-                    top_p=0.9,
-                    pad_token_id=tokenizer.eos_token_id
-                )
-            
-            response = tokenizer.decode(outputs[0][inputs["input_ids"].shape[1]:], skip_special_tokens=True)
-            logger.info(f"응답 생성 완료 (transformers): {response[:50]}...")
-        
-        return response
-    except Exception as e:
-        logger.error(f"응답 생성 중 오류 발생: {str(e)}")
-        return f"응답 생성 중 오류가 발생했습니다: {str(e)}"
+            yield from _stream_transformers(handle, formatted_prompt, max_length, temperature, cancel_event, session_id,
+                                            stats, schema)
+
+def generate_batch(prompts, max_length=1000, temperature=0.7, model_name=None, stats=None, schema=None):
+    """여러 프롬프트에 대한 응답을 한 번에 생성합니다.
+    
+    transformers 백엔드는 프롬프트들을 하나의 배치로 묶어 디코딩 스텝을 공유합니다.
+    llama.cpp 백엔드는 단일 컨텍스트만 제공하므로 같은 컨텍스트에서 순차적으로 처리합니다.
+    model_name이 없으면 기본 모델을 사용합니다. stats 딕셔너리가 주어지면 배치 전체의 지표를 기록합니다.
+    schema가 주어지면 모든 프롬프트의 출력을 그 JSON 스키마로 제약합니다.
+    오류는 예외로 전달되며, 호출자(스케줄러)가 요청별로 처리합니다.
+    """
+    if not _ensure_model_loaded(model_name):
+        raise RuntimeError("모델이 로드되지 않았습니다. 서버 로그를 확인해주세요.")
+    
+    formatted_prompts = [format_prompt(prompt) for prompt in prompts]
+    logger.info(f"배치 생성 시작: {len(formatted_prompts)}개 프롬프트")
+    
+    with acquire_model(model_name) as handle, track_memory(stats):
+        if handle.is_llama_cpp:
+            return [
+                _generate_llama_cpp(handle, formatted_prompt, max_length, temperature, stats=stats, schema=schema)
+                for formatted_prompt in formatted_prompts
+            ]
+        return _generate_transformers(handle, formatted_prompts, max_length, temperature, stats, schema)
 
 # 모듈이 직접 실행될 때 테스트를 위한 코드
 if __name__ == "__main__":
@@ -333,6 +1162,11 @@ if __name__ == "__main__":
                         help='1bit 양자화 비활성화')
     parser.add_argument('--gpu', action='store_true', 
                         help='GPU 모드 사용 (기본값: CPU 모드)')
+    parser.add_argument('--draft-model', type=str, default=None,
+                        help='추측 디코딩에 사용할 초안 모델 (예: --gpu --model deepseek-ai/DeepSeek-R1-Distill-Qwen-7B와 '
+                             'deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B, 주 모델과 토크나이저가 같아야 함)')
+    parser.add_argument('--quantization', type=str, default=None,
+                        help='GGUF 양자화 종류 (예: Q4_K_M, auto이면 이 컴퓨터에서 측정해 가장 빠른 것을 선택)')
     parser.add_argument('--prompt', type=str, 
                         default="안녕하세요, 저는 출결 관리 시스템 AI 비서입니다. 무엇을 도와드릴까요?", 
                         help='테스트할 프롬프트')
@@ -343,13 +1177,17 @@ if __name__ == "__main__":
     use_4bit = not args.no_4bit and not args.no_1bit  # 둘 다 비활성화되지 않은 경우 4bit 사용
     use_1bit = not args.no_1bit  # 1bit가 비활성화되지 않은 경우 사용
     use_cpu = not args.gpu  # GPU 옵션이 지정되지 않은 경우 CPU 사용
+    try:
+        check_draft_model(args.model, args.draft_model, use_1bit, use_cpu, args.quantization)
+    except ValueError as e:
+        parser.error(str(e))
     
     # 실행 설정 정보 출력
     print(f"CPU 모드: {use_cpu}")
     print(f"1bit 양자화: {use_1bit}")
     print(f"4bit 양자화: {use_4bit and not use_1bit}")
     
-    result = load_model(args.model, use_4bit, use_1bit, use_cpu)
+    result = load_model(args.model, use_4bit, use_1bit, use_cpu, args.draft_model, args.quantization)
     
     if result:
         print("모델 로드 성공!")
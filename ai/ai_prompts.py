@@ -0,0 +1,61 @@
+"""채팅/분석 요청을 모델 프롬프트로 바꾸는 함수들
+
+서버(ai_server)와 배치 작업(ai_jobs), 벤치마크가 함께 사용하므로 Flask 앱에 의존하지 않습니다.
+"""
+
+
+def build_chat_prompt(message, context=None, attendance_data=None, session_id=None, max_length=1000, model_name=None):
+    """채팅 메시지, 이전 대화, 출결 데이터로 모델 프롬프트를 구성합니다.
+    
+    이전 대화는 모델의 컨텍스트 크기와 토큰 예산에 맞게 최근 턴만 남기고, 오래된 턴은 세션별 요약으로 대체합니다.
+    """
+    from ai_context import format_turn, get_history_manager
+    
+    header = ""
+    
+    # 출결 데이터는 원본 대신 통계 요약으로 맨 앞에 추가 (턴마다 같은 접두어가 되어 세션 캐시에 유리)
+    if attendance_data:
+        from ai_attendance import summarize_request_data
+        
+        current_class = attendance_data.get('currentClass')
+        _, summary = summarize_request_data(attendance_data, 'studentData', 'attendanceHistory',
+                                            [str(current_class)] if current_class else None)
+        if summary:
+            header += f"[출결 통계 요약]\n{summary}\n\n"
+    
+    # 현재 사용자 메시지
+    tail = f"User: {message}\n\nA:"
+    
+    # 이전 대화 내역 추가 (토큰 예산을 넘는 오래된 턴은 요약)
+    history_summary, recent = get_history_manager().fit(
+        context, header + tail, max_length, session_id, model_name)
+    full_prompt = header
+    if history_summary:
+        full_prompt += f"[이전 대화 요약]\n{history_summary}\n\n"
+    full_prompt += "".join(format_turn(msg) for msg in recent)
+    return full_prompt + tail
+
+
+def build_analyze_prompt(prompt, attendance_data, schema=None):
+    """분석 요청과 출결 데이터로 프롬프트를 구성하고 (프롬프트, 학급별 통계)를 반환합니다.
+    
+    원본 출결 데이터 대신 미리 계산한 통계 요약을 넣어 기록 기간과 무관하게 프롬프트 길이를 유지합니다.
+    attendance_data가 {"dataset": {...}}로 서버의 출결 스냅샷을 참조하면 그 스냅샷의 통계를 사용합니다.
+    schema가 주어지면 그 JSON 스키마로 답하라는 지시를 붙입니다.
+    """
+    from ai_attendance import summarize_request_data
+    from ai_model import SYSTEM_PROMPT
+    
+    current_class = attendance_data.get('currentClass')
+    class_ids = [str(current_class)] if current_class else None
+    stats, summary = summarize_request_data(attendance_data, 'students', 'attendance', class_ids)
+    
+    full_prompt = (
+        f"{SYSTEM_PROMPT}\n\n"
+        f"[출결 통계 요약]\n{summary}\n\n"
+        f"요청: {prompt}"
+    )
+    if schema is not None:
+        from ai_structured import structured_prompt
+        full_prompt = structured_prompt(full_prompt, schema)
+    return full_prompt, stats
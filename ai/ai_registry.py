@@ -0,0 +1,274 @@
+import logging
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# 상주 모델들이 사용할 수 있는 기본 메모리 한도 (바이트)
+DEFAULT_MAX_BYTES = 16 * 1024 ** 3
+
+
+class ModelHandle:
+    """로드된 모델 하나와 그 모델을 사용 중인 요청 수를 관리합니다.
+
+    새 모델로 교체되거나 레지스트리에서 제거되어도 이미 이 핸들을 잡은 요청은 끝까지 이 모델로 생성하며,
+    마지막 요청이 끝나면 모델 메모리가 해제됩니다.
+    """
+
+    def __init__(self, name, model, tokenizer, is_llama_cpp, model_type, nbytes=0, options=None, load_timings=None,
+                 draft=None, calibration=None):
+        self.handle_id = uuid.uuid4().hex[:8]
+        self.name = name
+        self.model = model
+        self.tokenizer = tokenizer
+        self.is_llama_cpp = is_llama_cpp
+        self.model_type = model_type
+        self.nbytes = nbytes
+        self.options = options or {}
+        self.load_timings = load_timings or {}
+        self.draft = draft  # 추측 디코딩에 쓰는 초안 모델 (없으면 None)
+        self.calibration = calibration  # quantization="auto"로 고른 양자화/스레드 수와 측정 결과 (없으면 None)
+        self.loaded_at = time.time()
+        self.last_used = self.loaded_at
+        self._refcount = 0
+        self._retired = False
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            self._refcount += 1
+            self.last_used = time.time()
+
+    def release(self):
+        with self._lock:
+            self._refcount -= 1
+            should_free = self._retired and self._refcount == 0
+        if should_free:
+            self._free()
+
+    def retire(self):
+        """더 이상 새 요청에 쓰이지 않도록 표시하고, 사용 중인 요청이 없으면 바로 해제합니다."""
+        with self._lock:
+            self._retired = True
+            should_free = self._refcount == 0
+        if should_free:
+            self._free()
+
+    @property
+    def in_use(self):
+        return self._refcount
+
+    def to_dict(self):
+        return {
+            "model_name": self.name,
+            "model_type": self.model_type,
+            "handle_id": self.handle_id,
+            "bytes": self.nbytes,
+            "loaded_at": self.loaded_at,
+            "last_used": self.last_used,
+            "in_use": self.in_use,
+            "load_timings": self.load_timings,
+            "draft": self.draft.to_dict() if self.draft is not None else None,
+            "calibration": {key: self.calibration[key]
+                            for key in ("quantization", "threads", "tokens_per_second", "cached")}
+            if self.calibration is not None else None
+        }
+
+    def _free(self):
+        """모델이 잡고 있는 메모리(llama.cpp 컨텍스트, CUDA 메모리 포함)를 해제합니다."""
+        if self.model is None:
+            return
+        logger.info(f"모델 해제: {self.name} ({self.handle_id})")
+        model = self.model
+        if self.is_llama_cpp and hasattr(model, "close"):
+            model.close()
+        if self.draft is not None:
+            self.draft.close()
+        self.model = None
+        self.draft = None
+        self.tokenizer = None
+
+        # 기본 모델이 LRU로 제거된 경우 ai_model 전역 변수에 남은 참조가 가중치를 붙잡고 있지 않도록 함
+        ai_model = sys.modules.get("ai_model")
+        if ai_model is not None and ai_model.model is model:
+            ai_model.model = None
+            ai_model.tokenizer = None
+        del model
+
+        from ai_session_cache import get_session_cache
+        get_session_cache().discard_prefix(f"{self.handle_id}:")
+
+        # GC 후 malloc_trim과 CUDA 캐시 비우기로 해제한 메모리를 운영체제에 돌려줌
+        from ai_memory import release_memory
+        release_memory()
+
+
+class ModelRegistry:
+    """여러 모델을 메모리 한도 안에서 동시에 상주시키고 요청을 모델 이름별로 연결합니다.
+
+    한도를 넘으면 가장 오래 사용하지 않은 모델부터 제거하며, 상주하지 않은 모델을 요청하면
+    백그라운드 로드(콜드 로드)를 시작하고 ModelLoadingError를 발생시킵니다.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.default_name = None
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._cold_loads = 0
+        self._cold_load_seconds = 0.0
+        self._evictions = 0
+
+    def get(self, name=None):
+        """모델 핸들을 반환합니다. name이 없으면 기본 모델을 반환합니다. 상주하지 않으면 None입니다."""
+        with self._lock:
+            handle = self._handles.get(name or self.default_name)
+            if handle is not None:
+                self._handles.move_to_end(handle.name)
+            return handle
+
+    def acquire(self, name=None):
+        """모델 핸들을 잡아서 반환합니다. 호출자는 사용이 끝나면 handle.release()를 호출해야 합니다.
+
+        요청한 모델이 상주하지 않으면 콜드 로드를 시작하고 ModelLoadingError를 발생시킵니다.
+        """
+        from ai_loader import ModelLoadingError, get_loader
+
+        with self._lock:
+            target = name or self.default_name
+            if target is None:
+                raise RuntimeError("모델이 로드되지 않았습니다. 서버 로그를 확인해주세요.")
+            handle = self._handles.get(target)
+            if handle is not None:
+                self._handles.move_to_end(target)
+                self._hits += 1
+                handle.acquire()
+                return handle
+            options = self._default_options()
+
+        self._check_known_model(target)
+        job = get_loader().start(target, make_default=False, cold=True, **options)
+        raise ModelLoadingError(f"모델 '{target}'을 불러오는 중입니다. 잠시 후 다시 시도해주세요.",
+                                job.to_dict()["eta"] or 5)
+
+    def put(self, handle, make_default=False):
+        """새로 로드한 모델을 등록합니다. 같은 이름의 이전 모델과 한도를 넘는 모델은 제거됩니다."""
+        with self._lock:
+            old_handle = self._handles.pop(handle.name, None)
+            self._handles[handle.name] = handle
+            if make_default or self.default_name is None:
+                self.default_name = handle.name
+            evicted = self._evict_over_budget(keep=handle.name)
+
+        if old_handle is not None:
+            logger.info(f"모델 교체: {old_handle.name} ({old_handle.handle_id} -> {handle.handle_id}, "
+                        f"이전 모델 사용 중 요청 {old_handle.in_use}개)")
+            old_handle.retire()
+        for evicted_handle in evicted:
+            logger.info(f"메모리 한도 초과로 모델 제거 (LRU): {evicted_handle.name}")
+            evicted_handle.retire()
+
+    def evict_idle(self):
+        """사용 중인 요청이 없는 기본 모델 외 모델을 모두 제거하고 제거한 모델 이름 목록을 반환합니다.
+
+        메모리 가드가 프로세스 메모리 한도를 넘었을 때 호출합니다.
+        """
+        with self._lock:
+            evicted = [handle for name, handle in self._handles.items()
+                       if name != self.default_name and handle.in_use == 0]
+            for handle in evicted:
+                del self._handles[handle.name]
+            self._evictions += len(evicted)
+
+        for handle in evicted:
+            logger.info(f"메모리 회수를 위해 모델 제거: {handle.name}")
+            handle.retire()
+        return [handle.name for handle in evicted]
+
+    def record_cold_load(self, seconds):
+        """콜드 로드 횟수와 소요 시간을 기록합니다."""
+        with self._lock:
+            self._cold_loads += 1
+            self._cold_load_seconds += seconds
+
+    def resident(self):
+        with self._lock:
+            return [handle.to_dict() for handle in self._handles.values()]
+
+    def stats(self):
+        with self._lock:
+            used = sum(handle.nbytes for handle in self._handles.values())
+            return {
+                "default_model": self.default_name,
+                "resident": [handle.to_dict() for handle in self._handles.values()],
+                "bytes": used,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "cold_loads": self._cold_loads,
+                "cold_load_seconds": round(self._cold_load_seconds, 2),
+                "evictions": self._evictions
+            }
+
+    def _default_options(self):
+        """콜드 로드 시 사용할 로드 옵션으로 기본 모델의 옵션을 사용합니다. _lock을 잡은 상태에서 호출합니다.
+
+        초안 모델은 주 모델과 어휘가 같아야 하므로 물려받지 않습니다.
+        """
+        default = self._handles.get(self.default_name)
+        if default is not None:
+            options = dict(default.options)
+            options.pop("draft_model", None)
+            return options
+        return {}
+
+    def _check_known_model(self, name):
+        """오타로 인한 대용량 다운로드를 막기 위해 목록에 있는 모델만 콜드 로드를 허용합니다."""
+        from ai_model import get_available_models
+
+        if name not in {model["id"] for model in get_available_models()}:
+            raise ValueError(f"알 수 없는 모델입니다: {name}")
+
+    def _evict_over_budget(self, keep):
+        """메모리 한도를 넘는 동안 가장 오래 사용하지 않은 모델을 목록에서 뺍니다. _lock을 잡은 상태에서 호출합니다."""
+        evicted = []
+        used = sum(handle.nbytes for handle in self._handles.values())
+        # 기본 모델은 다른 모델을 모두 제거해도 한도를 넘을 때만 제거
+        candidates = sorted(self._handles, key=lambda name: name == self.default_name)
+        for name in candidates:
+            if used <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            handle = self._handles.pop(name)
+            used -= handle.nbytes
+            self._evictions += 1
+            evicted.append(handle)
+            if name == self.default_name:
+                self.default_name = keep
+        return evicted
+
+
+# 서버 전체에서 공유하는 모델 레지스트리
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def configure_registry(**kwargs):
+    """공유 모델 레지스트리를 주어진 설정으로 생성합니다. 모델을 로드하기 전에 호출해야 합니다."""
+    global _registry
+    with _registry_lock:
+        _registry = ModelRegistry(**kwargs)
+        return _registry
+
+
+def get_registry():
+    """공유 모델 레지스트리를 반환합니다. 아직 없으면 기본 설정으로 생성합니다."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+        return _registry
@@ -0,0 +1,199 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# 프롬프트와 응답(학생 분석 내용 포함)을 그대로 저장하므로 정적 파일로 제공되는 저장소 폴더 밖에 둠
+DATA_DIR = os.environ.get("AI_DATA_DIR") or os.path.join(os.path.expanduser("~"), ".attendance_ai")
+DEFAULT_CACHE_PATH = os.path.join(DATA_DIR, "response_cache.json")
+
+# 기본 응답 캐시 설정
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_TTL = 6 * 60 * 60         # 캐시 항목 유효 시간(초)
+DEFAULT_MAX_TEMPERATURE = 0.3     # 이 온도 이하의 요청만 캐시 (결과가 거의 결정적인 경우)
+DEFAULT_SAVE_DELAY = 5.0          # 변경 사항을 모아 디스크에 저장하기까지 기다리는 시간(초)
+
+# 생성 함수가 예외 대신 돌려주는 오류 메시지의 접두어 (ai_model 참고). 이런 응답은 캐시하지 않음
+ERROR_RESPONSE_PREFIX = "응답 생성 중 오류"
+
+
+def normalize_prompt(prompt):
+    """공백과 대소문자, 유니코드 표기 차이만 다른 프롬프트가 같은 키를 갖도록 정규화합니다."""
+    prompt = unicodedata.normalize("NFKC", prompt)
+    prompt = re.sub(r"\s+", " ", prompt)
+    return prompt.strip().lower()
+
+
+def hash_data(data):
+    """요청에 포함된 데이터를 키 순서와 무관하게 해시합니다."""
+    if data is None:
+        return None
+    encoded = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """정규화된 프롬프트, 데이터 해시, 생성 설정을 키로 응답을 보관하는 캐시입니다.
+
+    항목 수 한도를 넘으면 가장 오래 사용하지 않은 항목부터 제거하며,
+    변경 사항은 save_delay초 동안 모았다가 백그라운드에서 한 번에 디스크에 저장되어 서버를 재시작해도 유지됩니다.
+    저장은 조회에 쓰는 잠금 밖에서 이루어지므로 캐시가 커져도 조회가 디스크 쓰기를 기다리지 않습니다.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL,
+                 max_temperature=DEFAULT_MAX_TEMPERATURE, save_delay=DEFAULT_SAVE_DELAY):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_temperature = max_temperature
+        self.save_delay = save_delay
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._save_timer = None
+        self._dirty = False
+        self._hits = 0
+        self._misses = 0
+        self._load()
+        if self.path:
+            # 종료 직전까지 모인 변경 사항도 저장
+            atexit.register(self.flush)
+
+    def is_cacheable(self, temperature):
+        """캐시해도 되는 (거의 결정적인) 요청인지 확인합니다."""
+        return temperature is not None and temperature <= self.max_temperature
+
+    def make_key(self, prompt, data=None, **params):
+        """프롬프트, 데이터, 생성 설정으로 캐시 키를 만듭니다."""
+        key_source = {
+            "prompt": normalize_prompt(prompt),
+            "data": hash_data(data),
+            "params": params
+        }
+        encoded = json.dumps(key_source, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """캐시된 응답을 반환합니다. 없거나 만료되었으면 None을 반환합니다."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry["created"] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry["response"]
+
+    def put(self, key, response):
+        """응답을 캐시에 저장하고 디스크 저장을 예약합니다. 비어 있거나 오류 메시지인 응답은 저장하지 않습니다."""
+        if not isinstance(response, str) or not response.strip() or response.startswith(ERROR_RESPONSE_PREFIX):
+            return
+        with self._lock:
+            self._entries[key] = {"response": response, "created": time.time()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._schedule_save()
+
+    def clear(self):
+        """모든 캐시 항목을 제거합니다."""
+        with self._lock:
+            self._entries.clear()
+            self._schedule_save()
+
+    def flush(self):
+        """예약된 변경 사항을 바로 디스크에 저장합니다. 바뀐 것이 없으면 아무것도 하지 않습니다."""
+        # 저장끼리는 순서대로 진행되어 오래된 내용이 새 내용을 덮어쓰지 않으며, 조회용 잠금은 복사하는 동안만 잡음
+        with self._save_lock:
+            with self._lock:
+                if self._save_timer is not None:
+                    self._save_timer.cancel()
+                    self._save_timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                entries = dict(self._entries)
+            self._save(entries)
+
+    def stats(self):
+        """캐시 크기와 적중 통계를 반환합니다."""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / total, 4) if total else 0.0
+            }
+
+    def _load(self):
+        """디스크에 저장된 캐시를 불러오며 만료된 항목은 버립니다."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            now = time.time()
+            for key, entry in sorted(entries.items(), key=lambda item: item[1]["created"]):
+                if now - entry["created"] <= self.ttl:
+                    self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            logger.info(f"응답 캐시 로드 완료: {len(self._entries)}개 항목")
+        except Exception as e:
+            logger.error(f"응답 캐시 로드 실패: {str(e)}")
+
+    def _schedule_save(self):
+        """save_delay초 뒤에 저장하도록 예약합니다. 이미 예약되어 있으면 그 저장에 함께 반영됩니다. _lock을 잡은 상태에서 호출합니다."""
+        if not self.path:
+            return
+        self._dirty = True
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.save_delay, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _save(self, entries):
+        """캐시를 임시 파일에 쓴 뒤 교체하여 중간에 종료되어도 파일이 깨지지 않게 합니다. _save_lock을 잡은 상태에서 호출합니다."""
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            logger.error(f"응답 캐시 저장 실패: {str(e)}")
+
+
+# 서버 전체에서 공유하는 응답 캐시 인스턴스
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def configure_response_cache(**kwargs):
+    """공유 응답 캐시를 주어진 설정으로 (재)생성합니다."""
+    global _response_cache
+    with _response_cache_lock:
+        _response_cache = ResponseCache(**kwargs)
+        return _response_cache
+
+
+def get_response_cache():
+    """공유 응답 캐시를 반환합니다. 아직 없으면 기본 설정으로 생성합니다."""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache()
+        return _response_cache
@@ -0,0 +1,537 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future
+
+from ai_metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# 기본 스케줄러 설정
+DEFAULT_MAX_QUEUE_SIZE = 64      # 대기열에 쌓일 수 있는 최대 요청 수
+DEFAULT_MAX_BATCH_SIZE = 8       # 한 번의 디코딩에 묶을 최대 요청 수
+DEFAULT_BATCH_WINDOW = 0.05      # 첫 요청 이후 추가 요청을 기다리는 시간(초)
+DEFAULT_MAX_WAIT = 120.0         # 요청이 대기열에서 기다릴 수 있는 최대 시간(초)
+
+# 우선순위 클래스 (앞에 있을수록 먼저 처리)
+PRIORITY_CLASSES = ("interactive", "analysis", "bulk")
+DEFAULT_PRIORITY = "analysis"
+# 클래스별 최대 생성 토큰 수 (긴 생성이 한 배치를 오래 점유하지 않도록 제한)
+DEFAULT_CLASS_MAX_TOKENS = {"interactive": 512, "analysis": 1000, "bulk": 1000}
+# 클래스별로 사용할 수 있는 대기열 비율 (낮은 우선순위 요청이 대기열을 채워 대화형 요청이 거절되지 않도록)
+QUEUE_SHARES = {"interactive": 1.0, "analysis": 0.75, "bulk": 0.5}
+PRIORITY_AGING = 30.0            # 이 시간(초)만큼 기다릴 때마다 한 단계 높은 우선순위로 취급 (기아 방지)
+MAX_TRACKED_CLIENTS = 10000
+
+
+class SchedulerError(Exception):
+    """스케줄러가 요청을 처리할 수 없을 때 발생하는 오류의 기본 클래스입니다."""
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFullError(SchedulerError):
+    """대기열이 가득 찼거나 예상 대기 시간이 허용치를 넘을 때 발생합니다."""
+
+
+class QueueTimeoutError(SchedulerError):
+    """요청이 최대 대기 시간 안에 처리되지 못했을 때 발생합니다."""
+
+
+class RequestCancelledError(SchedulerError):
+    """클라이언트가 요청을 취소했을 때 발생합니다."""
+
+
+def parse_class_max_tokens(value):
+    """'interactive=512,bulk=1000' 형식의 클래스별 최대 토큰 수를 딕셔너리로 변환합니다. 값이 없으면 빈 딕셔너리입니다."""
+    limits = {}
+    for part in (value or "").split(","):
+        if not part.strip():
+            continue
+        name, _, tokens = part.partition("=")
+        name = name.strip()
+        if name not in PRIORITY_CLASSES:
+            raise ValueError(f"알 수 없는 우선순위입니다: {name}")
+        limits[name] = int(tokens)
+    return limits
+
+
+class InferenceRequest:
+    """대기열에 들어가는 하나의 생성 요청입니다.
+
+    stream=True인 요청은 생성된 토큰 조각을 chunks 큐로 전달하며, 배치로 묶이지 않고 단독으로 실행됩니다.
+    session_id가 있는 요청도 세션 KV 캐시를 사용하기 위해 단독으로 실행됩니다.
+    schema(JSON 스키마)가 있는 요청은 같은 스키마의 요청끼리만 배치로 묶입니다.
+    """
+
+    def __init__(self, prompt, max_length, temperature, max_wait, stream=False, session_id=None, model_name=None,
+                 priority=DEFAULT_PRIORITY, client_id=None, schema=None):
+        from ai_structured import schema_key
+
+        self.request_id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.model_name = model_name
+        self.schema = schema
+        self.schema_key = schema_key(schema)
+        self.priority = priority
+        self.client_id = client_id or "anonymous"
+        self.cost = 0  # 공정 분배를 위해 클라이언트에 부과한 토큰 수
+        self.prompt = prompt
+        self.max_length = max_length
+        self.temperature = temperature
+        self.stream = stream
+        self.submitted_at = time.time()
+        self.deadline = self.submitted_at + max_wait
+        self.started_at = None
+        self.first_token_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.chunks = queue.Queue() if stream else None
+        self.future = Future()
+        # 생성 지표 (모델, 백엔드, 토큰 수, 프롬프트 평가/디코딩 시간). 배치의 요청들이 같은 딕셔너리를 공유함
+        self.generation = None
+
+    @property
+    def batch_key(self):
+        """같은 디코딩 스텝을 공유할 수 있는 요청끼리 같은 키를 가집니다."""
+        if self.stream or self.session_id:
+            return ("single", self.request_id)
+        # 우선순위가 다른 요청을 묶으면 짧은 대화형 요청이 긴 분석 요청이 끝날 때까지 기다리게 됨
+        return (self.model_name, self.max_length, self.temperature, self.priority, self.schema_key)
+
+    def rank(self, now):
+        """현재 우선순위 순위를 반환합니다. 오래 기다린 요청일수록 높아집니다 (작을수록 먼저)."""
+        rank = PRIORITY_CLASSES.index(self.priority)
+        return max(rank - int((now - self.submitted_at) // PRIORITY_AGING), 0)
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def is_expired(self, now):
+        return now > self.deadline
+
+    def fail(self, error):
+        """요청을 오류로 종료합니다. 스트리밍 소비자도 깨워 오류를 전달받게 합니다."""
+        self.finished_at = time.time()
+        if not self.future.done():
+            self.future.set_exception(error)
+        if self.stream:
+            self.chunks.put(None)
+
+    def iter_chunks(self):
+        """스트리밍 요청의 토큰 조각을 생성되는 대로 반환합니다. 생성 중 오류가 있으면 마지막에 다시 발생시킵니다."""
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                break
+            yield chunk
+        self.future.result()
+
+    def timings(self):
+        """대기 시간, 첫 토큰까지의 시간(TTFT), 전체 소요 시간을 초 단위로 반환합니다.
+
+        생성 지표가 있으면 프롬프트 평가 시간과 생성 토큰 수, 추측 디코딩 수락률도 함께 반환합니다.
+        """
+        def elapsed(end):
+            return round(end - self.submitted_at, 4) if end else None
+
+        timings = {
+            "queue_wait": elapsed(self.started_at),
+            "ttft": elapsed(self.first_token_at),
+            "total_time": elapsed(self.finished_at)
+        }
+        if self.generation:
+            prompt_eval = self.generation.get("prompt_eval_time")
+            timings["prompt_eval"] = round(prompt_eval, 4) if prompt_eval is not None else None
+            timings["completion_tokens"] = self.generation.get("completion_tokens")
+            if self.generation.get("draft_tokens"):
+                timings["draft_acceptance"] = round(
+                    self.generation.get("accepted_tokens", 0) / self.generation["draft_tokens"], 3)
+        return timings
+
+
+class InferenceScheduler:
+    """생성 요청을 대기열에 모아 배치 단위로 모델에 전달하는 스케줄러입니다.
+
+    모든 생성은 하나의 스케줄러 스레드에서만 실행되므로 공유 모델 컨텍스트에 대한
+    경쟁이 없고, 동시에 들어온 요청은 가능한 한 같은 배치로 묶입니다.
+    executor(워커 풀)가 주어지면 배치를 직접 실행하지 않고 여유 있는 워커에 넘깁니다.
+
+    다음 배치는 우선순위 클래스(interactive → analysis → bulk) 순으로 고르고, 같은 클래스 안에서는
+    지금까지 사용한 토큰이 가장 적은 클라이언트의 요청을 먼저 처리합니다 (토큰 단위 공정 분배).
+    """
+
+    def __init__(self, max_queue_size=DEFAULT_MAX_QUEUE_SIZE, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 batch_window=DEFAULT_BATCH_WINDOW, max_wait=DEFAULT_MAX_WAIT, executor=None, class_max_tokens=None):
+        self.max_queue_size = max_queue_size
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.max_wait = max_wait
+        self.executor = executor
+        self.class_max_tokens = {**DEFAULT_CLASS_MAX_TOKENS, **(class_max_tokens or {})}
+
+        self._queue = deque()
+        self._active = {}
+        self._usage = {}  # 클라이언트별 사용 토큰 수 (가상 시간)
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+        # 처리 시간 통계 (재시도 힌트 계산용)
+        self._avg_batch_time = None
+        self._completed = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._cancelled = 0
+        self._batches = 0
+
+    def start(self):
+        """스케줄러 스레드를 시작합니다."""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(f"추론 스케줄러 시작 (대기열 {self.max_queue_size}, 배치 {self.max_batch_size})")
+
+    def stop(self):
+        """스케줄러 스레드를 중지하고 남은 요청을 실패 처리합니다."""
+        with self._condition:
+            self._running = False
+            pending = list(self._queue)
+            self._queue.clear()
+            self._condition.notify_all()
+        for req in pending:
+            req.fail(SchedulerError("서버가 종료 중입니다."))
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def estimated_wait(self, depth=None):
+        """앞에 있는 요청 수로부터 예상 대기 시간(초)을 계산합니다. depth가 없으면 대기열 전체 길이를 사용합니다."""
+        if depth is None:
+            depth = len(self._queue)
+        batch_time = self._avg_batch_time or 1.0
+        parallelism = self.executor.size if self.executor is not None else 1
+        batches_ahead = depth // (self._batch_limit() * parallelism) + 1
+        return batches_ahead * batch_time
+
+    def effective_max_tokens(self, max_length, priority=None):
+        """우선순위 클래스의 최대 토큰 수를 적용해 요청이 실제로 생성할 수 있는 최대 토큰 수를 반환합니다."""
+        priority = priority or DEFAULT_PRIORITY
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"알 수 없는 우선순위입니다: {priority}")
+        return min(max_length, self.class_max_tokens[priority])
+
+    def submit(self, prompt, max_length=1000, temperature=0.7, max_wait=None, stream=False, session_id=None,
+               model_name=None, priority=None, client_id=None, schema=None):
+        """요청을 대기열에 넣고 InferenceRequest를 반환합니다.
+
+        max_length는 우선순위 클래스의 최대 토큰 수로 제한됩니다.
+        클래스에 허용된 대기열이 가득 찼거나 예상 대기 시간이 max_wait을 넘으면 QueueFullError를 발생시킵니다.
+        """
+        priority = priority or DEFAULT_PRIORITY
+        max_length = self.effective_max_tokens(max_length, priority)
+        if max_wait is None:
+            max_wait = self.max_wait
+        max_wait = min(max_wait, self.max_wait)
+        if self.executor is not None:
+            self.executor.check_available()
+
+        with self._condition:
+            depth = len(self._queue)
+            if depth >= self.max_queue_size * QUEUE_SHARES[priority]:
+                self._rejected += 1
+                raise QueueFullError("대기 중인 요청이 너무 많습니다.", self.estimated_wait(depth))
+
+            # 같거나 높은 우선순위의 요청만 이 요청보다 먼저 처리됨
+            now = time.time()
+            rank = PRIORITY_CLASSES.index(priority)
+            expected = self.estimated_wait(sum(1 for queued in self._queue if queued.rank(now) <= rank))
+            if self._avg_batch_time is not None and expected > max_wait:
+                self._rejected += 1
+                raise QueueFullError("예상 대기 시간이 허용치를 초과합니다.", expected)
+
+            req = InferenceRequest(prompt, max_length, temperature, max_wait, stream, session_id, model_name,
+                                   priority, client_id, schema)
+            self._join_client(req.client_id)
+            self._queue.append(req)
+            self._active[req.request_id] = req
+            self._condition.notify()
+        return req
+
+    def generate(self, prompt, max_length=1000, temperature=0.7, max_wait=None, session_id=None, model_name=None,
+                 priority=None, client_id=None, schema=None):
+        """요청을 제출하고 응답이 생성될 때까지 기다립니다."""
+        if not self._running:
+            self.start()
+        req = self.submit(prompt, max_length, temperature, max_wait, session_id=session_id, model_name=model_name,
+                          priority=priority, client_id=client_id, schema=schema)
+        return req.future.result()
+
+    def submit_stream(self, prompt, max_length=1000, temperature=0.7, max_wait=None, session_id=None, model_name=None,
+                      priority=None, client_id=None, schema=None):
+        """스트리밍 요청을 제출합니다. 반환된 요청의 iter_chunks()로 토큰을 받습니다."""
+        if not self._running:
+            self.start()
+        return self.submit(prompt, max_length, temperature, max_wait, stream=True, session_id=session_id,
+                           model_name=model_name, priority=priority, client_id=client_id, schema=schema)
+
+    def cancel(self, request_id):
+        """요청을 취소합니다. 대기 중이면 대기열에서 빼고, 생성 중이면 다음 토큰에서 디코딩을 멈춥니다."""
+        with self._condition:
+            req = self._active.get(request_id)
+            if req is None:
+                return False
+            req.cancel_event.set()
+            if req in self._queue:
+                self._queue.remove(req)
+                self._active.pop(request_id, None)
+                self._cancelled += 1
+                req.fail(RequestCancelledError("요청이 취소되었습니다."))
+                return True
+        if self.executor is not None:
+            self.executor.cancel(request_id)
+        return True
+
+    def stats(self):
+        """대기열 상태와 처리 통계를 반환합니다."""
+        with self._condition:
+            depth = len(self._queue)
+            by_priority = {priority: 0 for priority in PRIORITY_CLASSES}
+            for req in self._queue:
+                by_priority[req.priority] += 1
+            clients = len(self._usage)
+        return {
+            "queue_depth": depth,
+            "queue_by_priority": by_priority,
+            "class_max_tokens": self.class_max_tokens,
+            "clients": clients,
+            "max_queue_size": self.max_queue_size,
+            "max_batch_size": self.max_batch_size,
+            "avg_batch_time": self._avg_batch_time,
+            "estimated_wait": self.estimated_wait(depth),
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "timed_out": self._timed_out,
+            "cancelled": self._cancelled,
+            "batches": self._batches
+        }
+
+    def _expire_requests(self, now):
+        """최대 대기 시간을 넘긴 요청을 대기열에서 제거합니다. _condition을 잡은 상태에서 호출합니다."""
+        expired = [req for req in self._queue if req.is_expired(now)]
+        for req in expired:
+            self._queue.remove(req)
+            self._active.pop(req.request_id, None)
+            self._timed_out += 1
+            req.fail(QueueTimeoutError("요청이 대기 시간 안에 처리되지 않았습니다.", self.estimated_wait()))
+
+    def _join_client(self, client_id):
+        """대기열에 요청이 없던 클라이언트의 사용량을 대기 중인 클라이언트들의 최소 사용량까지 올립니다.
+
+        오래 쉬었던 클라이언트가 쌓아 둔 몫으로 다른 클라이언트를 밀어내지 않도록 합니다. _condition을 잡은 상태에서 호출합니다.
+        """
+        queued_clients = {req.client_id for req in self._queue}
+        if client_id in queued_clients:
+            return
+        floor = min((self._usage.get(client) or 0 for client in queued_clients), default=0)
+        self._usage[client_id] = max(self._usage.get(client_id, 0), floor)
+        if len(self._usage) > MAX_TRACKED_CLIENTS:
+            self._usage = {client: self._usage[client] for client in queued_clients | {client_id}}
+
+    def _order_key(self, now):
+        """대기열 정렬 키: 우선순위 순위, 클라이언트 사용 토큰 수, 제출 시각 순입니다."""
+        def key(req):
+            return req.rank(now), self._usage.get(req.client_id, 0), req.submitted_at
+        return key
+
+    def _charge(self, req, tokens):
+        """클라이언트 사용량에 토큰을 더합니다 (추정치 부과 후 실제 값으로 보정할 때 음수일 수 있음). _condition을 잡은 상태에서 호출합니다."""
+        self._usage[req.client_id] = self._usage.get(req.client_id, 0) + tokens
+        req.cost += tokens
+
+    def _batch_limit(self, req=None):
+        """요청을 몇 개까지 한 배치로 묶을지 반환합니다. req가 없으면 기본 모델 기준입니다.
+
+        llama.cpp는 배치 안의 프롬프트를 순서대로 하나씩 처리하므로 묶어도 처리량은 같고, 모든 요청이
+        마지막 프롬프트가 끝날 때까지 기다리게 됩니다. 그래서 디코딩 스텝을 공유하는 transformers 모델만 묶습니다.
+        워커 모드에서는 워커 풀에 맞춰 설정한 max_batch_size를 그대로 사용합니다.
+        """
+        from ai_registry import get_registry
+
+        if req is not None and (req.stream or req.session_id):
+            return 1
+        if self.executor is not None:
+            return self.max_batch_size
+        handle = get_registry().get(req.model_name if req is not None else None)
+        if handle is None or handle.is_llama_cpp:
+            return 1
+        return self.max_batch_size
+
+    def _next_batch(self):
+        """다음에 실행할 배치를 대기열에서 꺼냅니다.
+
+        우선순위와 공정 분배 순서로 가장 앞선 요청을 고르고, 그 요청과 배치 키가 같은 요청만 묶습니다.
+        """
+        with self._condition:
+            while self._running and not self._queue:
+                self._condition.wait()
+            if not self._running:
+                return []
+
+            # 첫 요청 이후 잠시 기다려 동시에 들어오는 요청을 같은 배치로 묶음
+            # (단독 실행하는 요청이나 llama.cpp처럼 배치로 묶지 않는 모델은 기다리지 않음)
+            window_end = time.time() + self.batch_window
+            while self._queue and len(self._queue) < self._batch_limit(min(self._queue,
+                                                                           key=self._order_key(time.time()))):
+                remaining = window_end - time.time()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            self._expire_requests(time.time())
+            if not self._queue:
+                return []
+
+            ordered = sorted(self._queue, key=self._order_key(time.time()))
+            key = ordered[0].batch_key
+            batch = [req for req in ordered if req.batch_key == key][:self._batch_limit(ordered[0])]
+            for req in batch:
+                self._queue.remove(req)
+                # 실행 전에는 최대 토큰 수로 부과하고, 끝난 뒤 실제 사용량으로 보정
+                self._charge(req, req.max_length)
+        return batch
+
+    def _run_batch(self, batch):
+        """일반 요청 배치를 한 번의 생성 호출로 처리합니다."""
+        try:
+            from ai_model import generate_batch, generate_session
+
+            first = batch[0]
+            stats = {}
+            for req in batch:
+                req.generation = stats
+            if first.session_id:
+                responses = [generate_session(first.prompt, first.max_length, first.temperature, first.session_id,
+                                              first.model_name, stats, first.schema)]
+            else:
+                responses = generate_batch([req.prompt for req in batch], first.max_length, first.temperature,
+                                           first.model_name, stats, first.schema)
+            finished_at = time.time()
+            for req, response in zip(batch, responses):
+                req.finished_at = finished_at
+                req.future.set_result(response)
+        except Exception as e:
+            logger.error(f"배치 생성 중 오류 발생: {str(e)}")
+            for req in batch:
+                req.fail(e)
+
+    def _run_stream(self, req):
+        """스트리밍 요청을 처리하며 생성된 토큰을 소비자에게 바로 전달합니다."""
+        if req.cancelled:
+            req.fail(RequestCancelledError("요청이 취소되었습니다."))
+            return
+        try:
+            from ai_model import generate_stream
+
+            req.generation = {}
+            for chunk in generate_stream(req.prompt, req.max_length, req.temperature, req.cancel_event,
+                                         req.session_id, req.model_name, req.generation, req.schema):
+                if req.first_token_at is None:
+                    req.first_token_at = time.time()
+                req.chunks.put(chunk)
+                if req.cancelled:
+                    break
+            if req.cancelled:
+                logger.info(f"스트리밍 요청 취소됨: {req.request_id}")
+            req.finished_at = time.time()
+            req.future.set_result(None)
+            req.chunks.put(None)
+        except Exception as e:
+            logger.error(f"스트리밍 생성 중 오류 발생: {str(e)}")
+            req.fail(e)
+
+    def _batch_done(self, batch):
+        """배치 처리가 끝난 뒤 통계를 갱신합니다. 워커 풀을 사용하면 풀의 결과 수신 스레드에서 호출됩니다."""
+        elapsed = time.time() - batch[0].started_at
+        # 스트리밍이 아닌 요청은 생성 지표의 첫 토큰 시각을 TTFT로 사용
+        first_token_times = (batch[0].generation or {}).get("first_token_times")
+        if first_token_times:
+            for index, req in enumerate(batch):
+                if req.first_token_at is None:
+                    req.first_token_at = first_token_times[min(index, len(first_token_times) - 1)]
+        get_metrics().record_batch(batch)
+        generation = batch[0].generation or {}
+        used = generation.get("prompt_tokens", 0) + generation.get("completion_tokens", 0)
+        with self._condition:
+            for req in batch:
+                self._active.pop(req.request_id, None)
+                if generation:
+                    self._charge(req, used / len(batch) - req.cost)
+                if req.cancelled:
+                    self._cancelled += 1
+                elif req.future.done() and req.future.exception() is None:
+                    self._completed += 1
+            self._batches += 1
+            if self._avg_batch_time is None:
+                self._avg_batch_time = elapsed
+            else:
+                self._avg_batch_time = 0.8 * self._avg_batch_time + 0.2 * elapsed
+        logger.info(f"배치 처리 완료: {len(batch)}개 요청, {elapsed:.2f}초")
+
+    def _run(self):
+        while self._running:
+            # 워커 풀을 사용하면 여유 있는 워커가 생긴 뒤에 배치를 꺼내 대기열에서 취소와 만료가 계속 동작하게 함
+            if self.executor is not None and not self.executor.wait_for_capacity(timeout=1.0):
+                continue
+            batch = self._next_batch()
+            batch = [req for req in batch if req.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            start_time = time.time()
+            for req in batch:
+                req.started_at = start_time
+            if self.executor is not None:
+                self.executor.submit(batch, self._batch_done)
+                continue
+            try:
+                if batch[0].stream:
+                    self._run_stream(batch[0])
+                else:
+                    self._run_batch(batch)
+            finally:
+                self._batch_done(batch)
+
+
+# 서버 전체에서 공유하는 스케줄러 인스턴스
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def configure_scheduler(**kwargs):
+    """공유 스케줄러를 주어진 설정으로 (재)생성합니다."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is not None:
+            _scheduler.stop()
+        _scheduler = InferenceScheduler(**kwargs)
+        _scheduler.start()
+        return _scheduler
+
+
+def get_scheduler():
+    """공유 스케줄러를 반환합니다. 아직 없으면 기본 설정으로 생성합니다."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = InferenceScheduler()
+            _scheduler.start()
+        return _scheduler
@@ -1,9 +1,14 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS
+import gzip
 import logging
+import mimetypes
+import threading
 import time
 import os
 import json
+import math
+from werkzeug.security import safe_join
 
 # 로깅 설정
 logging.basicConfig(
@@ -19,44 +24,418 @@ CORS(app)  # 크로스 오리진 요청 허용
 # 루트 디렉토리 설정
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# 서버 시작 시각과 시작 단계별 소요 시간 (/api/status에서 확인)
+SERVER_STARTED_AT = time.time()
+STARTUP_PHASES = {}
+
+# 정적 파일 캐시 설정 (HTML은 항상 ETag로 재검증하고, 나머지는 잠시 브라우저 캐시를 그대로 사용)
+STATIC_MAX_AGE = 600
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+GZIP_MIN_SIZE = 1024
+# 정적 파일 루트는 저장소 전체이므로 프론트엔드 파일 확장자만 제공하고, 숨김 폴더와 모델/캐시 폴더는 제공하지 않음
+STATIC_EXTENSIONS = ('.html', '.css', '.js', '.md', '.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', '.webp',
+                     '.woff', '.woff2', '.ttf')
+PRIVATE_STATIC_DIRS = ('models_cache', 'gguf_models', 'node_modules')
+
+# 요청 본문으로 받을 수 있는 생성 길이와 대기 시간의 상한
+MAX_GENERATION_TOKENS = 8192
+MAX_REQUEST_WAIT = 3600.0
+
+# 압축한 정적 파일 캐시: 경로 -> (수정 시각, 파일 크기, 압축된 본문)
+_gzip_cache = {}
+_gzip_cache_lock = threading.Lock()
+
+def request_payload():
+    """요청 본문을 JSON으로 반환합니다. Content-Encoding이 gzip/deflate이면 압축을 풀어서 읽습니다."""
+    from ai_attendance import decode_json
+    
+    if not request.headers.get('Content-Encoding'):
+        return request.get_json(force=True, silent=True) or {}
+    return decode_json(request.get_data(), request.headers.get('Content-Encoding'))
+
+def attendance_error_response(error):
+    """출결 데이터 오류를 HTTP 응답으로 변환합니다. 버전 충돌이면 서버의 현재 버전을 함께 알려줍니다."""
+    payload = {"error": str(error)}
+    if getattr(error, 'current_version', None) is not None:
+        payload["current_version"] = error.current_version
+    return jsonify(payload), error.status_code
+
+def scheduler_error_response(error):
+    """스케줄러 오류를 재시도 힌트가 포함된 HTTP 응답으로 변환합니다."""
+    from ai_scheduler import QueueFullError
+    
+    retry_after = max(1, math.ceil(error.retry_after))
+    status_code = 429 if isinstance(error, QueueFullError) else 503
+    response = jsonify({"error": str(error), "retry_after": retry_after})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, status_code
+
+@app.before_request
+def start_timer():
+    g.request_started = time.time()
+    if request.path.startswith('/api/'):
+        from ai_memory import memory_sample
+        g.memory_before = memory_sample()
+
+@app.after_request
+def record_request_metrics(response):
+    """요청 처리 시간과 API 요청 전후의 메모리 차이를 지표에 기록하고 API 응답에 Server-Timing 헤더를 붙입니다.
+    
+    생성 요청이면 대기 시간, 프롬프트 평가 시간, 첫 토큰까지의 시간, 생성 시간이 함께 포함됩니다.
+    스트리밍 응답은 본문을 보내기 전에 기록되므로 생성 중 메모리 차이는 생성 지표(ai_generation_rss_delta_bytes)에서 확인합니다.
+    """
+    from ai_memory import memory_delta, memory_sample
+    from ai_metrics import get_metrics
+    
+    duration = time.time() - g.get('request_started', time.time())
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unknown'
+    if endpoint == '/<path:path>':
+        endpoint = 'static'
+    delta = memory_delta(g.memory_before, memory_sample()) if 'memory_before' in g else {}
+    get_metrics().record_http(endpoint, request.method, response.status_code, duration, delta.get('rss_delta'))
+    
+    if request.path.startswith('/api/'):
+        timings = [f"total;dur={duration * 1000:.1f}"] + g.get('server_timing', [])
+        if delta:
+            timings.append('memory;desc="' + ", ".join(f"{key[:-6]} {value / 1024 ** 2:+.1f}MB"
+                                                     for key, value in delta.items()) + '"')
+        response.headers['Server-Timing'] = ", ".join(timings)
+    return response
+
+def record_generation_timing(req):
+    """생성 요청의 단계별 소요 시간을 Server-Timing 헤더에 넣을 수 있게 기록합니다."""
+    timings = req.timings()
+    entries = []
+    for name, key in (("queue", "queue_wait"), ("prompt_eval", "prompt_eval"), ("ttft", "ttft"), ("gen", "total_time")):
+        if timings.get(key) is not None:
+            entries.append(f"{name};dur={timings[key] * 1000:.1f}")
+    g.server_timing = g.get('server_timing', []) + entries
+
+def classify_request(data, default_priority):
+    """요청의 우선순위 클래스와 클라이언트 ID를 정해 g에 기록합니다.
+    
+    클라이언트는 본문의 priority로 엔드포인트 기본값보다 낮은 우선순위만 요청할 수 있습니다
+    (분석 요청이 interactive로 끼어들지 못하도록). 클라이언트 ID는 X-Client-Id 헤더, 없으면 접속 IP입니다.
+    알 수 없는 우선순위이면 ValueError를 발생시킵니다.
+    """
+    from ai_scheduler import PRIORITY_CLASSES
+    
+    priority = data.get('priority') or default_priority
+    if priority not in PRIORITY_CLASSES:
+        raise ValueError(f"알 수 없는 우선순위입니다: {priority}")
+    if PRIORITY_CLASSES.index(priority) < PRIORITY_CLASSES.index(default_priority):
+        priority = default_priority
+    g.priority = priority
+    g.client_id = request.headers.get('X-Client-Id') or request.remote_addr
+
+def run_generation(prompt, max_length, temperature, max_wait, session_id=None, model_name=None, schema=None):
+    """스케줄러로 응답을 생성하고 단계별 소요 시간을 기록합니다."""
+    from ai_scheduler import get_scheduler
+    
+    req = get_scheduler().submit(prompt, max_length, temperature, max_wait, session_id=session_id,
+                                 model_name=model_name, priority=g.get('priority'), client_id=g.get('client_id'),
+                                 schema=schema)
+    try:
+        return req.future.result()
+    finally:
+        record_generation_timing(req)
+
+def sse_event(payload):
+    """Server-Sent Events 형식의 이벤트 문자열을 만듭니다."""
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def stream_response(prompt, max_length, temperature, max_wait, session_id=None, model_name=None, schema=None):
+    """생성되는 토큰을 Server-Sent Events로 전달하는 응답을 만듭니다.
+    
+    첫 이벤트로 요청 ID를 보내며, 클라이언트는 /api/cancel/<request_id>로 생성을 중단할 수 있습니다.
+    클라이언트 연결이 끊겨도 생성이 취소되어 다음 요청이 바로 실행됩니다.
+    schema가 주어지면 마지막 이벤트에 파싱한 결과(result)를 함께 보냅니다.
+    """
+    from ai_scheduler import get_scheduler
+    from ai_structured import structured_result
+    
+    scheduler = get_scheduler()
+    req = scheduler.submit_stream(prompt, max_length, temperature, max_wait, session_id, model_name,
+                                  g.get('priority'), g.get('client_id'), schema)
+    
+    def events():
+        yield sse_event({"event": "start", "request_id": req.request_id})
+        try:
+            chunks = []
+            for chunk in req.iter_chunks():
+                chunks.append(chunk)
+                yield sse_event({"token": chunk})
+            result = structured_result("".join(chunks), schema) if schema is not None and not req.cancelled else {}
+            yield sse_event({"event": "done", "cancelled": req.cancelled, **result, **req.timings()})
+        except Exception as e:
+            logger.error(f"스트리밍 오류: {str(e)}")
+            yield sse_event({"event": "error", "error": str(e), **req.timings()})
+        finally:
+            # 클라이언트 연결이 끊기면 GeneratorExit로 이곳에 도달하므로 생성을 중단함
+            if req.finished_at is None:
+                scheduler.cancel(req.request_id)
+    
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Request-Id'] = req.request_id
+    return response
+
+def requested_model(data):
+    """요청 본문의 model 필드를 확인합니다. 지정하지 않으면 None(기본 모델)을 반환합니다.
+    
+    사용 가능한 모델 목록에도 없고 메모리에 올라와 있지도 않은 모델이면 ValueError를 발생시킵니다.
+    """
+    from ai_model import get_available_models
+    from ai_registry import get_registry
+    
+    name = data.get('model')
+    if not name:
+        return None
+    if get_registry().get(name) is None and name not in {m["id"] for m in get_available_models()}:
+        raise ValueError(f"알 수 없는 모델입니다: {name}")
+    return name
+
+def requested_generation_params(data, max_length=1000, temperature=0.7):
+    """요청 본문의 max_length, temperature, max_wait을 확인해 (max_length, temperature, max_wait)로 반환합니다.
+    
+    지정하지 않은 값은 주어진 기본값(max_wait은 None, 서버 기본값)을 사용합니다. 타입이나 범위가 맞지 않으면 ValueError를 발생시킵니다.
+    """
+    def number(key, default, kind, low, high):
+        value = data.get(key, default)
+        if value is None:
+            return default
+        # bool은 int의 하위 클래스이므로 따로 거부
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or (kind is int and value != int(value)):
+            raise ValueError(f"{key}는 {'정수' if kind is int else '숫자'}여야 합니다.")
+        if not low <= value <= high:
+            raise ValueError(f"{key}는 {low}에서 {high} 사이여야 합니다.")
+        return kind(value)
+    
+    return (number('max_length', max_length, int, 1, MAX_GENERATION_TOKENS),
+            number('temperature', temperature, float, 0.0, 2.0),
+            number('max_wait', None, float, 0.1, MAX_REQUEST_WAIT))
+
+def requested_schema(data):
+    """요청 본문의 schema 필드(스키마 이름 또는 JSON 스키마)를 확인합니다. 지정하지 않으면 None을 반환합니다.
+    
+    사용할 수 없는 스키마이면 ValueError(SchemaError)를 발생시킵니다.
+    """
+    from ai_structured import resolve_schema
+    
+    return resolve_schema(data.get('schema'))
+
+def cached_generate(prompt, max_length, temperature, max_wait, data=None, model_name=None, schema=None):
+    """응답 캐시를 먼저 확인하고, 없으면 스케줄러로 생성한 뒤 캐시에 저장합니다.
+    
+    결과가 거의 결정적인 낮은 온도의 요청만 캐시합니다.
+    """
+    from ai_registry import get_registry
+    from ai_response_cache import get_response_cache
+    from ai_structured import schema_key
+    
+    cache = get_response_cache()
+    if not cache.is_cacheable(temperature):
+        return run_generation(prompt, max_length, temperature, max_wait, model_name=model_name, schema=schema)
+    
+    key = cache.make_key(prompt, data, model=model_name or get_registry().default_name,
+                         max_length=max_length, temperature=temperature, schema=schema_key(schema))
+    response = cache.get(key)
+    if response is not None:
+        logger.info(f"응답 캐시 적중: {prompt[:50]}...")
+        g.server_timing = g.get('server_timing', []) + ['cache;desc="hit"']
+        return response
+    
+    response = run_generation(prompt, max_length, temperature, max_wait, model_name=model_name, schema=schema)
+    cache.put(key, response)
+    return response
+
+def gzip_static(file_path, stat):
+    """정적 파일을 gzip으로 압축한 본문을 반환합니다. 파일이 바뀌지 않았으면 이전에 압축한 결과를 재사용합니다."""
+    with _gzip_cache_lock:
+        cached = _gzip_cache.get(file_path)
+        if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+            return cached[2]
+    
+    with open(file_path, 'rb') as f:
+        body = gzip.compress(f.read(), compresslevel=6, mtime=0)
+    with _gzip_cache_lock:
+        _gzip_cache[file_path] = (stat.st_mtime, stat.st_size, body)
+    return body
+
+def is_public_static_path(path):
+    """프론트엔드 파일로 제공해도 되는 경로인지 확인합니다 (데이터베이스, 캐시, 모델, 서버 소스 등은 제외)."""
+    parts = path.replace('\\', '/').split('/')
+    if parts[0] in PRIVATE_STATIC_DIRS or any(part.startswith('.') for part in parts):
+        return False
+    return os.path.splitext(path)[1].lower() in STATIC_EXTENSIONS
+
+def static_response(path):
+    """정적 파일을 ETag, Cache-Control과 함께 반환하고, 클라이언트가 지원하면 gzip으로 압축합니다.
+    
+    If-None-Match/If-Modified-Since가 일치하면 본문 없이 304를 반환합니다.
+    """
+    file_path = safe_join(app.static_folder, path) if is_public_static_path(path) else None
+    if file_path is None or not os.path.isfile(file_path):
+        return jsonify({"error": "파일을 찾을 수 없습니다."}), 404
+    
+    mimetype = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+    stat = os.stat(file_path)
+    
+    if (stat.st_size >= GZIP_MIN_SIZE and mimetype.startswith(COMPRESSIBLE_TYPES)
+            and 'gzip' in request.accept_encodings):
+        response = Response(gzip_static(file_path, stat), mimetype=mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(f"{int(stat.st_mtime)}-{stat.st_size}-gz")
+        response.last_modified = stat.st_mtime
+    else:
+        response = send_from_directory(app.static_folder, path)
+        response.set_etag(f"{int(stat.st_mtime)}-{stat.st_size}")
+    
+    response.vary.add('Accept-Encoding')
+    if mimetype == 'text/html':
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+    return response.make_conditional(request)
+
 @app.route('/')
 def index():
-    return send_from_directory(app.static_folder, 'index.html')
+    return static_response('index.html')
 
 @app.route('/<path:path>')
 def serve_static(path):
-    return send_from_directory(app.static_folder, path)
+    return static_response(path)
 
 @app.route('/api/status', methods=['GET'])
 def api_status():
     """서버 상태를 확인합니다."""
-    from ai_model import is_model_loaded
+    from ai_model import is_model_loaded, get_active_model_info
+    from ai_loader import get_loader
+    from ai_scheduler import get_scheduler
+    from ai_session_cache import get_session_cache
+    from ai_response_cache import get_response_cache
+    from ai_registry import get_registry
+    from ai_context import get_history_manager
+    from ai_jobs import get_job_manager
+    from ai_attendance import get_attendance_store
+    from ai_memory import read_rss
+    from ai_workers import get_worker_pool
+    
+    pool = get_worker_pool()
+    pool_stats = pool.stats() if pool is not None else None
+    
+    # 서버 시작부터 첫 모델이 준비될 때까지 걸린 시간
+    if pool_stats:
+        loaded_times = [w["model"]["loaded_at"] for w in pool_stats["workers"] if w["model"]]
+    else:
+        model_info = get_active_model_info()
+        loaded_times = [model_info["loaded_at"]] if model_info else []
+    ready_after = round(min(loaded_times) - SERVER_STARTED_AT, 2) if loaded_times else None
     
     return jsonify({
         "status": "online",
-        "model_loaded": is_model_loaded(),
+        "model_loaded": pool_stats["ready"] > 0 if pool_stats else is_model_loaded(),
+        "model": get_active_model_info(),
+        "load_jobs": [job.to_dict() for job in get_loader().active_jobs()],
         "server_time": time.time(),
-        "server_version": "1.0.0"
+        "server_version": "1.0.0",
+        "scheduler": get_scheduler().stats(),
+        "session_cache": get_session_cache().stats(),
+        "response_cache": get_response_cache().stats(),
+        "chat_history": get_history_manager().stats(),
+        "batch_jobs": get_job_manager().stats(),
+        "attendance": get_attendance_store().stats(),
+        "models": get_registry().stats(),
+        "workers": pool_stats,
+        "memory": read_rss(),
+        "startup": {"started_at": SERVER_STARTED_AT, "phases": STARTUP_PHASES, "ready_after": ready_after}
     })
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 형식의 서버 지표를 반환합니다."""
+    from ai_metrics import get_metrics
+    
+    return Response(get_metrics().render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/debug/memory', methods=['GET'])
+def api_debug_memory():
+    """프로세스 메모리 상태를 진단용으로 반환합니다.
+    
+    RSS/힙/CUDA 사용량, 메모리 가드 통계와 최근 측정 기록, 상주 모델과 세션 캐시 크기, 워커별 RSS를 포함합니다.
+    --trace-memory로 tracemalloc을 켠 경우 추적 시작 이후 가장 많이 늘어난 할당 위치(top 개)도 포함합니다.
+    """
+    try:
+        from ai_memory import get_memory_guard
+        from ai_registry import get_registry
+        from ai_session_cache import get_session_cache
+        from ai_workers import get_worker_pool
+        
+        top = min(max(request.args.get('top', 20, type=int), 1), 100)
+        guard = get_memory_guard()
+        pool = get_worker_pool()
+        models = get_registry().stats()
+        return jsonify({
+            "time": time.time(),
+            "pid": os.getpid(),
+            "uptime": round(time.time() - SERVER_STARTED_AT, 1),
+            "process": guard.stats(),
+            "history": [{"time": round(at, 1), "rss": rss, "rss_anon": rss_anon}
+                        for at, rss, rss_anon in guard.history()],
+            "models": {
+                "bytes": models["bytes"],
+                "max_bytes": models["max_bytes"],
+                "resident": [{key: handle[key] for key in ("model_name", "handle_id", "bytes", "in_use", "loaded_at")}
+                             for handle in models["resident"]]
+            },
+            "session_cache": get_session_cache().stats(),
+            "workers": [{key: worker[key] for key in ("index", "pid", "state", "memory", "restarts", "recycles")}
+                        for worker in pool.stats()["workers"]] if pool is not None else None,
+            "allocations": guard.top_allocations(top)
+        })
+    except Exception as e:
+        logger.error(f"메모리 정보 조회 중 오류 발생: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/generate', methods=['POST'])
 def api_generate():
     """텍스트 생성 API 엔드포인트"""
     try:
-        # AI 모델 모듈 임포트 (매번 임포트하여 최신 상태 유지)
-        from ai_model import generate_response
+        from ai_attendance import AttendanceError
+        from ai_scheduler import SchedulerError
+        from ai_structured import structured_result
         
-        data = request.json
+        data = request_payload()
         prompt = data.get('prompt', '')
-        max_length = data.get('max_length', 1000)
-        temperature = data.get('temperature', 0.7)
         
         if not prompt:
             return jsonify({"error": "프롬프트가 비어있습니다"}), 400
+        try:
+            max_length, temperature, max_wait = requested_generation_params(data)
+            model_name = requested_model(data)
+            schema = requested_schema(data)
+            classify_request(data, "analysis")
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        # 정형 출력: 스키마를 따르는 JSON만 생성하고 객체가 닫히면 바로 멈춤
+        if schema is not None:
+            from ai_structured import structured_prompt
+            prompt = structured_prompt(prompt, schema)
+        
+        if data.get('stream', False):
+            return stream_response(prompt, max_length, temperature, max_wait, model_name=model_name, schema=schema)
         
-        response = generate_response(prompt, max_length, temperature)
+        response = cached_generate(prompt, max_length, temperature, max_wait, model_name=model_name, schema=schema)
+        if schema is not None:
+            return jsonify({"response": response, **structured_result(response, schema)})
         return jsonify({"response": response})
     
+    except AttendanceError as e:
+        return attendance_error_response(e)
+    except SchedulerError as e:
+        return scheduler_error_response(e)
     except Exception as e:
         logger.error(f"API 오류: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -65,34 +444,34 @@ def api_generate():
 def api_chat():
     """챗봇 API 엔드포인트"""
     try:
-        # AI 모델 모듈 임포트
-        from ai_model import generate_response
+        from ai_attendance import AttendanceError
+        from ai_scheduler import SchedulerError, get_scheduler
+        from ai_prompts import build_chat_prompt
         
-        data = request.json
+        data = request_payload()
         message = data.get('message', '')
         context = data.get('context', [])
         attendance_data = data.get('attendanceData', {})
+        session_id = data.get('session_id')
         
         if not message:
             return jsonify({"error": "메시지가 비어있습니다"}), 400
+        try:
+            _, _, max_wait = requested_generation_params(data)
+            model_name = requested_model(data)
+            classify_request(data, "interactive")
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        # 컨텍스트를 포함한 프롬프트 구성
-        full_prompt = ""
-        
-        # 이전 대화 내역 추가
-        if context:
-            for msg in context:
-                if msg['role'] == 'user':
-                    full_prompt += f"User: {msg['content']}\n\n"
-                else:
-                    full_prompt += f"A: {msg['content']}\n\n"
+        # 이전 대화 예산은 우선순위 클래스 제한을 적용한 실제 생성 길이만큼 응답 자리를 남기고 계산
+        reserve = get_scheduler().effective_max_tokens(1000, g.get('priority'))
+        full_prompt = build_chat_prompt(message, context, attendance_data, session_id, reserve, model_name)
         
-        # 현재 사용자 메시지 추가
-        full_prompt += f"User: {message}\n\n"
-        full_prompt += "A:"
+        if data.get('stream', False):
+            return stream_response(full_prompt, 1000, 0.7, max_wait, session_id, model_name)
         
-        # 응답 생성
-        response = generate_response(full_prompt, 1000, 0.7)
+        # 응답 생성 (session_id가 있으면 이전 턴의 KV 캐시를 재사용)
+        response = run_generation(full_prompt, 1000, 0.7, max_wait, session_id, model_name)
         
         # 응답에서 불필요한 접두어/접미어 제거
         response = response.strip()
@@ -103,45 +482,291 @@ def api_chat():
         
         return jsonify({"response": response})
     
+    except AttendanceError as e:
+        return attendance_error_response(e)
+    except SchedulerError as e:
+        return scheduler_error_response(e)
     except Exception as e:
         logger.error(f"채팅 API 오류: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/cancel/<request_id>', methods=['POST'])
+def api_cancel(request_id):
+    """진행 중이거나 대기 중인 생성 요청을 취소합니다."""
+    from ai_scheduler import get_scheduler
+    
+    if get_scheduler().cancel(request_id):
+        return jsonify({"success": True, "request_id": request_id})
+    return jsonify({"success": False, "error": "해당 요청을 찾을 수 없습니다."}), 404
+
+@app.route('/api/analyze', methods=['POST'])
+def api_analyze():
+    """출결 데이터 분석 API 엔드포인트"""
+    try:
+        from ai_attendance import AttendanceError
+        from ai_scheduler import SchedulerError
+        from ai_prompts import build_analyze_prompt
+        from ai_structured import structured_result
+        
+        data = request_payload()
+        prompt = data.get('prompt', '')
+        attendance_data = data.get('data', {}) or {}
+        
+        if not prompt:
+            return jsonify({"error": "프롬프트가 비어있습니다"}), 400
+        try:
+            max_length, temperature, max_wait = requested_generation_params(data)
+            model_name = requested_model(data)
+            schema = requested_schema(data)
+            classify_request(data, "analysis")
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        full_prompt, stats = build_analyze_prompt(prompt, attendance_data, schema)
+        
+        if data.get('stream', False):
+            return stream_response(full_prompt, max_length, temperature, max_wait, model_name=model_name,
+                                   schema=schema)
+        
+        response = cached_generate(full_prompt, max_length, temperature, max_wait, model_name=model_name,
+                                   schema=schema)
+        if schema is not None:
+            return jsonify({"response": response, "stats": stats, **structured_result(response, schema)})
+        return jsonify({"response": response, "stats": stats})
+    
+    except AttendanceError as e:
+        return attendance_error_response(e)
+    except SchedulerError as e:
+        return scheduler_error_response(e)
+    except Exception as e:
+        logger.error(f"분석 API 오류: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/attendance/<dataset_id>', methods=['PUT'])
+def api_put_attendance(dataset_id):
+    """출결 데이터 전체를 데이터셋의 새 버전으로 올립니다.
+    
+    본문은 {"students": ..., "attendance": ...} 또는 열 형식({"format": "columnar", ...})이며 gzip으로 압축할 수 있습니다.
+    이후 채팅/분석 요청은 원본 대신 {"dataset": {"id": dataset_id, "version": version}}을 보내면 됩니다.
+    """
+    from ai_attendance import AttendanceError, decode_attendance, get_attendance_store
+    
+    try:
+        students, attendance = decode_attendance(request_payload())
+        snapshot = get_attendance_store().put(dataset_id, students, attendance)
+        return jsonify(snapshot.to_dict())
+    except AttendanceError as e:
+        return attendance_error_response(e)
+
+@app.route('/api/attendance/<dataset_id>', methods=['PATCH'])
+def api_patch_attendance(dataset_id):
+    """기준 버전({"base_version": n})에 바뀐 부분({"delta": {...}})만 적용해 새 버전을 만듭니다.
+    
+    서버의 버전이 다르면 409와 현재 버전을, 데이터셋이 없으면(제거됨) 404를 반환하며
+    이때 클라이언트는 PUT으로 전체 데이터를 다시 올립니다.
+    """
+    from ai_attendance import AttendanceError, get_attendance_store
+    
+    try:
+        data = request_payload()
+        snapshot = get_attendance_store().apply_delta(dataset_id, data.get('base_version'), data.get('delta') or {})
+        return jsonify(snapshot.to_dict())
+    except AttendanceError as e:
+        return attendance_error_response(e)
+
+@app.route('/api/attendance/<dataset_id>', methods=['GET'])
+def api_get_attendance(dataset_id):
+    """데이터셋의 현재 버전과 요약 정보를 반환합니다."""
+    from ai_attendance import AttendanceError, get_attendance_store
+    
+    try:
+        return jsonify(get_attendance_store().get(dataset_id).to_dict())
+    except AttendanceError as e:
+        return attendance_error_response(e)
+
+@app.route('/api/attendance/<dataset_id>/records', methods=['GET'])
+def api_attendance_records(dataset_id):
+    """데이터셋의 출결 기록을 학급(class_id), 학생(student_id), 기간(from, to), 상태(status)로 조회합니다.
+    
+    예: /api/attendance/<dataset_id>/records?class_id=1&from=2024-03-01&to=2024-03-31&status=absent
+    """
+    from ai_attendance import AttendanceError, get_attendance_store, parse_period
+    
+    try:
+        start, end = parse_period({"from": request.args.get('from'), "to": request.args.get('to')})
+        limit = request.args.get('limit', type=int)
+        records = get_attendance_store().query_records(
+            dataset_id,
+            class_id=request.args.get('class_id'),
+            student_id=request.args.get('student_id'),
+            start=start,
+            end=end,
+            status=request.args.get('status'),
+            limit=limit
+        )
+        return jsonify({"dataset_id": dataset_id, "count": len(records), "records": records})
+    except AttendanceError as e:
+        return attendance_error_response(e)
+
+@app.route('/api/attendance/<dataset_id>/stats', methods=['GET'])
+def api_attendance_stats(dataset_id):
+    """데이터셋의 학급별 통계와 요약을 반환합니다. class_id(여러 번 지정 가능)와 기간(from, to)으로 제한할 수 있습니다."""
+    from ai_attendance import AttendanceError, get_attendance_store, parse_period
+    
+    try:
+        start, end = parse_period({"from": request.args.get('from'), "to": request.args.get('to')})
+        snapshot = get_attendance_store().get(dataset_id)
+        stats, summary = snapshot.summarize(request.args.getlist('class_id') or None, start, end)
+        return jsonify({"dataset_id": dataset_id, "version": snapshot.version, "period": [start, end],
+                        "stats": stats, "summary": summary})
+    except AttendanceError as e:
+        return attendance_error_response(e)
+
+@app.route('/api/jobs', methods=['POST'])
+def api_create_job():
+    """여러 학급의 분석 요청을 배치 작업으로 등록합니다.
+    
+    본문은 한 줄에 한 항목씩인 JSONL이거나 {"items": [...], "run_hours": "22-7"} 형식의 JSON이며 gzip으로 압축할 수 있습니다.
+    작업은 대화형 요청이 없을 때만 실행되며, 진행 상황은 /api/jobs/<job_id>에서 확인합니다.
+    """
+    try:
+        from ai_attendance import AttendanceError
+        from ai_jobs import get_job_manager
+        
+        options = {}
+        if request.is_json:
+            data = request_payload()
+            items = data.get('items', [])
+            options = {key: data[key] for key in ('max_length', 'temperature', 'schema') if key in data}
+            run_hours = data.get('run_hours')
+        else:
+            from ai_attendance import decode_body
+            
+            body = decode_body(request.get_data(), request.headers.get('Content-Encoding'))
+            lines = body.decode('utf-8').splitlines()
+            items = [json.loads(line) for line in lines if line.strip()]
+            run_hours = request.args.get('run_hours')
+            data = {"model": request.args.get('model')}
+        
+        try:
+            requested_generation_params(options)
+            model_name = requested_model(data)
+            job = get_job_manager().create(items, run_hours, model_name, options)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({"success": True, "job_id": job.job_id, "job": job.to_dict()}), 202
+    
+    except AttendanceError as e:
+        return attendance_error_response(e)
+    except Exception as e:
+        logger.error(f"배치 작업 등록 오류: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/jobs', methods=['GET'])
+def api_list_jobs():
+    """배치 작업 목록을 반환합니다."""
+    from ai_jobs import get_job_manager
+    
+    return jsonify({"jobs": get_job_manager().list()})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def api_job_status(job_id):
+    """배치 작업의 진행 상황을 반환합니다."""
+    from ai_jobs import get_job_manager
+    
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({"error": "해당 작업을 찾을 수 없습니다."}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/results', methods=['GET'])
+def api_job_results(job_id):
+    """지금까지 처리된 배치 작업 결과를 JSONL로 반환합니다."""
+    from ai_jobs import get_job_manager
+    
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({"error": "해당 작업을 찾을 수 없습니다."}), 404
+    if not os.path.exists(job.output_path):
+        return Response("", mimetype='application/x-ndjson')
+    return send_from_directory(os.path.dirname(job.output_path), os.path.basename(job.output_path),
+                               mimetype='application/x-ndjson')
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def api_cancel_job(job_id):
+    """배치 작업을 취소합니다. 이미 처리한 결과는 유지됩니다."""
+    from ai_jobs import get_job_manager
+    
+    if get_job_manager().cancel(job_id):
+        return jsonify({"success": True, "job_id": job_id})
+    return jsonify({"success": False, "error": "진행 중인 해당 작업을 찾을 수 없습니다."}), 404
+
 @app.route('/api/models', methods=['GET'])
 def api_models():
     """사용 가능한 모델 목록을 반환합니다."""
     try:
         from ai_model import get_available_models
+        from ai_registry import get_registry
         models = get_available_models()
-        return jsonify({"models": models})
+        return jsonify({"models": models, "resident": get_registry().resident()})
     except Exception as e:
         logger.error(f"모델 목록 조회 중 오류: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/load_model', methods=['POST'])
 def api_load_model():
-    """지정된 모델을 로드합니다."""
+    """지정된 모델의 로드 작업을 백그라운드에서 시작하고 작업 ID를 반환합니다.
+    
+    로드가 끝나면 진행 중인 요청에 영향 없이 활성 모델이 교체됩니다.
+    진행 상황은 /api/load_model/<job_id> 또는 /api/status에서 확인할 수 있습니다.
+    """
     try:
-        from ai_model import load_model
+        from ai_loader import get_loader
+        from ai_model import check_draft_model, get_available_models
+        from ai_workers import get_worker_pool
+        
+        if get_worker_pool() is not None:
+            return jsonify({"error": "워커 모드에서는 실행 중에 모델을 바꿀 수 없습니다. --model 옵션으로 서버를 다시 시작해주세요."}), 409
         
         data = request.json
         model_name = data.get('model', 'deepseek-ai/DeepSeek-R1-Distill-Qwen-7B')
         use_4bit = data.get('use_4bit', False)
         use_1bit = data.get('use_1bit', True)
         use_cpu = data.get('use_cpu', True)
+        make_default = data.get('make_default', True)
+        draft_model = data.get('draft_model') or None
+        quantization = data.get('quantization') or None
         
-        # 모델 로드
-        result = load_model(model_name, use_4bit, use_1bit, use_cpu)
+        if draft_model and draft_model not in {m["id"] for m in get_available_models()}:
+            return jsonify({"error": f"알 수 없는 초안 모델입니다: {draft_model}"}), 400
+        try:
+            check_draft_model(model_name, draft_model, use_1bit, use_cpu, quantization)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        if result:
-            return jsonify({"success": True, "message": f"모델 '{model_name}'을 성공적으로 로드했습니다."})
-        else:
-            return jsonify({"success": False, "message": f"모델 '{model_name}' 로드에 실패했습니다."}), 500
+        job = get_loader().start(model_name, use_4bit, use_1bit, use_cpu, make_default, draft_model=draft_model,
+                                 quantization=quantization)
+        return jsonify({
+            "success": True,
+            "job_id": job.job_id,
+            "message": f"모델 '{model_name}' 로드를 시작했습니다.",
+            "job": job.to_dict()
+        }), 202
     
     except Exception as e:
         logger.error(f"모델 로드 중 오류: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/load_model/<job_id>', methods=['GET'])
+def api_load_model_status(job_id):
+    """모델 로드 작업의 진행 상황을 반환합니다."""
+    from ai_loader import get_loader
+    
+    job = get_loader().get(job_id)
+    if job is None:
+        return jsonify({"error": "해당 로드 작업을 찾을 수 없습니다."}), 404
+    return jsonify(job.to_dict())
+
 if __name__ == '__main__':
     import argparse
     
@@ -149,26 +774,153 @@ if __name__ == '__main__':
     parser.add_argument('--port', type=int, default=8080, help='서버 포트 (기본값: 8080)')
     parser.add_argument('--host', type=str, default='0.0.0.0', help='서버 호스트 (기본값: 0.0.0.0)')
     parser.add_argument('--model', type=str, default='deepseek-ai/DeepSeek-R1-Distill-Qwen-7B', help='사용할 모델')
+    parser.add_argument('--draft-model', type=str, default=None,
+                        help='추측 디코딩에 사용할 작은 초안 모델 (예: --gpu와 deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B, 주 모델과 토크나이저가 같아야 함)')
+    parser.add_argument('--quantization', type=str, default=None,
+                        help='GGUF 양자화 종류 (예: Q4_K_M, auto이면 호스트별로 측정해 가장 빠른 것을 선택)')
     parser.add_argument('--no-1bit', action='store_true', help='1bit 양자화 비활성화')
     parser.add_argument('--no-4bit', action='store_true', help='4bit 양자화 비활성화')
     parser.add_argument('--gpu', action='store_true', help='GPU 모드 사용 (기본값: CPU 모드)')
+    parser.add_argument('--max-queue', type=int, default=64, help='대기열 최대 요청 수 (기본값: 64)')
+    parser.add_argument('--max-batch', type=int, default=None, help='transformers 모델에서 한 배치에 묶을 최대 요청 수 (기본값: 8, 워커 모드에서는 1). llama.cpp 모델은 디코딩을 공유하지 않으므로 묶지 않음')
+    parser.add_argument('--batch-window', type=float, default=0.05, help='배치를 모으는 대기 시간(초) (기본값: 0.05)')
+    parser.add_argument('--max-wait', type=float, default=120.0, help='요청별 최대 대기 시간(초) (기본값: 120)')
+    parser.add_argument('--class-max-tokens', type=str, default=None,
+                        help='우선순위 클래스별 최대 생성 토큰 수 (예: interactive=512,analysis=1000,bulk=1000)')
+    parser.add_argument('--session-cache-mb', type=int, default=2048, help='세션 KV 캐시 메모리 한도(MB) (기본값: 2048)')
+    parser.add_argument('--model-memory-mb', type=int, default=16384, help='동시에 상주할 모델들의 메모리 한도(MB) (기본값: 16384)')
+    parser.add_argument('--response-cache-size', type=int, default=1000, help='응답 캐시 최대 항목 수 (기본값: 1000)')
+    parser.add_argument('--response-cache-ttl', type=float, default=6 * 60 * 60, help='응답 캐시 유효 시간(초) (기본값: 21600)')
+    parser.add_argument('--max-history-tokens', type=int, default=1024, help='채팅 프롬프트에 넣을 이전 대화의 최대 토큰 수 (기본값: 1024)')
+    parser.add_argument('--summary-tokens', type=int, default=256, help='오래된 대화 요약의 최대 토큰 수 (기본값: 256)')
+    parser.add_argument('--attendance-db', type=str, default=None,
+                        help='출결 데이터베이스 파일 경로 (기본값: ~/.attendance_ai/attendance.db, :memory:는 메모리에만 보관)')
+    parser.add_argument('--memory-limit-mb', type=int, default=0,
+                        help='프로세스(워커 모드에서는 워커마다) 상주 메모리 한도(MB). 넘으면 캐시를 비우고 모델 컨텍스트나 워커를 다시 시작 (기본값: 0, 측정만 함)')
+    parser.add_argument('--memory-check-interval', type=float, default=30.0, help='메모리 한도 확인 간격(초) (기본값: 30)')
+    parser.add_argument('--trace-memory', type=int, default=0,
+                        help='tracemalloc으로 Python 할당 위치를 추적할 스택 깊이 (기본값: 0, 끔. 켜면 할당이 느려짐)')
+    parser.add_argument('--job-hours', type=str, default=None, help='배치 작업을 실행할 시간대 (예: 22-7, 기본값: 항상)')
+    parser.add_argument('--workers', type=int, default=0, help='추론 워커 프로세스 수 (기본값: 0, 서버 프로세스에서 직접 추론)')
+    parser.add_argument('--threads-per-worker', type=int, default=0, help='워커당 CPU 스레드(코어) 수 (기본값: 0, 코어 수를 워커 수로 나눔)')
+    parser.add_argument('--production', action='store_true', help='개발 서버 대신 waitress WSGI 서버로 실행')
+    parser.add_argument('--http-threads', type=int, default=None, help='HTTP 요청 처리 스레드 수 (기본값: 대기열 크기 + 8)')
     
     args = parser.parse_args()
     
-    # 서버 시작 시 모델 미리 로드 (선택 사항)
+    use_4bit = not args.no_4bit and not args.no_1bit
+    use_1bit = not args.no_1bit
+    use_cpu = not args.gpu
+    
+    # 토크나이저가 다른 초안 모델은 두 모델을 받기 전에 거부
+    from ai_model import check_draft_model
     try:
-        from ai_model import load_model
-        
-        use_4bit = not args.no_4bit and not args.no_1bit
-        use_1bit = not args.no_1bit
-        use_cpu = not args.gpu
+        check_draft_model(args.model, args.draft_model, use_1bit, use_cpu, args.quantization)
+    except ValueError as e:
+        parser.error(str(e))
+    
+    # llama.cpp는 요청을 하나씩 처리하므로 워커 모드에서는 배치로 묶지 않고 여러 워커에 나눠 보냄
+    if args.max_batch is None:
+        args.max_batch = 1 if args.workers > 0 else 8
+    
+    from ai_model import timed_phase
+    
+    with timed_phase(STARTUP_PHASES, "configure"):
+        from ai_registry import configure_registry
+        configure_registry(max_bytes=args.model_memory_mb * 1024 * 1024)
+        from ai_scheduler import configure_scheduler, parse_class_max_tokens
+        from ai_session_cache import configure_session_cache
+        configure_session_cache(max_bytes=args.session_cache_mb * 1024 * 1024)
+        from ai_response_cache import configure_response_cache
+        configure_response_cache(max_entries=args.response_cache_size, ttl=args.response_cache_ttl)
+        from ai_context import configure_history_manager
+        configure_history_manager(max_history_tokens=args.max_history_tokens, summary_tokens=args.summary_tokens)
+        from ai_attendance import DEFAULT_DB_PATH, configure_attendance_store
+        configure_attendance_store(path=None if args.attendance_db == ':memory:' else args.attendance_db or DEFAULT_DB_PATH)
+        from ai_jobs import configure_job_manager, parse_run_hours
+        job_manager = configure_job_manager(run_hours=parse_run_hours(args.job_hours))
+        from ai_memory import configure_memory_guard
+        memory_guard = configure_memory_guard(limit_bytes=args.memory_limit_mb * 1024 * 1024 or None,
+                                              interval=args.memory_check_interval)
+        if args.trace_memory > 0:
+            memory_guard.start_tracing(args.trace_memory)
+    
+    # 워커 모드: 각 워커 프로세스가 자기 코어 집합에서 모델을 로드하고, 서버 프로세스는 요청 분배만 담당
+    pool = None
+    if args.workers > 0:
+        from ai_workers import configure_worker_pool, plan_core_sets
         
-        logger.info(f"서버 시작 시 모델 '{args.model}' 미리 로드 중...")
-        logger.info(f"CPU 모드: {use_cpu}, 1bit 양자화: {use_1bit}, 4bit 양자화: {use_4bit and not use_1bit}")
+        # 워커마다 따로 측정하면 서로 코어를 빼앗아 결과가 틀어지므로 서버 프로세스에서 워커 스레드 수로 한 번만 측정
+        quantization = args.quantization
+        if quantization == "auto":
+            from ai_calibration import calibrate
+            
+            with timed_phase(STARTUP_PHASES, "calibrate"):
+                try:
+                    threads = len(plan_core_sets(args.workers, args.threads_per_worker or None)[0])
+                    quantization = calibrate(args.model, threads=threads)["quantization"]
+                except Exception as e:
+                    logger.warning(f"양자화 자동 선택 실패, 기본 양자화를 사용합니다: {str(e)}")
+                    quantization = None
         
-        load_model(args.model, use_4bit, use_1bit, use_cpu)
-    except Exception as e:
-        logger.warning(f"사전 모델 로드 실패 (요청 시 로드됨): {str(e)}")
+        if not (use_cpu and use_1bit):
+            logger.warning("워커 모드는 CPU llama.cpp(GGUF) 백엔드용입니다. 다른 백엔드는 워커마다 가중치를 따로 올립니다.")
+        logger.info(f"추론 워커 {args.workers}개 시작, 모델 '{args.model}'")
+        with timed_phase(STARTUP_PHASES, "worker_pool"):
+            pool = configure_worker_pool(
+                args.workers,
+                args.threads_per_worker or None,
+                {"model_name_or_path": args.model, "use_4bit": use_4bit, "use_1bit": use_1bit, "use_cpu": use_cpu,
+                 "draft_model": args.draft_model, "quantization": quantization}
+            )
+    
+    with timed_phase(STARTUP_PHASES, "scheduler"):
+        configure_scheduler(
+            max_queue_size=args.max_queue,
+            max_batch_size=args.max_batch,
+            batch_window=args.batch_window,
+            max_wait=args.max_wait,
+            executor=pool,
+            class_max_tokens=parse_class_max_tokens(args.class_max_tokens)
+        )
+    
+    # 서버 시작 시 모델을 백그라운드에서 미리 로드 (로드 중에도 서버는 바로 요청을 받음)
+    if pool is None:
+        try:
+            from ai_loader import get_loader
+            
+            logger.info(f"서버 시작 시 모델 '{args.model}' 미리 로드 중...")
+            logger.info(f"CPU 모드: {use_cpu}, 1bit 양자화: {use_1bit}, 4bit 양자화: {use_4bit and not use_1bit}")
+            
+            if args.draft_model:
+                logger.info(f"추측 디코딩 초안 모델: {args.draft_model}")
+            
+            get_loader().start(args.model, use_4bit, use_1bit, use_cpu, draft_model=args.draft_model,
+                               quantization=args.quantization)
+        except Exception as e:
+            logger.warning(f"사전 모델 로드 실패 (요청 시 로드됨): {str(e)}")
+    
+    # 재시작 전에 끝나지 않은 배치 작업을 이어서 실행 (대화형 요청이 없을 때만 진행됨)
+    job_manager.resume()
+    
+    # 생성 요청이 대기열을 가득 채워도 정적 파일과 상태 요청을 처리할 스레드가 남도록 여유를 둠
+    http_threads = args.http_threads or args.max_queue + 8
+    
+    serve = None
+    if args.production:
+        try:
+            from waitress import serve
+        except ImportError:
+            logger.warning("waitress가 설치되지 않아 개발 서버로 실행합니다. 'pip install waitress'로 설치하세요.")
     
+    STARTUP_PHASES["until_serving"] = round(time.time() - SERVER_STARTED_AT, 3)
+    logger.info(f"서버 준비 완료: 시작 후 {STARTUP_PHASES['until_serving']:.2f}초 (모델은 백그라운드에서 로드 중)")
     print(f"통합 서버를 http://{args.host}:{args.port}/ 에서 실행합니다...")
-    app.run(host=args.host, port=args.port, debug=False) 
\ No newline at end of file
+    if serve is not None:
+        logger.info(f"waitress 프로덕션 서버로 실행합니다 (HTTP 스레드 {http_threads}개)")
+        # send_bytes=1: SSE 토큰을 버퍼에 모으지 않고 바로 전송
+        serve(app, host=args.host, port=args.port, threads=http_threads,
+              connection_limit=max(100, http_threads * 4), channel_timeout=args.max_wait + 60,
+              send_bytes=1, ident='attendance-ai')
+    else:
+        app.run(host=args.host, port=args.port, debug=False, threaded=True) 
\ No newline at end of file
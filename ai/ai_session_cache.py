@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# 세션 KV 캐시가 사용할 수 있는 기본 메모리 한도 (바이트)
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def common_prefix_length(a, b):
+    """두 토큰 시퀀스가 앞에서부터 일치하는 길이를 반환합니다."""
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+class SessionEntry:
+    """한 채팅 세션의 평가된 토큰과 모델 상태(KV 캐시)입니다."""
+
+    def __init__(self, session_id, tokens, state, nbytes):
+        self.session_id = session_id
+        self.tokens = list(tokens)
+        self.state = state
+        self.nbytes = nbytes
+        self.last_used = time.time()
+
+
+class SessionCache:
+    """세션 ID별 KV 상태를 메모리 한도 안에서 LRU 방식으로 보관하는 캐시입니다.
+
+    llama.cpp 백엔드는 save_state()로 만든 상태를, transformers 백엔드는 past_key_values를 저장합니다.
+    새 대화 턴에서는 저장된 토큰과 새 프롬프트의 공통 접두어만큼 평가를 건너뛸 수 있습니다.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._total_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._reused_tokens = 0
+
+    def take(self, session_id, tokens):
+        """세션 항목을 캐시에서 꺼내고 새 토큰과의 공통 접두어 길이를 함께 반환합니다.
+
+        꺼낸 항목은 생성 중에 변경될 수 있으므로 생성이 끝나면 put()으로 다시 넣어야 합니다.
+        """
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is None:
+                self._misses += 1
+                return None, 0
+            self._total_bytes -= entry.nbytes
+
+        prefix = common_prefix_length(entry.tokens, tokens)
+        with self._lock:
+            if prefix > 0:
+                self._hits += 1
+                self._reused_tokens += prefix
+            else:
+                self._misses += 1
+        return entry, prefix
+
+    def put(self, session_id, tokens, state, nbytes):
+        """세션 상태를 저장하고 메모리 한도를 넘으면 오래 사용하지 않은 세션부터 제거합니다."""
+        if nbytes > self.max_bytes:
+            logger.warning(f"세션 상태가 캐시 한도보다 커서 저장하지 않습니다: {nbytes} 바이트")
+            return
+
+        with self._lock:
+            old = self._entries.pop(session_id, None)
+            if old is not None:
+                self._total_bytes -= old.nbytes
+            self._entries[session_id] = SessionEntry(session_id, tokens, state, nbytes)
+            self._total_bytes += nbytes
+
+            while self._total_bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= evicted.nbytes
+                self._evictions += 1
+                logger.info(f"세션 KV 캐시 제거 (LRU): {evicted.session_id}")
+
+    def discard_prefix(self, prefix):
+        """키가 prefix로 시작하는 세션 상태를 모두 제거합니다. 모델이 해제될 때 그 모델의 상태를 버리는 데 사용합니다."""
+        with self._lock:
+            for session_id in [key for key in self._entries if key.startswith(prefix)]:
+                entry = self._entries.pop(session_id)
+                self._total_bytes -= entry.nbytes
+
+    def clear(self):
+        """모든 세션 상태를 제거합니다."""
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self):
+        """캐시 사용량과 적중 통계를 반환합니다."""
+        with self._lock:
+            return {
+                "sessions": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "reused_tokens": self._reused_tokens
+            }
+
+
+# 서버 전체에서 공유하는 세션 캐시 인스턴스
+_session_cache = None
+_session_cache_lock = threading.Lock()
+
+
+def configure_session_cache(**kwargs):
+    """공유 세션 캐시를 주어진 설정으로 (재)생성합니다."""
+    global _session_cache
+    with _session_cache_lock:
+        _session_cache = SessionCache(**kwargs)
+        return _session_cache
+
+
+def get_session_cache():
+    """공유 세션 캐시를 반환합니다. 아직 없으면 기본 설정으로 생성합니다."""
+    global _session_cache
+    with _session_cache_lock:
+        if _session_cache is None:
+            _session_cache = SessionCache()
+        return _session_cache
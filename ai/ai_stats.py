@@ -0,0 +1,217 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 출결 상태 코드 (기록이 없는 날은 NO_RECORD)
+NO_RECORD = -1
+PRESENT = 0
+LATE = 1
+ABSENT = 2
+STATUS_CODES = {"present": PRESENT, "late": LATE, "absent": ABSENT}
+
+WEEKDAY_NAMES = ["월", "화", "수", "목", "금", "토", "일"]
+
+# 월간 건수 배열(month_counts)의 항목 순서
+RECORDED = 0
+PRESENT_DAYS = 1
+LATE_DAYS = 2
+ABSENT_DAYS = 3
+COUNT_FIELDS = 4
+
+# 요약에 포함할 학생 목록의 최대 길이 (프롬프트 길이를 학급 크기와 무관하게 유지)
+DEFAULT_TOP_K = 5
+
+
+def build_status_matrix(students, attendance, class_id):
+    """학급의 출결 기록을 (날짜 × 학생) 상태 코드 행렬로 변환합니다.
+
+    반환값은 (dates, student_list, codes)이며, 해당 학급의 기록이 있는 날짜만 포함됩니다.
+    """
+    student_list = students.get(class_id, []) or []
+    column = {str(student.get("id")): index for index, student in enumerate(student_list)}
+
+    dates = sorted(date for date, day in attendance.items() if (day or {}).get(class_id))
+    codes = np.full((len(dates), len(student_list)), NO_RECORD, dtype=np.int8)
+
+    for row, date in enumerate(dates):
+        for student_id, record in attendance[date][class_id].items():
+            col = column.get(str(student_id))
+            if col is None:
+                continue
+            status = (record or {}).get("status", "present")
+            codes[row, col] = STATUS_CODES.get(status, NO_RECORD)
+
+    return np.array(dates, dtype="datetime64[D]"), student_list, codes
+
+
+def compute_class_stats(students, attendance, class_id):
+    """한 학급의 출결 통계를 벡터 연산으로 계산합니다.
+
+    출석률은 통계 탭과 같은 방식으로 (출석 일수 / 기록된 일수)로 계산합니다.
+    """
+    dates, student_list, codes = build_status_matrix(students, attendance, class_id)
+
+    # 학생별 월간 (기록, 출석, 지각, 결석) 일수
+    months, month_index = np.unique(dates.astype("datetime64[M]"), return_inverse=True)
+    month_counts = np.zeros((len(months), COUNT_FIELDS, len(student_list)), dtype=np.int64)
+    for field, mask in enumerate((codes != NO_RECORD, codes == PRESENT, codes == LATE, codes == ABSENT)):
+        np.add.at(month_counts[:, field], month_index, mask)
+
+    # 학생별 요일 (지각, 결석) 건수 (1970-01-01은 목요일이므로 +3 하면 월요일이 0)
+    weekdays = (dates.astype("int64") + 3) % 7
+    weekday_counts = np.zeros((7, 2, len(student_list)), dtype=np.int64)
+    np.add.at(weekday_counts[:, 0], weekdays, codes == LATE)
+    np.add.at(weekday_counts[:, 1], weekdays, codes == ABSENT)
+
+    return class_stats_from_counts(
+        class_id, student_list, len(dates),
+        str(dates[0]) if len(dates) else None,
+        str(dates[-1]) if len(dates) else None,
+        [str(month) for month in months], month_counts, weekday_counts
+    )
+
+
+def class_stats_from_counts(class_id, student_list, day_count, first_date, last_date, months,
+                            month_counts, weekday_counts):
+    """미리 집계한 건수로 학급 통계를 만듭니다.
+
+    month_counts는 (월 × COUNT_FIELDS × 학생) 배열로 학생별 월간 (기록, 출석, 지각, 결석) 일수이고,
+    weekday_counts는 (요일 × 2 × 학생) 배열로 학생별 요일 (지각, 결석) 건수입니다.
+    원본 기록 대신 건수만 있으면 되므로 기록 기간과 무관한 비용으로 계산됩니다.
+    """
+    recorded_days, present_days, late_days, absent_days = month_counts.sum(axis=0)
+    rates = np.divide(present_days * 100.0, recorded_days,
+                      out=np.zeros(len(student_list)), where=recorded_days > 0)
+
+    student_stats = [
+        {
+            "id": student.get("id"),
+            "name": student.get("name", str(student.get("id"))),
+            "recorded_days": int(recorded_days[i]),
+            "present": int(present_days[i]),
+            "late": int(late_days[i]),
+            "absent": int(absent_days[i]),
+            "attendance_rate": round(float(rates[i]), 1)
+        }
+        for i, student in enumerate(student_list)
+    ]
+
+    weekday_late, weekday_absent = weekday_counts.sum(axis=2).T
+
+    # 월별 출석률
+    month_recorded = month_counts[:, RECORDED]
+    month_present = month_counts[:, PRESENT_DAYS]
+    monthly_total = month_recorded.sum(axis=1)
+    monthly_rate = np.divide(month_present.sum(axis=1) * 100.0, monthly_total,
+                             out=np.zeros(len(months)), where=monthly_total > 0)
+
+    # 최근 두 달 사이 학생별 출석률 변화
+    changes = []
+    if len(months) >= 2:
+        prev_rate = np.divide(month_present[-2] * 100.0, month_recorded[-2],
+                              out=np.full(len(student_list), np.nan), where=month_recorded[-2] > 0)
+        last_rate = np.divide(month_present[-1] * 100.0, month_recorded[-1],
+                              out=np.full(len(student_list), np.nan), where=month_recorded[-1] > 0)
+        delta = last_rate - prev_rate
+        for i in np.flatnonzero(~np.isnan(delta)):
+            changes.append({
+                "name": student_stats[i]["name"],
+                "previous_rate": round(float(prev_rate[i]), 1),
+                "current_rate": round(float(last_rate[i]), 1),
+                "change": round(float(delta[i]), 1)
+            })
+
+    total_recorded = int(recorded_days.sum())
+    return {
+        "class_id": class_id,
+        "student_count": len(student_list),
+        "day_count": day_count,
+        "first_date": first_date,
+        "last_date": last_date,
+        "attendance_rate": round(float(present_days.sum() * 100.0 / total_recorded), 1) if total_recorded else 0.0,
+        "late_count": int(late_days.sum()),
+        "absent_count": int(absent_days.sum()),
+        "students": student_stats,
+        "weekday": {
+            WEEKDAY_NAMES[day]: {"late": int(weekday_late[day]), "absent": int(weekday_absent[day])}
+            for day in range(7)
+        },
+        "monthly": [
+            {"month": month, "attendance_rate": round(float(rate), 1)}
+            for month, rate in zip(months, monthly_rate)
+        ],
+        "changes": changes,
+        "change_period": [months[-2], months[-1]] if len(months) >= 2 else None
+    }
+
+
+def summarize_class_stats(stats, top_k=DEFAULT_TOP_K):
+    """학급 통계를 모델 프롬프트에 넣을 짧은 텍스트로 요약합니다.
+
+    학생 목록은 top_k명으로 제한하므로 기록 기간이나 학생 수가 늘어나도 요약 길이는 거의 일정합니다.
+    """
+    if stats["day_count"] == 0:
+        return f"학급 {stats['class_id']}: 학생 {stats['student_count']}명, 출결 기록 없음"
+
+    lines = [
+        f"학급 {stats['class_id']}: 학생 {stats['student_count']}명, 기록 {stats['day_count']}일 "
+        f"({stats['first_date']} ~ {stats['last_date']})",
+        f"전체 출석률 {stats['attendance_rate']}%, 지각 {stats['late_count']}건, 결석 {stats['absent_count']}건"
+    ]
+
+    weekday = ", ".join(
+        f"{day} {counts['late']}/{counts['absent']}"
+        for day, counts in stats["weekday"].items()
+        if counts["late"] or counts["absent"]
+    )
+    if weekday:
+        lines.append(f"요일별 지각/결석: {weekday}")
+
+    recorded_students = [s for s in stats["students"] if s["recorded_days"] > 0]
+    lowest = sorted(recorded_students, key=lambda s: s["attendance_rate"])[:top_k]
+    if lowest:
+        lines.append("출석률 하위: " + ", ".join(
+            f"{s['name']} {s['attendance_rate']}% (지각 {s['late']}, 결석 {s['absent']})" for s in lowest))
+
+    most_absent = [s for s in sorted(recorded_students, key=lambda s: -s["absent"]) if s["absent"] > 0][:top_k]
+    if most_absent:
+        lines.append("결석 많은 학생: " + ", ".join(f"{s['name']} {s['absent']}일" for s in most_absent))
+
+    most_late = [s for s in sorted(recorded_students, key=lambda s: -s["late"]) if s["late"] > 0][:top_k]
+    if most_late:
+        lines.append("지각 잦은 학생: " + ", ".join(f"{s['name']} {s['late']}회" for s in most_late))
+
+    if stats["monthly"]:
+        lines.append("월별 출석률: " + ", ".join(
+            f"{m['month']} {m['attendance_rate']}%" for m in stats["monthly"][-6:]))
+
+    if stats["changes"]:
+        start, end = stats["change_period"]
+        changes = sorted(stats["changes"], key=lambda c: c["change"])
+        worsened = [c for c in changes if c["change"] < 0][:top_k]
+        improved = [c for c in reversed(changes) if c["change"] > 0][:top_k]
+        if improved:
+            lines.append(f"개선 ({start} → {end}): " + ", ".join(
+                f"{c['name']} {c['change']:+}%p" for c in improved))
+        if worsened:
+            lines.append(f"악화 ({start} → {end}): " + ", ".join(
+                f"{c['name']} {c['change']:+}%p" for c in worsened))
+
+    return "\n".join(lines)
+
+
+def summarize_attendance(students, attendance, class_ids=None, top_k=DEFAULT_TOP_K):
+    """하나 이상의 학급에 대한 통계와 요약 텍스트를 반환합니다.
+
+    class_ids를 지정하지 않으면 학생이 등록된 모든 학급을 요약합니다.
+    """
+    students = students or {}
+    attendance = attendance or {}
+    if class_ids is None:
+        class_ids = [class_id for class_id, student_list in students.items() if student_list]
+
+    all_stats = [compute_class_stats(students, attendance, str(class_id)) for class_id in class_ids]
+    summary = "\n\n".join(summarize_class_stats(stats, top_k) for stats in all_stats)
+    return all_stats, summary
@@ -0,0 +1,259 @@
+import json
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+MAX_SCHEMA_BYTES = 16 * 1024  # 요청으로 받을 수 있는 JSON 스키마의 최대 크기
+GRAMMAR_CACHE_SIZE = 32       # 컴파일해 둘 llama.cpp 문법 수
+
+# 웹 화면의 정형 분석에서 이름으로 요청하는 스키마
+SCHEMAS = {
+    "at_risk_students": {
+        "type": "object",
+        "properties": {
+            "students": {
+                "type": "array",
+                "maxItems": 10,
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "name": {"type": "string", "maxLength": 40},
+                        "absent": {"type": "integer"},
+                        "late": {"type": "integer"},
+                        "attendance_rate": {"type": "number"},
+                        "risk": {"type": "string", "enum": ["높음", "보통", "낮음"]},
+                        "reason": {"type": "string", "maxLength": 200}
+                    },
+                    "required": ["name", "absent", "late", "attendance_rate", "risk", "reason"]
+                }
+            },
+            "summary": {"type": "string", "maxLength": 400}
+        },
+        "required": ["students", "summary"]
+    },
+    "weekday_patterns": {
+        "type": "object",
+        "properties": {
+            "weekdays": {
+                "type": "array",
+                "maxItems": 7,
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "day": {"type": "string", "enum": ["월", "화", "수", "목", "금", "토", "일"]},
+                        "late": {"type": "integer"},
+                        "absent": {"type": "integer"},
+                        "note": {"type": "string", "maxLength": 200}
+                    },
+                    "required": ["day", "late", "absent", "note"]
+                }
+            },
+            "patterns": {"type": "array", "maxItems": 5, "items": {"type": "string", "maxLength": 200}},
+            "summary": {"type": "string", "maxLength": 400}
+        },
+        "required": ["weekdays", "patterns", "summary"]
+    }
+}
+
+
+class SchemaError(ValueError):
+    """요청한 JSON 스키마를 사용할 수 없을 때 발생합니다."""
+
+
+class StructuredOutputError(ValueError):
+    """생성된 응답이 스키마를 따르는 JSON이 아닐 때 발생합니다."""
+
+
+def resolve_schema(schema):
+    """요청의 schema 값(스키마 이름 또는 JSON 스키마 객체)을 검사해 스키마 객체를 반환합니다. 없으면 None입니다.
+
+    응답이 끝났는지 판단할 수 있도록 최상위 타입은 object나 array여야 합니다.
+    """
+    if not schema:
+        return None
+    if isinstance(schema, str):
+        if schema not in SCHEMAS:
+            raise SchemaError(f"알 수 없는 스키마 이름입니다: {schema} (사용 가능: {', '.join(SCHEMAS)})")
+        return SCHEMAS[schema]
+    if not isinstance(schema, dict):
+        raise SchemaError("schema는 스키마 이름이나 JSON 스키마 객체여야 합니다.")
+    if len(schema_key(schema)) > MAX_SCHEMA_BYTES:
+        raise SchemaError(f"JSON 스키마가 {MAX_SCHEMA_BYTES // 1024}KB를 넘습니다.")
+    if schema.get("type") not in ("object", "array"):
+        raise SchemaError("JSON 스키마의 최상위 type은 object 또는 array여야 합니다.")
+    return schema
+
+
+def schema_key(schema):
+    """스키마를 배치/캐시 키로 쓸 수 있는 정규화된 문자열로 만듭니다."""
+    if schema is None:
+        return None
+    return json.dumps(schema, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+
+def structured_prompt(prompt, schema):
+    """프롬프트 끝에 스키마를 따르는 JSON으로만 답하라는 지시를 붙입니다."""
+    return (
+        f"{prompt}\n\n"
+        f"다음 JSON 스키마를 따르는 JSON 하나로만 답하세요. 설명이나 다른 텍스트는 쓰지 마세요.\n"
+        f"{json.dumps(schema, ensure_ascii=False)}"
+    )
+
+
+class JsonScanner:
+    """생성되는 텍스트를 받아 첫 JSON 객체(또는 배열)가 닫혔는지 판단합니다.
+
+    첫 '{' 또는 '[' 앞의 텍스트는 무시하고, 문자열 안의 괄호와 이스케이프는 건너뜁니다.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.complete = False
+        self.in_string = False
+        self.escape = False
+
+    def feed(self, text):
+        """텍스트 조각을 이어서 읽고, JSON 값이 닫혔으면 True를 반환합니다."""
+        for char in text:
+            if self.complete:
+                break
+            if not self.started:
+                if char in "{[":
+                    self.started = True
+                    self.depth = 1
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                self.complete = self.depth == 0
+        return self.complete
+
+
+class JsonCompletionCriteria:
+    """배치의 모든 시퀀스에서 JSON 값이 닫히면 transformers 디코딩을 멈춥니다.
+
+    스키마가 끝난 뒤에도 max_new_tokens까지 이어서 생성하지 않도록 하며,
+    매 스텝 지난번 이후 새로 붙은 토큰만 디코딩해 읽으므로 응답 길이에 비례하는 비용만 듭니다.
+    추측 디코딩은 한 스텝에 여러 토큰을 받아들이므로 마지막 토큰 하나가 아니라 새 토큰 전체를 읽습니다.
+    """
+
+    def __init__(self, tokenizer, prompt_length, batch_size=1):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.seen = prompt_length
+        self.scanners = [JsonScanner() for _ in range(batch_size)]
+
+    def __call__(self, input_ids, scores, **kwargs):
+        length = input_ids.shape[1]
+        if length <= self.seen:
+            return False
+        for scanner, tokens in zip(self.scanners, input_ids[:, self.seen:].tolist()):
+            if not scanner.complete:
+                scanner.feed(self.tokenizer.decode(tokens, skip_special_tokens=True))
+        self.seen = length
+        return all(scanner.complete for scanner in self.scanners)
+
+
+_grammars = OrderedDict()
+_grammars_lock = threading.Lock()
+
+
+def llama_grammar(schema):
+    """스키마를 llama.cpp 문법(GBNF)으로 변환합니다. 컴파일한 문법은 스키마별로 재사용합니다.
+
+    문법이 스키마를 다 채운 뒤에는 종료 토큰만 허용하므로 객체가 닫히면 생성이 바로 끝납니다.
+    """
+    from llama_cpp import LlamaGrammar
+
+    key = schema_key(schema)
+    with _grammars_lock:
+        grammar = _grammars.get(key)
+        if grammar is not None:
+            _grammars.move_to_end(key)
+            return grammar
+
+    grammar = LlamaGrammar.from_json_schema(json.dumps(schema, ensure_ascii=False), verbose=False)
+    with _grammars_lock:
+        _grammars[key] = grammar
+        while len(_grammars) > GRAMMAR_CACHE_SIZE:
+            _grammars.popitem(last=False)
+    return grammar
+
+
+_tokenizer_data = weakref.WeakKeyDictionary()
+_tokenizer_data_lock = threading.Lock()
+
+
+def transformers_constraint(tokenizer, schema):
+    """transformers generate()에 넘길 prefix_allowed_tokens_fn을 반환합니다.
+
+    lm-format-enforcer가 설치되어 있지 않으면 None을 반환하며, 이때는 JsonCompletionCriteria로
+    JSON이 닫히는 시점에 멈추고 결과를 parse_structured로 검사하는 것만 가능합니다.
+    """
+    try:
+        from lmformatenforcer import JsonSchemaParser
+        from lmformatenforcer.integrations.transformers import (build_token_enforcer_tokenizer_data,
+                                                                build_transformers_prefix_allowed_tokens_fn)
+    except ImportError:
+        logger.warning("lm-format-enforcer가 설치되지 않아 스키마 제약 없이 생성합니다. "
+                       "'pip install lm-format-enforcer'로 설치하세요.")
+        return None
+
+    # 토크나이저 어휘 분석은 오래 걸리므로 토크나이저마다 한 번만 수행
+    with _tokenizer_data_lock:
+        tokenizer_data = _tokenizer_data.get(tokenizer)
+        if tokenizer_data is None:
+            tokenizer_data = build_token_enforcer_tokenizer_data(tokenizer)
+            _tokenizer_data[tokenizer] = tokenizer_data
+    return build_transformers_prefix_allowed_tokens_fn(tokenizer_data, JsonSchemaParser(schema))
+
+
+def parse_structured(text, schema):
+    """응답에서 첫 JSON 값을 꺼내 파싱하고, jsonschema가 설치되어 있으면 스키마로 검증해 반환합니다.
+
+    JSON이 없거나 닫히지 않았거나 스키마에 맞지 않으면 StructuredOutputError를 발생시킵니다.
+    """
+    scanner = JsonScanner()
+    for end, char in enumerate(text):
+        if scanner.feed(char):
+            break
+    if not scanner.complete:
+        raise StructuredOutputError("응답에서 완성된 JSON을 찾을 수 없습니다.")
+    start = min(index for index in (text.find("{"), text.find("[")) if index >= 0)
+    try:
+        result = json.loads(text[start:end + 1])
+    except ValueError as e:
+        raise StructuredOutputError(f"응답의 JSON을 해석할 수 없습니다: {str(e)}")
+
+    try:
+        import jsonschema
+    except ImportError:
+        return result
+    try:
+        jsonschema.validate(result, schema)
+    except jsonschema.ValidationError as e:
+        raise StructuredOutputError(f"응답이 스키마와 맞지 않습니다: {e.message}")
+    return result
+
+
+def structured_result(response, schema):
+    """정형 출력 응답을 파싱해 응답 본문에 넣을 필드를 반환합니다. 파싱에 실패하면 result는 None입니다."""
+    try:
+        return {"result": parse_structured(response, schema)}
+    except StructuredOutputError as e:
+        logger.warning(f"정형 출력 파싱 실패: {str(e)}")
+        return {"result": None, "result_error": str(e)}
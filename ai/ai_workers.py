@@ -0,0 +1,472 @@
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from ai_scheduler import RequestCancelledError, SchedulerError
+
+logger = logging.getLogger(__name__)
+
+# 워커 하나에 동시에 맡길 수 있는 최대 작업 수 (실행 중 1개 + 바로 이어서 실행할 1개)
+MAX_INFLIGHT_PER_WORKER = 2
+# 세션을 마지막으로 처리한 워커를 기억하는 최대 세션 수
+MAX_SESSION_ROUTES = 10000
+# 결과가 계속 들어와도 이 간격(초)마다 워커 프로세스가 살아 있는지 확인
+WORKER_CHECK_INTERVAL = 1.0
+
+
+def available_cores():
+    """현재 프로세스가 사용할 수 있는 CPU 코어 번호 목록을 반환합니다."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_core_sets(workers, threads_per_worker=None):
+    """워커마다 겹치지 않는 코어 집합을 나눠 줍니다.
+
+    threads_per_worker를 지정하지 않으면 사용 가능한 코어를 워커 수로 나눕니다.
+    코어가 모자라면 앞쪽 코어부터 다시 배정하고 경고를 남깁니다.
+    """
+    cores = available_cores()
+    if not threads_per_worker:
+        threads_per_worker = max(1, len(cores) // workers)
+    if workers * threads_per_worker > len(cores):
+        logger.warning(f"워커 {workers}개 × 스레드 {threads_per_worker}개가 사용 가능한 코어 수({len(cores)})보다 많습니다. "
+                       "일부 코어를 여러 워커가 나눠 씁니다.")
+    return [
+        [cores[(index * threads_per_worker + offset) % len(cores)] for offset in range(threads_per_worker)]
+        for index in range(workers)
+    ]
+
+
+def _worker_main(index, cores, model_options, task_queue, cancel_queue, result_queue):
+    """워커 프로세스의 진입점입니다. 지정된 코어에 고정한 뒤 모델을 로드하고 작업을 처리합니다."""
+    threads = len(cores)
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    # torch/OpenMP가 불러와지기 전에 스레드 수를 맞춰 코어 집합 밖으로 스레드가 넘치지 않게 함
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+
+    import ai_model
+
+    try:
+        ai_model.set_thread_count(threads)
+        handle = ai_model.create_model(**model_options)
+        ai_model.swap_model(handle)
+        result_queue.put(("ready", index, handle.to_dict()))
+    except Exception as e:
+        result_queue.put(("failed", index, str(e)))
+        return
+
+    cancelled = set()
+
+    def drain_cancels():
+        while True:
+            try:
+                cancelled.add(cancel_queue.get_nowait())
+            except queue.Empty:
+                return
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        kind, task_id, params = task
+        drain_cancels()
+        if task_id in cancelled:
+            cancelled.discard(task_id)
+            _put_error(result_queue, task_id, RequestCancelledError("요청이 취소되었습니다."))
+            continue
+
+        stats = {}
+        try:
+            if kind == "stream":
+                cancel_event = threading.Event()
+                for chunk in ai_model.generate_stream(cancel_event=cancel_event, stats=stats, **params):
+                    result_queue.put(("chunk", task_id, chunk))
+                    drain_cancels()
+                    if task_id in cancelled:
+                        cancelled.discard(task_id)
+                        cancel_event.set()
+                        break
+                result_queue.put(("done", task_id, (None, stats)))
+            elif params.get("session_id"):
+                response = ai_model.generate_session(params["prompts"][0], params["max_length"], params["temperature"],
+                                                     params["session_id"], params["model_name"], stats,
+                                                     params["schema"])
+                result_queue.put(("done", task_id, ([response], stats)))
+            else:
+                responses = ai_model.generate_batch(params["prompts"], params["max_length"], params["temperature"],
+                                                    params["model_name"], stats, params["schema"])
+                result_queue.put(("done", task_id, (responses, stats)))
+        except Exception as e:
+            _put_error(result_queue, task_id, e)
+
+
+def _put_error(result_queue, task_id, error):
+    """오류를 부모 프로세스로 보냅니다. 피클할 수 없는 예외는 메시지만 담은 RuntimeError로 바꿉니다."""
+    try:
+        pickle.dumps(error)
+    except Exception:
+        error = RuntimeError(str(error))
+    result_queue.put(("error", task_id, error))
+
+
+class WorkerProcess:
+    """워커 프로세스 하나와 그 프로세스에 맡긴 작업 상태입니다."""
+
+    def __init__(self, index, cores):
+        self.index = index
+        self.cores = cores
+        self.process = None
+        self.task_queue = None
+        self.cancel_queue = None
+        self.state = "starting"
+        self.error = None
+        self.model = None
+        self.inflight = 0
+        self.completed = 0
+        self.restarts = 0
+        self.recycles = 0
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def to_dict(self):
+        from ai_memory import read_rss
+
+        pid = self.process.pid if self.process else None
+        return {
+            "index": self.index,
+            "pid": pid,
+            "cores": self.cores,
+            "state": self.state,
+            "error": self.error,
+            "model": self.model,
+            "inflight": self.inflight,
+            "completed": self.completed,
+            "restarts": self.restarts,
+            "recycles": self.recycles,
+            "memory": read_rss(pid) if pid else None
+        }
+
+
+class WorkerTask:
+    """워커에 보낸 요청 묶음입니다. 결과가 돌아오면 요청들의 future와 스트림에 전달합니다."""
+
+    def __init__(self, worker, batch, on_done):
+        self.task_id = uuid.uuid4().hex
+        self.worker = worker
+        self.batch = batch
+        self.on_done = on_done
+
+
+class WorkerPool:
+    """CPU 추론용 워커 프로세스 풀입니다.
+
+    각 워커는 서로 다른 코어 집합에 고정되어 자체 모델을 로드합니다. llama.cpp는 GGUF 파일을 mmap으로
+    읽으므로 가중치는 운영체제 페이지 캐시를 통해 모든 워커가 공유합니다. 스케줄러가 꺼낸 배치는
+    진행 중인 작업이 가장 적은 워커로 전달되며, 같은 세션의 요청은 가능하면 이전 워커로 보내
+    그 워커의 세션 KV 캐시를 재사용합니다.
+    """
+
+    def __init__(self, workers, threads_per_worker=None, model_options=None):
+        self.model_options = model_options or {}
+        self._context = multiprocessing.get_context("spawn")
+        self._workers = [WorkerProcess(index, cores)
+                         for index, cores in enumerate(plan_core_sets(workers, threads_per_worker))]
+        self._result_queue = self._context.Queue()
+        self._tasks = {}
+        self._request_tasks = {}
+        self._session_routes = OrderedDict()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    @property
+    def size(self):
+        return len(self._workers)
+
+    def start(self):
+        """워커 프로세스들과 결과 수신 스레드를 시작합니다."""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        for worker in self._workers:
+            self._spawn(worker)
+        self._thread = threading.Thread(target=self._collect, name="worker-pool", daemon=True)
+        self._thread.start()
+        logger.info(f"워커 풀 시작: {self.size}개 프로세스, 코어 배정 {[worker.cores for worker in self._workers]}")
+
+    def stop(self):
+        """워커 프로세스를 종료하고 처리 중인 요청을 실패 처리합니다."""
+        with self._condition:
+            self._running = False
+            tasks = list(self._tasks.values())
+            self._tasks.clear()
+            self._request_tasks.clear()
+            self._condition.notify_all()
+        for task in tasks:
+            self._finish(task, error=SchedulerError("서버가 종료 중입니다."))
+        for worker in self._workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.task_queue.put(None)
+        for worker in self._workers:
+            if worker.process is not None:
+                worker.process.join(timeout=5)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+
+    def check_available(self):
+        """준비된 워커가 없으면 ModelLoadingError를 발생시킵니다."""
+        from ai_loader import ModelLoadingError
+
+        with self._condition:
+            if any(worker.ready for worker in self._workers):
+                return
+            failed = [worker.error for worker in self._workers if worker.state == "failed"]
+        if failed and len(failed) == self.size:
+            raise SchedulerError(f"모든 워커의 모델 로드가 실패했습니다: {failed[0]}", 30)
+        raise ModelLoadingError("워커가 모델을 불러오는 중입니다. 잠시 후 다시 시도해주세요.", 5)
+
+    def wait_for_capacity(self, timeout=None):
+        """작업을 더 받을 수 있는 워커가 생길 때까지 기다립니다. 시간 안에 생기면 True를 반환합니다."""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._pick_worker() is not None or not self._running, timeout)
+
+    def submit(self, batch, on_done):
+        """배치를 워커에 보냅니다. 처리가 끝나면 on_done(batch)를 결과 수신 스레드에서 호출합니다."""
+        first = batch[0]
+        if first.stream:
+            kind = "stream"
+            params = {"prompt": first.prompt, "max_length": first.max_length, "temperature": first.temperature,
+                      "session_id": first.session_id, "model_name": first.model_name, "schema": first.schema}
+        else:
+            kind = "generate"
+            params = {"prompts": [req.prompt for req in batch], "max_length": first.max_length,
+                      "temperature": first.temperature, "session_id": first.session_id,
+                      "model_name": first.model_name, "schema": first.schema}
+
+        with self._condition:
+            worker = self._pick_worker(first.session_id)
+            if worker is None:
+                worker = min((w for w in self._workers if w.ready), key=lambda w: w.inflight, default=None)
+            if worker is None:
+                error = SchedulerError("요청을 처리할 수 있는 워커가 없습니다.", 5)
+                task = WorkerTask(None, batch, on_done)
+            else:
+                error = None
+                task = WorkerTask(worker, batch, on_done)
+                worker.inflight += 1
+                self._tasks[task.task_id] = task
+                for req in batch:
+                    self._request_tasks[req.request_id] = task
+                if first.session_id:
+                    self._session_routes[first.session_id] = worker.index
+                    self._session_routes.move_to_end(first.session_id)
+                    while len(self._session_routes) > MAX_SESSION_ROUTES:
+                        self._session_routes.popitem(last=False)
+                worker.task_queue.put((kind, task.task_id, params))
+
+        if error is not None:
+            self._finish(task, error=error)
+
+    def cancel(self, request_id):
+        """워커에서 실행 중이거나 대기 중인 요청의 취소를 워커에 알립니다."""
+        with self._condition:
+            task = self._request_tasks.get(request_id)
+            if task is None:
+                return False
+            task.worker.cancel_queue.put(task.task_id)
+        return True
+
+    def recycle(self, index):
+        """워커를 새 작업 배정에서 빼고, 진행 중인 작업이 끝나면 프로세스를 다시 시작합니다.
+
+        메모리 가드가 메모리 한도를 넘은 워커를 새 프로세스로 바꿀 때 사용하며, 준비된 워커가 아니면 False를 반환합니다.
+        """
+        with self._condition:
+            worker = self._workers[index]
+            if worker.state != "ready":
+                return False
+            worker.state = "recycling"
+        self._restart_if_recycling(worker)
+        return True
+
+    def stats(self):
+        """워커별 상태를 반환합니다."""
+        with self._condition:
+            return {
+                "workers": [worker.to_dict() for worker in self._workers],
+                "ready": sum(worker.ready for worker in self._workers),
+                "inflight": sum(worker.inflight for worker in self._workers)
+            }
+
+    def _spawn(self, worker):
+        worker.task_queue = self._context.Queue()
+        worker.cancel_queue = self._context.Queue()
+        worker.state = "starting"
+        worker.process = self._context.Process(
+            target=_worker_main,
+            args=(worker.index, worker.cores, self.model_options, worker.task_queue, worker.cancel_queue,
+                  self._result_queue),
+            name=f"inference-worker-{worker.index}",
+            daemon=True
+        )
+        worker.process.start()
+
+    def _pick_worker(self, session_id=None):
+        """작업을 맡길 워커를 고릅니다. 세션을 처리했던 워커가 여유가 있으면 우선하고, 아니면 진행 중인
+        작업이 가장 적은 워커를 고릅니다. 여유 있는 워커가 없으면 None을 반환합니다. _condition을 잡은 상태에서 호출합니다.
+        """
+        candidates = [worker for worker in self._workers if worker.ready and worker.inflight < MAX_INFLIGHT_PER_WORKER]
+        if not candidates:
+            return None
+        if session_id in self._session_routes:
+            previous = self._workers[self._session_routes[session_id]]
+            if previous in candidates:
+                return previous
+        return min(candidates, key=lambda worker: worker.inflight)
+
+    def _finish(self, task, responses=None, error=None, stats=None):
+        """작업 결과와 생성 지표를 요청들에 전달하고 완료 콜백을 호출합니다."""
+        finished_at = time.time()
+        for index, req in enumerate(task.batch):
+            req.finished_at = finished_at
+            req.generation = stats
+            if error is not None:
+                req.fail(error)
+                continue
+            if not req.future.done():
+                req.future.set_result(responses[index] if responses is not None else None)
+            if req.stream:
+                req.chunks.put(None)
+        task.on_done(task.batch)
+
+    def _collect(self):
+        """워커들이 보낸 결과를 받아 요청에 전달하고, 비정상 종료한 워커를 다시 시작합니다."""
+        next_check = time.time() + WORKER_CHECK_INTERVAL
+        while self._running:
+            now = time.time()
+            if now >= next_check:
+                self._check_workers()
+                next_check = now + WORKER_CHECK_INTERVAL
+            try:
+                message = self._result_queue.get(timeout=max(0.0, next_check - now))
+            except queue.Empty:
+                continue
+
+            kind, key, payload = message
+            if kind in ("ready", "failed"):
+                with self._condition:
+                    worker = self._workers[key]
+                    worker.state = kind
+                    if kind == "ready":
+                        worker.model = payload
+                        worker.error = None
+                        logger.info(f"워커 {key} 준비 완료 (코어 {worker.cores})")
+                    else:
+                        worker.error = payload
+                        logger.error(f"워커 {key} 모델 로드 실패: {payload}")
+                    self._condition.notify_all()
+                continue
+
+            with self._condition:
+                task = self._tasks.get(key)
+            if task is None:
+                continue
+
+            if kind == "chunk":
+                req = task.batch[0]
+                if req.first_token_at is None:
+                    req.first_token_at = time.time()
+                req.chunks.put(payload)
+                continue
+
+            with self._condition:
+                self._tasks.pop(key, None)
+                for req in task.batch:
+                    self._request_tasks.pop(req.request_id, None)
+                task.worker.inflight -= 1
+                task.worker.completed += 1
+                self._condition.notify_all()
+            if kind == "done":
+                responses, stats = payload
+                self._finish(task, responses=responses, stats=stats)
+            else:
+                self._finish(task, error=payload)
+            self._restart_if_recycling(task.worker)
+
+    def _restart_if_recycling(self, worker):
+        """재시작을 기다리는 워커의 작업이 모두 끝났으면 별도 스레드에서 프로세스를 정상 종료하고 새로 시작합니다.
+
+        프로세스 종료를 기다리는 동안에도 결과 수신 스레드가 다른 워커의 결과를 계속 전달하도록 따로 실행합니다.
+        """
+        with self._condition:
+            if worker.state != "recycling" or worker.inflight > 0:
+                return
+            worker.state = "stopping"
+            process, task_queue = worker.process, worker.task_queue
+        threading.Thread(target=self._respawn, args=(worker, process, task_queue),
+                         name=f"worker-recycle-{worker.index}", daemon=True).start()
+
+    def _respawn(self, worker, process, task_queue):
+        """재시작 스레드에서 이전 워커 프로세스가 끝나기를 기다렸다가 새 프로세스를 시작합니다."""
+        logger.info(f"워커 {worker.index} 재시작 (메모리 회수, pid {process.pid})")
+        task_queue.put(None)
+        process.join(timeout=10)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+        with self._condition:
+            worker.recycles += 1
+            if self._running:
+                self._spawn(worker)
+
+    def _check_workers(self):
+        """종료된 워커의 작업을 실패 처리하고 워커를 다시 시작합니다."""
+        for worker in self._workers:
+            if worker.process is None or worker.process.is_alive() or worker.state in ("failed", "stopping"):
+                continue
+            logger.error(f"워커 {worker.index}가 비정상 종료되었습니다 (종료 코드 {worker.process.exitcode}). 다시 시작합니다.")
+            with self._condition:
+                lost = [task for task in self._tasks.values() if task.worker is worker]
+                for task in lost:
+                    self._tasks.pop(task.task_id, None)
+                    for req in task.batch:
+                        self._request_tasks.pop(req.request_id, None)
+                worker.inflight = 0
+                worker.restarts += 1
+                self._spawn(worker)
+            for task in lost:
+                self._finish(task, error=SchedulerError("워커 프로세스가 종료되어 요청을 처리하지 못했습니다.", 5))
+
+
+# 서버 전체에서 공유하는 워커 풀 (워커 모드가 아니면 None)
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure_worker_pool(workers, threads_per_worker=None, model_options=None):
+    """워커 풀을 만들고 시작합니다. 스케줄러를 구성하기 전에 호출해야 합니다."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.stop()
+        _pool = WorkerPool(workers, threads_per_worker, model_options)
+        _pool.start()
+        return _pool
+
+
+def get_worker_pool():
+    """워커 풀을 반환합니다. 워커 모드가 아니면 None을 반환합니다."""
+    with _pool_lock:
+        return _pool
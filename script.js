@@ -1105,6 +1105,7 @@ async function fetchAIResponse(message, context) {
         const attendanceData = {
             studentData: studentData || {},
             attendanceHistory: attendanceHistory || {},
+            currentClass: currentClass,
             currentDate: new Date().toISOString().split('T')[0]
         };
         
@@ -1951,18 +1952,16 @@ function runAnalysis(analysisType) {
             prompt = '현재 학급의 출결 데이터를 분석하여 중요한 인사이트를 제공해주세요.';
     }
     
+    // 표로 보여줄 분석은 JSON 스키마로 요청하여 서버가 객체가 닫히는 즉시 생성을 멈추게 함
+    const schema = ANALYSIS_SCHEMAS[analysisType];
+    
     // API 요청
-    fetch('http://localhost:8080/api/analyze', {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({
-            prompt: prompt,
-            data: data,
-            max_length: 1000,
-            temperature: 0.7
-        })
+    postAnalysis({
+        prompt: prompt,
+        data: data,
+        max_length: 1000,
+        temperature: 0.2,  // 정형 분석은 낮은 온도로 요청하여 서버 응답 캐시를 활용
+        ...(schema ? { schema: schema } : {})
     })
     .then(response => {
         if (!response.ok) {
@@ -1974,8 +1973,12 @@ function runAnalysis(analysisType) {
         // 로딩 숨기기
         loadingIndicator.style.display = 'none';
         
-        // 분석 결과 표시
-        analysisOutput.innerHTML = formatAIResponse(result.response || '분석 결과가 없습니다.');
+        // 분석 결과 표시 (정형 결과가 있으면 표로, 없으면 텍스트로)
+        if (schema && result.result) {
+            analysisOutput.innerHTML = renderStructuredAnalysis(schema, result.result);
+        } else {
+            analysisOutput.innerHTML = formatAIResponse(result.response || '분석 결과가 없습니다.');
+        }
     })
     .catch(error => {
         console.error('분석 중 오류:', error);
@@ -1988,6 +1991,58 @@ function runAnalysis(analysisType) {
     });
 }
 
+// 분석 유형별로 서버에 요청할 JSON 스키마 이름 (ai/ai_structured.py의 SCHEMAS)
+const ANALYSIS_SCHEMAS = {
+    absent: 'at_risk_students',
+    pattern: 'weekday_patterns'
+};
+
+// 정형 분석 결과를 표로 변환
+function renderStructuredAnalysis(schema, result) {
+    const cell = value => `<td>${escapeHtml(String(value ?? ''))}</td>`;
+    const table = (headers, rows) => `
+        <table class="structured-analysis">
+            <thead><tr>${headers.map(header => `<th>${header}</th>`).join('')}</tr></thead>
+            <tbody>${rows.map(row => `<tr>${row.map(cell).join('')}</tr>`).join('')}</tbody>
+        </table>`;
+    let html = '';
+    
+    if (schema === 'at_risk_students') {
+        html += table(
+            ['이름', '결석', '지각', '출석률', '위험도', '사유'],
+            (result.students || []).map(s => [s.name, s.absent, s.late, `${s.attendance_rate}%`, s.risk, s.reason])
+        );
+    } else if (schema === 'weekday_patterns') {
+        html += table(
+            ['요일', '지각', '결석', '메모'],
+            (result.weekdays || []).map(d => [d.day, d.late, d.absent, d.note])
+        );
+        if ((result.patterns || []).length > 0) {
+            html += `<ul>${result.patterns.map(p => `<li>${escapeHtml(String(p))}</li>`).join('')}</ul>`;
+        }
+    }
+    
+    if (result.summary) {
+        html += `<p>${escapeHtml(String(result.summary))}</p>`;
+    }
+    return html;
+}
+
+// 분석 요청 전송 (AI 분석 모듈이 있으면 출결 데이터를 서버 스냅샷 참조로 보내 요청 크기를 일정하게 유지)
+function postAnalysis(body) {
+    const url = 'http://localhost:8080/api/analyze';
+    if (window.attendanceAnalyzer) {
+        return window.attendanceAnalyzer.postWithAttendance(url, body, 'data', 'students', 'attendance');
+    }
+    return fetch(url, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify(body)
+    });
+}
+
 // 사용자 정의 분석 실행
 function runCustomAnalysis(prompt) {
     // 기본 분석과 동일한 로직 사용, 프롬프트만 다름
@@ -2018,17 +2073,11 @@ function runCustomAnalysis(prompt) {
     };
     
     // API 요청
-    fetch('http://localhost:8080/api/analyze', {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({
-            prompt: prompt,
-            data: data,
-            max_length: 1000,
-            temperature: 0.7
-        })
+    postAnalysis({
+        prompt: prompt,
+        data: data,
+        max_length: 1000,
+        temperature: 0.7
     })
     .then(response => {
         if (!response.ok) {